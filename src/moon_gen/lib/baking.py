@@ -0,0 +1,190 @@
+'''
+BAKING.PY
+
+This submodule contains functions for baking textures from a surface :
+normal maps, hillshading (shaded relief) and an approximation of ambient
+occlusion, computed in tiles so that large surfaces can be baked, and
+written as images, e.g. for Gazebo or for display.
+'''
+
+import os
+import typing
+
+import numpy as np
+from numpy.typing import NDArray
+
+from moon_gen.lib.export import write_png
+from moon_gen.lib.tiling import iter_tiles
+from moon_gen.lib.utils import SurfaceType
+
+BAKED = ('normals', 'hillshade', 'occlusion')
+'''the names of the baked textures'''
+
+
+def _spacing(x: NDArray, y: NDArray) -> tuple[float, float]:
+    '''the (uniform) spacing of a grid'''
+    return (float(x[-1] - x[0]) / (len(x) - 1),
+            float(y[-1] - y[0]) / (len(y) - 1))
+
+
+def surface_normals(
+        z: NDArray[np.float64],
+        spacing: tuple[float, float]
+) -> NDArray[np.float32]:
+    '''the unit normals of a heightmap, as an (nx, ny, 3) array'''
+    dzdx, dzdy = np.gradient(np.asarray(z, np.float64), *spacing)
+    norm = np.sqrt(1 + dzdx**2 + dzdy**2)
+    return np.stack((-dzdx/norm, -dzdy/norm, 1/norm), axis=-1) \
+        .astype(np.float32)
+
+
+def hillshade(
+        normals: NDArray[np.float32],
+        azimuth: float = 315.,
+        altitude: float = 45.
+) -> NDArray[np.float32]:
+    '''
+    the shaded relief of a normal map, lit by a distant light at `azimuth`
+    degrees (clockwise from `+y`) and `altitude` degrees above the horizon
+    '''
+    az, alt = np.radians(azimuth), np.radians(altitude)
+    light = np.array([np.sin(az)*np.cos(alt), np.cos(az)*np.cos(alt),
+                      np.sin(alt)], np.float32)
+    return np.clip(normals @ light, 0, 1)
+
+
+def _shifted(z: NDArray[np.float64], di: int, dj: int) -> NDArray[np.float64]:
+    '''a heightmap, shifted by `di`, `dj` samples, clamped at its edges'''
+    i = np.clip(np.arange(z.shape[0]) + di, 0, z.shape[0] - 1)
+    j = np.clip(np.arange(z.shape[1]) + dj, 0, z.shape[1] - 1)
+    return z[i][:, j]
+
+
+def ambient_occlusion(
+        z: NDArray[np.float64],
+        spacing: tuple[float, float],
+        radius: int = 16,
+        directions: int = 8
+) -> NDArray[np.float32]:
+    '''
+    an approximation of the ambient occlusion of a heightmap (1 : open sky,
+    0 : fully occluded), from the horizon in a few `directions`, searched
+    at distances doubling up to `radius` samples
+    '''
+    z = np.asarray(z, np.float64)
+    steps = 2**np.arange(int(np.log2(max(radius, 1))) + 1)
+    visible = np.zeros(z.shape)
+    for angle in 2*np.pi*np.arange(directions)/directions:
+        horizon = np.zeros(z.shape)
+        for k in steps:
+            di, dj = int(round(k*np.cos(angle))), int(round(k*np.sin(angle)))
+            distance = np.hypot(di*spacing[0], dj*spacing[1])
+            np.maximum(horizon, (_shifted(z, di, dj) - z)/distance,
+                       out=horizon)
+        # the sine of the elevation of the horizon
+        visible += 1 - horizon/np.sqrt(1 + horizon**2)
+    return (visible/directions).astype(np.float32)
+
+
+def bake(
+        surface: SurfaceType,
+        radius: int = 16,
+        azimuth: float = 315.,
+        altitude: float = 45.,
+        tile: int = 1024,
+        out: dict[str, NDArray] | None = None
+) -> dict[str, NDArray]:
+    '''
+    bake the normals (an (nx, ny, 3) array), the hillshade and the ambient
+    occlusion of a surface (see `surface_normals`, `hillshade` and
+    `ambient_occlusion`), in a single tiled pass, so the heightmap and the
+    outputs can be memory-mapped arrays.
+    '''
+    x, y, z, *_ = surface
+    spacing = _spacing(x, y)
+
+    out = dict(out or {})
+    for name in BAKED:
+        if name not in out:
+            shape = z.shape + (3,) if name == 'normals' else z.shape
+            out[name] = np.empty(shape, np.float32)
+
+    for block, window, inner in iter_tiles(z.shape, tile, max(radius, 1)):
+        zw = np.asarray(z[window], np.float64)
+        normals = surface_normals(zw, spacing)
+        out['normals'][block] = normals[inner]
+        out['hillshade'][block] = hillshade(normals, azimuth, altitude)[inner]
+        out['occlusion'][block] = \
+            ambient_occlusion(zw, spacing, radius)[inner]
+    return out
+
+
+def _image_strips(
+        a: NDArray,
+        strip: int = 256
+) -> typing.Iterator[NDArray]:
+    '''
+    iterate over strips of the rows of an array's image, in which rows
+    follow `y` and columns follow `x` (mirrored), as for the DEMs
+    '''
+    for j in range(0, a.shape[1], strip):
+        yield np.swapaxes(np.asarray(a[::-1, j:j+strip]), 0, 1)
+
+
+def export_baked(
+        surface: SurfaceType,
+        filename: str | os.PathLike,
+        strip: int = 256,
+        **kwargs
+) -> dict[str, str]:
+    '''
+    bake the textures of a surface (see `bake`), and write them as 8-bit
+    PNG images next to `filename` (e.g. the DEM), in the orientation of the
+    DEM : `<name>_normals.png` (the normals, in the frame of the surface,
+    mapped from [-1, 1] to RGB), `<name>_hillshade.png` and
+    `<name>_occlusion.png`. Returns the names of the images.
+    '''
+    x, y, *_ = surface
+    baked = bake(surface, **kwargs)
+    root = os.path.splitext(filename)[0]
+    names = {}
+    for name, texture in baked.items():
+        names[name] = f'{root}_{name}.png'
+        scale = (texture + 1)/2 if name == 'normals' else texture
+        write_png(names[name],
+                  (np.round(s*255) for s in _image_strips(scale, strip)),
+                  len(x), len(y), depth=8,
+                  channels=3 if name == 'normals' else 1)
+    return names
+
+
+def cached_normals(
+        surface: SurfaceType,
+        filename: str | os.PathLike
+) -> NDArray[np.float32]:
+    '''
+    the normals of a surface loaded from `filename`, read from the cache
+    next to it (`<filename>.normals.npz`) if it is up to date, i.e. newer
+    than the file and computed for the same grid spacing, or computed and
+    cached otherwise, so repeated loads skip the computation
+    '''
+    x, y, z, *_ = surface
+    spacing = _spacing(x, y)
+    cache = f'{filename}.normals.npz'
+    try:
+        if os.path.getmtime(cache) >= os.path.getmtime(filename):
+            with np.load(cache) as cached:
+                normals = cached['normals']
+                if normals.shape == z.shape + (3,) and \
+                        np.array_equal(cached['spacing'], spacing):
+                    return normals
+    except (OSError, ValueError, KeyError):
+        pass
+
+    normals = surface_normals(z, spacing)
+    try:
+        with open(cache, 'wb') as file:
+            np.savez(file, normals=normals, spacing=spacing)
+    except OSError:
+        pass  # e.g. a read-only directory
+    return normals
@@ -0,0 +1,155 @@
+'''
+CATALOG.PY
+
+This submodule contains a compact, array-backed catalog of the craters
+placed on a surface, with a spatial index for range and nearest-neighbour
+queries.
+'''
+
+import os
+import typing
+
+import numpy as np
+from numpy.typing import NDArray
+
+from scipy.spatial import cKDTree
+
+CRATER_DTYPE = np.dtype([
+    ('x', np.float64),
+    ('y', np.float64),
+    ('radius', np.float64),
+    ('age', np.float64),
+])
+'''
+the record of a crater : its center, its radius and its age
+(larger is older, in arbitrary units)
+'''
+
+
+class CraterCatalog:
+    '''
+    an array-backed catalog of craters, stored as a structured numpy array
+    of `CRATER_DTYPE` records in order of appearance (oldest first).
+    Range and nearest-neighbour queries use a KD-tree over the crater
+    centers, which is built on the first query.
+    '''
+
+    def __init__(self, craters: NDArray | None = None) -> None:
+        if craters is None:
+            craters = np.zeros(0, CRATER_DTYPE)
+        self.craters = craters
+        self._tree: cKDTree | None = None
+
+    @classmethod
+    def from_arrays(
+            cls,
+            radii: NDArray[np.float64],
+            centers: tuple[NDArray[np.float64], NDArray[np.float64]],
+            ages: float | NDArray[np.float64] = 0.
+    ) -> 'CraterCatalog':
+        '''create a catalog from arrays of crater radii, centers and ages'''
+        craters = np.zeros(len(radii), CRATER_DTYPE)
+        craters['x'], craters['y'] = centers
+        craters['radius'] = radii
+        craters['age'] = ages
+        return cls(craters)
+
+    @classmethod
+    def concatenate(
+            cls,
+            catalogs: typing.Iterable['CraterCatalog']
+    ) -> 'CraterCatalog':
+        '''join several catalogs, in order'''
+        return cls(np.concatenate(
+            [c.craters for c in catalogs] + [np.zeros(0, CRATER_DTYPE)]
+        ))
+
+    def __len__(self) -> int:
+        return len(self.craters)
+
+    def __getitem__(self, index) -> 'CraterCatalog':
+        return CraterCatalog(np.atleast_1d(self.craters[index]))
+
+    @property
+    def x(self) -> NDArray[np.float64]:
+        return self.craters['x']
+
+    @property
+    def y(self) -> NDArray[np.float64]:
+        return self.craters['y']
+
+    @property
+    def radius(self) -> NDArray[np.float64]:
+        return self.craters['radius']
+
+    @property
+    def age(self) -> NDArray[np.float64]:
+        return self.craters['age']
+
+    @property
+    def tree(self) -> cKDTree:
+        '''the spatial index of the crater centers'''
+        if self._tree is None:
+            self._tree = cKDTree(np.stack((self.x, self.y), axis=-1))
+        return self._tree
+
+    def within(self, x: float, y: float, distance: float) -> 'CraterCatalog':
+        '''the craters whose center is within `distance` of `(x, y)`'''
+        if not len(self):
+            return self
+        index = self.tree.query_ball_point((x, y), distance)
+        return self[np.sort(np.asarray(index, np.intp))]
+
+    def covering(self, x: float, y: float,
+                 extent: float = 1.) -> 'CraterCatalog':
+        '''the craters which cover `(x, y)` within `extent` radii'''
+        if not len(self):
+            return self
+        near = self.within(x, y, extent*self.radius.max())
+        distance = np.hypot(near.x - x, near.y - y)
+        return near[distance < extent*near.radius]
+
+    def in_box(self, x_range: tuple[float, float],
+               y_range: tuple[float, float],
+               margin: float = 0.) -> 'CraterCatalog':
+        '''
+        the craters which intersect the box `x_range` x `y_range`, where
+        each crater extends over `margin` radii
+        '''
+        reach = margin*self.radius
+        return self[(self.x + reach >= x_range[0]) &
+                    (self.x - reach <= x_range[1]) &
+                    (self.y + reach >= y_range[0]) &
+                    (self.y - reach <= y_range[1])]
+
+    def nearest(self, xs: NDArray[np.float64], ys: NDArray[np.float64],
+                k: int = 1) -> tuple[NDArray[np.float64], NDArray[np.intp]]:
+        '''
+        the distances to, and indices of, the `k` craters nearest to each
+        of the points `(xs, ys)`
+        '''
+        return self.tree.query(np.stack(np.broadcast_arrays(xs, ys), axis=-1),
+                               k=k)
+
+    def count(self, x_range: tuple[float, float],
+              y_range: tuple[float, float],
+              d_min: float = 0., d_max: float = np.inf) -> int:
+        '''
+        the number of craters centered in the box `x_range` x `y_range`,
+        with a diameter between `d_min` and `d_max`
+        '''
+        d = 2*self.in_box(x_range, y_range).radius
+        return int(np.count_nonzero((d >= d_min) & (d < d_max)))
+
+    def save(self, filename: str | os.PathLike) -> None:
+        '''save the catalog as a `.npy` file'''
+        np.save(filename, self.craters)
+
+    @classmethod
+    def load(cls, filename: str | os.PathLike,
+             mmap: bool = True) -> 'CraterCatalog':
+        '''load a catalog from a `.npy` file, memory-mapped by default'''
+        craters = np.load(filename, mmap_mode='r' if mmap else None)
+        if craters.dtype != CRATER_DTYPE:
+            raise ValueError(f"not a crater catalog (dtype {craters.dtype})")
+        return cls(craters)
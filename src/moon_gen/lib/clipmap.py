@@ -0,0 +1,112 @@
+'''
+CLIPMAP.PY
+
+This submodule contains a geometry clipmap: nested grids of increasing
+spacing centred on a moving focus point (e.g. a rover), which are updated
+incrementally as the focus moves.
+'''
+
+import numpy as np
+from numpy.typing import NDArray
+
+from moon_gen.lib.procedural import ProceduralTerrain, height_at
+from moon_gen.lib.utils import SurfaceType
+
+
+def _exposed(old: int, new: int, n: int) -> range:
+    '''the indices covered by a window of `n` at `new`, but not at `old`'''
+    if new > old:
+        return range(max(old + n, new), new + n)
+    return range(new, min(old, new + n))
+
+
+class Clipmap:
+    '''
+    nested square grids of `size` x `size` samples of a procedural terrain,
+    where level `k` has a spacing of `spacing*2**k`, all centred on a focus
+    point.
+
+    Each level is stored as a toroidal buffer indexed by the global lattice
+    indices of its samples (modulo `size`), so when the focus moves, only
+    the newly exposed strips are evaluated: the cost of an update is
+    proportional to the distance moved, not to the area covered.
+    '''
+
+    def __init__(
+            self,
+            recipe: ProceduralTerrain,
+            levels: int = 4,
+            size: int = 129,
+            spacing: float = 0.1,
+            seed: int = 0
+    ) -> None:
+        '''
+        Args:
+        * recipe :  the procedural terrain
+        * levels :  the number of nested grids
+        * size :    the number of samples along each side of the grids
+        * spacing : the spacing of the finest grid
+        * seed :    the seed of the terrain
+        '''
+        self.recipe = recipe
+        self.size = size
+        self.spacing = spacing
+        self.seed = seed
+        self.buffers = np.zeros((levels, size, size))
+        self.origins: list[tuple[int, int] | None] = [None]*levels
+        self.generated = 0
+        '''the number of samples evaluated during the last update'''
+
+    @property
+    def levels(self) -> int:
+        return len(self.buffers)
+
+    def level_spacing(self, level: int) -> float:
+        '''the spacing of the samples of a level'''
+        return self.spacing * 2**level
+
+    def update(self, focus: tuple[float, float]) -> None:
+        '''move the focus, regenerating only the newly exposed samples'''
+        self.generated = 0
+        for level in range(self.levels):
+            # snap to every other sample, so the levels stay nested
+            snap = 2*self.level_spacing(level)
+            origin = tuple(2*int(np.round(f/snap)) - self.size//2
+                           for f in focus)
+            self._update_level(level, origin)  # type: ignore
+
+    def _update_level(self, level: int, origin: tuple[int, int]) -> None:
+        '''regenerate the samples of a level which have come into view'''
+        n, old = self.size, self.origins[level]
+        full = range(origin[0], origin[0] + n), range(origin[1], origin[1] + n)
+        if old is None:
+            strips = [full]
+        else:
+            strips = [(_exposed(old[0], origin[0], n), full[1]),
+                      (full[0], _exposed(old[1], origin[1], n))]
+            if len(strips[0][0]) == n:
+                strips = strips[:1]
+
+        s = self.level_spacing(level)
+        for gi, gj in strips:
+            if not (len(gi) and len(gj)):
+                continue
+            xs, ys = np.meshgrid(np.array(gi)*s, np.array(gj)*s,
+                                 indexing='ij')
+            self.buffers[level][np.ix_(np.array(gi) % n, np.array(gj) % n)] = \
+                height_at(xs, ys, self.recipe, self.seed)
+            self.generated += xs.size
+        self.origins[level] = origin
+
+    def level(self, level: int) -> SurfaceType:
+        '''the grid of a level, as a surface'''
+        origin = self.origins[level]
+        if origin is None:
+            raise ValueError("the clipmap has no focus yet")
+        s, n = self.level_spacing(level), self.size
+        x = (origin[0] + np.arange(n))*s
+        y = (origin[1] + np.arange(n))*s
+        z: NDArray[np.float64] = np.roll(self.buffers[level],
+                                         (-origin[0] % n, -origin[1] % n),
+                                         axis=(0, 1))
+        return x, y, z
@@ -5,16 +5,24 @@ This submodule contains functions useful for generating graters on
 a surface
 '''
 
+import functools
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 from numpy.typing import NDArray
 
 from scipy.ndimage import gaussian_filter
+from scipy.signal import oaconvolve
 
+from moon_gen.lib.catalog import CraterCatalog
+from moon_gen.lib.tiling import map_tiles
 from moon_gen.lib.distributions import (  # noqa: F401
     HDR, DDR,
     crater_density_fresh, crater_density_young,
     crater_density_mature, crater_density_old,
-    cash, cash_norm
+    PowerDistribution,
+    cash, cash_norm, cash_uniform, poisson_icdf
     )
 
 
@@ -42,16 +50,181 @@ def crater_2D(
     return np.minimum(z_bowl, z_ejecta)
 
 
+class CraterProfile:
+    '''
+    a normalized radial crater profile, tabulated once on the squared
+    normalized radius `s = (r/radius)**2`, and evaluated by interpolated
+    lookup. This avoids evaluating transcendental functions for every pixel
+    of every crater.
+
+    The bowl and the ejecta are tabulated separately (in crater radii),
+    since the bowl is relative to the average elevation inside the crater,
+    whereas the ejecta are relative to the local elevation.
+    The ejecta blanket is rescaled so that it vanishes at `extent` radii,
+    which gives every crater a finite footprint.
+    '''
+
+    def __init__(self, hdr: float = HDR, ddr: float = DDR,
+                 extent: float = 5., noise: float = 0.1,
+                 samples: int = 4097) -> None:
+        '''
+        Args:
+        * hdr :       the height-to-diameter ratio of the rim
+        * ddr :       the depth-to-diameter ratio of the bowl
+        * extent :    the radius of the footprint, in crater radii
+        * noise :     the relative roughness of the ejecta
+        * samples :   the number of samples in the tables
+        '''
+        self.hdr = hdr
+        self.ddr = ddr
+        self.extent = extent
+        self.noise = noise
+
+        s = np.linspace(0, extent**2, samples)
+        self._scale = (samples - 1) / extent**2
+
+        bowl = 2*(hdr-ddr) + 2*ddr*s
+        ejecta = 2**(1/np.maximum(s, 1))
+        ejecta_end = 2**(1/extent**2)
+        ejecta = 2*hdr*(ejecta - ejecta_end)/(2 - ejecta_end)
+
+        self._bowl = self._table(bowl)
+        self._ejecta = self._table(ejecta)
+
+    @staticmethod
+    def _table(values: NDArray[np.float64]) -> NDArray[np.float64]:
+        '''stack values and their forward differences, for lookup'''
+        table = np.stack((values, np.append(np.diff(values), 0.)))
+        table.flags.writeable = False
+        return table
+
+    def _lookup(self, table: NDArray[np.float64],
+                s: NDArray[np.float64]) -> NDArray[np.float64]:
+        '''linear interpolation in a table, clamped at the footprint'''
+        i = np.minimum(s*self._scale, table.shape[1] - 1)
+        k = i.astype(np.intp)
+        return table[0, k] + (i - k)*table[1, k]
+
+    def bowl(self, s: NDArray[np.float64]) -> NDArray[np.float64]:
+        '''the bowl elevation (in radii) at squared normalized radius `s`'''
+        return self._lookup(self._bowl, s)
+
+    def ejecta(self, s: NDArray[np.float64]) -> NDArray[np.float64]:
+        '''the ejecta height (in radii) at squared normalized radius `s`'''
+        return self._lookup(self._ejecta, s)
+
+    def brightness(self, s: NDArray[np.float64]) -> NDArray[np.float64]:
+        '''
+        the albedo of fresh ejecta at squared normalized radius `s` : 1 up to
+        the rim, fading with the thickness of the ejecta blanket
+        '''
+        return self._lookup(self._ejecta, s) / (2*self.hdr)
+
+
+def ejecta_brightness(
+        age: float | NDArray[np.float64],
+        timescale: float = .5
+) -> float | NDArray[np.float64]:
+    '''
+    the albedo of ejecta which have weathered for `age` (in the units of
+    `waste_gaussian`'s duration), relative to fresh ejecta
+    '''
+    return np.exp(-np.asarray(age)/timescale)
+
+
+@functools.lru_cache
+def crater_profile(hdr: float = HDR, ddr: float = DDR,
+                   extent: float = 5., noise: float = 0.1) -> CraterProfile:
+    '''the tabulated profile of a crater family, computed only once'''
+    return CraterProfile(hdr, ddr, extent, noise)
+
+
+def crater_footprint(
+        x: NDArray[np.float64],
+        y: NDArray[np.float64],
+        radius: float,
+        center: tuple[float, float],
+        extent: float
+) -> tuple[slice, slice]:
+    '''
+    the index window of the (ascending) `x` and `y` coordinates
+    which is affected by a crater
+    '''
+    reach = extent*radius
+    i0, i1 = np.searchsorted(x, (center[0]-reach, center[0]+reach))
+    j0, j1 = np.searchsorted(y, (center[1]-reach, center[1]+reach))
+    return slice(int(i0), int(i1)), slice(int(j0), int(j1))
+
+
+def stamp_crater(
+        x: NDArray[np.float64],
+        y: NDArray[np.float64],
+        z: NDArray[np.float64],
+        radius: float,
+        center: tuple[float, float],
+        profile: CraterProfile | None = None,
+        albedo: NDArray[np.float64] | None = None,
+        brightness: float = 1.,
+        rng: np.random.Generator | None = None
+) -> NDArray[np.float64]:
+    '''
+    stamp a crater into the given `z` surface, in place, using a tabulated
+    crater profile. Only the footprint of the crater is evaluated.
+
+    If an `albedo` map is given, the ejecta are painted into it in the same
+    pass, with the given `brightness` (see `ejecta_brightness`), wherever
+    they are brighter than the ground.
+    The roughness of the ejecta is drawn from `rng` (by default, from the
+    global random state).
+    '''
+    if profile is None:
+        profile = crater_profile()
+
+    sx, sy = crater_footprint(x, y, radius, center, profile.extent)
+    zw = z[sx, sy]
+    if zw.size == 0:
+        return z
+
+    # squared normalized radius : no square roots needed
+    s = ((x[sx]-center[0])**2).reshape((-1, 1)) + \
+        ((y[sy]-center[1])**2).reshape((1, -1))
+    s *= 1/radius**2
+
+    inside = s < 1
+    avg_elevation = zw[inside].mean() if inside.any() else zw.mean()
+    z_bowl = avg_elevation + radius*profile.bowl(s)
+
+    z_ejecta = radius*profile.ejecta(s)
+    if profile.noise:
+        normal = np.random.normal if rng is None else rng.normal
+        z_ejecta *= 1 + normal(scale=profile.noise, size=s.shape)
+    z_ejecta += zw
+
+    np.minimum(z_bowl, z_ejecta, out=zw)
+
+    if albedo is not None:
+        aw = albedo[sx, sy]
+        np.maximum(aw, brightness*profile.brightness(s), out=aw)
+    return z
+
+
 def make_crater(
         x: NDArray[np.float64],
         y: NDArray[np.float64],
         z: NDArray[np.float64],
         radius: float,
-        center: tuple[float, float]
+        center: tuple[float, float],
+        profile: CraterProfile | None = None
 ) -> NDArray[np.float64]:
     '''
     make a crater in the given `z` surface.
+
+    If a tabulated `profile` is given, the crater is evaluated by lookup
+    over its footprint only (see `stamp_crater`).
     '''
+    if profile is not None:
+        return stamp_crater(x, y, z.copy(), radius, center, profile)
+
     # center r
     r = np.sqrt((x-center[0]).reshape((len(x), 1))**2 +
                 (y-center[1]).reshape((1, len(y)))**2)
@@ -60,55 +233,539 @@ def make_crater(
     return z
 
 
+def _template_radii(
+        radius: float,
+        dx: float,
+        dy: float,
+        extent: float
+) -> NDArray[np.float64]:
+    '''
+    the squared normalized radii of a grid of spacing `dx`, `dy` centered
+    on a crater, covering its footprint
+    '''
+    hx, hy = int(extent*radius/dx), int(extent*radius/dy)
+    kx, ky = np.arange(-hx, hx+1), np.arange(-hy, hy+1)
+    s = ((kx*dx)**2).reshape((-1, 1)) + ((ky*dy)**2).reshape((1, -1))
+    s *= 1/radius**2
+    return s
+
+
+def crater_template(
+        radius: float,
+        dx: float,
+        dy: float,
+        profile: CraterProfile
+) -> NDArray[np.float64]:
+    '''
+    the elevation change caused by a crater on flat ground, sampled on
+    a grid of spacing `dx`, `dy` centered on the crater
+    '''
+    s = _template_radii(radius, dx, dy, profile.extent)
+    return radius*np.minimum(profile.bowl(s), profile.ejecta(s))
+
+
+def _splat(
+        shape: tuple[int, int],
+        origin: tuple[float, float],
+        spacing: tuple[float, float],
+        centers: tuple[NDArray[np.float64], NDArray[np.float64]],
+        weights: NDArray[np.float64]
+) -> NDArray[np.float64]:
+    '''accumulate weighted impulses into a grid, with bilinear weights'''
+    px = (centers[0] - origin[0]) / spacing[0]
+    py = (centers[1] - origin[1]) / spacing[1]
+    i, j = np.floor(px).astype(np.intp), np.floor(py).astype(np.intp)
+    wx, wy = px - i, py - j
+
+    field = np.zeros(shape[0]*shape[1])
+    for di, dj, w in ((0, 0, (1-wx)*(1-wy)), (1, 0, wx*(1-wy)),
+                      (0, 1, (1-wx)*wy), (1, 1, wx*wy)):
+        inside = (i+di >= 0) & (i+di < shape[0]) & \
+            (j+dj >= 0) & (j+dj < shape[1])
+        field += np.bincount(
+            ((i+di)*shape[1] + (j+dj))[inside],
+            (w*weights)[inside],
+            minlength=len(field)
+        )
+    return field.reshape(shape)
+
+
+def splat_craters(
+        x: NDArray[np.float64],
+        y: NDArray[np.float64],
+        z: NDArray[np.float64],
+        radii: NDArray[np.float64],
+        centers: tuple[NDArray[np.float64], NDArray[np.float64]],
+        profile: CraterProfile | None = None,
+        bins_per_octave: int = 4,
+        albedo: NDArray[np.float64] | None = None,
+        brightness: float | NDArray[np.float64] = 1.
+) -> NDArray[np.float64]:
+    '''
+    add many small craters to the given (uniform) `z` surface, in place.
+
+    The craters are binned by radius. The impulses of each bin are
+    accumulated into a field, which is convolved once with the crater
+    template of that bin, so thousands of craters cost a few convolutions.
+    The craters are superposed rather than stamped, which is a good
+    approximation for craters only a few pixels wide.
+    If an `albedo` map is given, their ejecta are painted into it likewise
+    (see `stamp_crater`).
+    '''
+    if profile is None:
+        profile = crater_profile()
+    if len(radii) == 0:
+        return z
+
+    dx = (x[-1] - x[0]) / (len(x) - 1)
+    dy = (y[-1] - y[0]) / (len(y) - 1)
+    brightness = np.broadcast_to(brightness, np.shape(radii))
+
+    r_min = np.min(radii)
+    bins = np.floor(np.log2(radii/r_min)*bins_per_octave)
+    for b in np.unique(bins):
+        in_bin = bins == b
+        radius = np.exp(np.log(radii[in_bin]).mean())
+        template = crater_template(radius, dx, dy, profile)
+
+        # pad the field so that craters centered off the grid are included
+        hx, hy = template.shape[0]//2, template.shape[1]//2
+        splat = functools.partial(
+            _splat,
+            (len(x) + 2*hx, len(y) + 2*hy),
+            (x[0] - hx*dx, y[0] - hy*dy),
+            (dx, dy),
+            (centers[0][in_bin], centers[1][in_bin]),
+        )
+        z += oaconvolve(splat(radii[in_bin]/radius), template, mode='valid')
+
+        if albedo is not None:
+            rays = profile.brightness(
+                _template_radii(radius, dx, dy, profile.extent))
+            # overlapping ejecta saturate, rather than add up
+            painted = oaconvolve(splat(brightness[in_bin]), rays, mode='valid')
+            np.minimum(painted, brightness[in_bin].max(), out=painted)
+            np.maximum(albedo, painted, out=albedo)
+
+    return z
+
+
+def independent_batches(
+        x: NDArray[np.float64],
+        y: NDArray[np.float64],
+        radii: NDArray[np.float64],
+        centers: tuple[NDArray[np.float64], NDArray[np.float64]],
+        extent: float = 5.,
+        bucket: int = 16
+) -> list[NDArray[np.intp]]:
+    '''
+    partition a batch of craters into successive groups of craters whose
+    footprints do not overlap, so that each group can be stamped
+    concurrently.
+
+    Each crater goes into the group following the last group holding an
+    earlier crater that may overlap it, so overlapping craters keep their
+    order. Overlaps are tested conservatively, on buckets of `bucket` grid
+    cells.
+    '''
+    reach = extent*np.asarray(radii)
+    i0 = np.searchsorted(x, centers[0] - reach) // bucket
+    i1 = (np.searchsorted(x, centers[0] + reach) - 1) // bucket + 1
+    j0 = np.searchsorted(y, centers[1] - reach) // bucket
+    j1 = (np.searchsorted(y, centers[1] + reach) - 1) // bucket + 1
+
+    # the last group touching each bucket
+    level_map = np.zeros((len(x)//bucket + 1, len(y)//bucket + 1), np.intp)
+    levels = np.zeros(len(reach), np.intp)
+    for k in np.flatnonzero((i1 > i0) & (j1 > j0)):
+        window = level_map[i0[k]:i1[k], j0[k]:j1[k]]
+        levels[k] = window.max() + 1
+        window[...] = levels[k]
+
+    order = np.argsort(levels, kind='stable')
+    return np.split(order, np.flatnonzero(np.diff(levels[order])) + 1)
+
+
+def stamp_craters(
+        x: NDArray[np.float64],
+        y: NDArray[np.float64],
+        z: NDArray[np.float64],
+        radii: NDArray[np.float64],
+        centers: tuple[NDArray[np.float64], NDArray[np.float64]],
+        profile: CraterProfile | None = None,
+        workers: int | None = None,
+        albedo: NDArray[np.float64] | None = None,
+        brightness: float | NDArray[np.float64] = 1.,
+        rng: np.random.Generator | None = None
+) -> NDArray[np.float64]:
+    '''
+    stamp a batch of craters in the given `z` surface, in place, in order,
+    painting their ejecta into the `albedo` map, if given, with the given
+    `brightness` (per crater, or for all of them).
+
+    If `workers` is given, the craters are partitioned into groups of
+    non-overlapping craters (see `independent_batches`), and the craters
+    of each group are stamped concurrently on a thread pool.
+    If `rng` is given, each crater draws its ejecta noise from its own
+    generator, seeded from it, so the result doesn't depend on the order
+    in which the threads stamp the craters.
+    '''
+    if profile is None:
+        profile = crater_profile()
+    brightness = np.broadcast_to(brightness, np.shape(radii))
+    seeds = None if rng is None or not profile.noise else \
+        rng.integers(2**63, size=len(radii))
+
+    def stamp(k: int):
+        stamp_crater(x, y, z, radii[k], (centers[0][k], centers[1][k]),
+                     profile, albedo, brightness[k],
+                     None if seeds is None else
+                     np.random.default_rng(seeds[k]))
+
+    if workers is None or workers < 2:
+        for k in range(len(radii)):
+            stamp(k)
+        return z
+
+    with ThreadPoolExecutor(workers) as pool:
+        for batch in independent_batches(x, y, radii, centers,
+                                         profile.extent):
+            for _ in pool.map(stamp, batch):
+                pass
+    return z
+
+
+def make_craters(
+        x: NDArray[np.float64],
+        y: NDArray[np.float64],
+        z: NDArray[np.float64],
+        radii: NDArray[np.float64],
+        centers: tuple[NDArray[np.float64], NDArray[np.float64]],
+        profile: CraterProfile | None = None,
+        splat_below: float = 4.,
+        workers: int | None = None,
+        albedo: NDArray[np.float64] | None = None,
+        brightness: float | NDArray[np.float64] = 1.,
+        rng: np.random.Generator | None = None
+) -> NDArray[np.float64]:
+    '''
+    make a batch of craters in the given `z` surface, in place.
+
+    Craters with a radius larger than `splat_below` grid cells are stamped
+    exactly, in order, optionally on `workers` threads (see
+    `stamp_craters`). The smaller ones are added afterwards by convolution
+    (see `splat_craters`).
+    If an `albedo` map is given, the ejecta of the craters are painted into
+    it in the same pass, with the given `brightness` (see
+    `ejecta_brightness`).
+    The ejecta noise of the stamped craters is drawn from `rng` (see
+    `stamp_craters`).
+    '''
+    if profile is None:
+        profile = crater_profile()
+
+    radii = np.asarray(radii)
+    cxs, cys = np.asarray(centers[0]), np.asarray(centers[1])
+    cell = min(np.ptp(x)/(len(x)-1), np.ptp(y)/(len(y)-1))
+    small = radii < splat_below*cell
+    brightness = np.broadcast_to(brightness, radii.shape)
+
+    stamp_craters(x, y, z, radii[~small], (cxs[~small], cys[~small]),
+                  profile, workers, albedo, brightness[~small], rng)
+
+    return splat_craters(x, y, z, radii[small], (cxs[small], cys[small]),
+                         profile, albedo=albedo,
+                         brightness=brightness[small])
+
+
 def waste_gaussian(
     z: NDArray,
     resolution: float,
-    duration: float = 1
+    duration: float = 1,
+    tile: int | None = None
 ) -> NDArray:
-    '''simulate mass wasting between impacts, using gaussian blur.'''
-    gz = gaussian_filter(z, sigma=duration/resolution)
+    '''
+    simulate mass wasting between impacts, using gaussian blur.
+    If `tile` is given, the blur is applied in tiles of that size (see
+    `map_tiles`), so `z` can be a memory-mapped array.
+    '''
+    sigma = duration/resolution
+    if tile is not None:
+        halo = int(4*sigma + .5)  # the radius of the gaussian kernel
+        return map_tiles(functools.partial(gaussian_filter, sigma=sigma),
+                         z, halo, tile)
+    gz = gaussian_filter(z, sigma=sigma)
     return gz
     # w = min(1, max(0, duration+.5))
     # return w*gz + (1-w)*z  # type: ignore
 
 
-def make_procedural_craters(
-        x: NDArray[np.float64],
-        y: NDArray[np.float64],
-        z: NDArray[np.float64],
-        thresh: float = .999
+def erode_thermal(
+    z: NDArray,
+    resolution: float,
+    angle: float = 35.,
+    rate: float = .5,
+    iterations: int = 10000,
+    tolerance: float = 1e-3
+) -> NDArray:
+    '''
+    simulate mass wasting as thermal (talus) erosion : material slides to
+    the lower of the 4 neighbours of a cell only where the slope exceeds
+    the angle of repose (in degrees), so flat terrain is left untouched.
+    Mass is conserved, and no material leaves the grid.
+
+    Each sweep only visits the cells which moved material in the previous
+    one, and their neighbours, so it gets cheaper as the terrain settles.
+    The erosion stops once no cell is steeper than the angle of repose by
+    more than `tolerance` (as a fraction of the height difference at the
+    angle of repose), or after `iterations` sweeps.
+    '''
+    nx, ny = np.shape(z)
+    # a wall around the grid, so that no material leaves it
+    walled = np.full((nx + 2, ny + 2), np.inf)
+    walled[1:-1, 1:-1] = z
+    flat = walled.ravel()
+    talus = np.tan(np.radians(angle))*resolution
+    offsets = np.array([-(ny + 2), ny + 2, -1, 1])[:, None]
+
+    active = np.flatnonzero(np.isfinite(flat))
+    # the last position of each cell in the list of candidates, to find
+    # the distinct ones without sorting
+    slot = np.empty(flat.size, np.intp)
+    for _ in range(iterations):
+        neighbours = active + offsets
+        excess = flat[active] - flat[neighbours]
+        excess -= talus
+        np.maximum(excess, 0, out=excess)
+        total = excess[0] + excess[1] + excess[2] + excess[3]
+
+        moving = total > tolerance*talus
+        if not moving.any():
+            break
+        active, neighbours = active[moving], neighbours[:, moving]
+        excess, total = excess[:, moving], total[moving]
+
+        # move part of the largest excess, shared in proportion to each
+        amount = rate/2*np.maximum(np.maximum(excess[0], excess[1]),
+                                   np.maximum(excess[2], excess[3]))
+        flat[active] -= amount
+        np.add.at(flat, neighbours.ravel(), (excess*(amount/total)).ravel())
+
+        # the cells which moved may still be too steep, and their
+        # neighbours may have become so
+        candidates = np.concatenate((active, neighbours.ravel()))
+        candidates = candidates[np.isfinite(flat[candidates])]
+        order = np.arange(len(candidates))
+        slot[candidates] = order
+        active = candidates[slot[candidates] == order]
+    return walled[1:-1, 1:-1].copy()
+
+
+def crater_size_classes(
+        distribution: PowerDistribution,
+        d_max: float | None = None
+) -> list[tuple[float, float, float]]:
+    '''
+    split the diameters of a crater distribution into dyadic size classes,
+    returned as `(d_lo, d_hi, cell)`, where `cell` is the size of the
+    lattice cells in which the craters of that class are placed.
+    The cells are sized such that they hold about one crater each.
+
+    By default, craters larger than the distribution's `d_max`, or rarer
+    than one per square kilometre, are ignored.
+    '''
+    if d_max is None:
+        d_max = min(distribution.d_max, distribution.icdf(1e-6))
+
+    classes = []
+    d_lo = distribution.d_min
+    while d_lo < d_max:
+        d_hi = min(2*d_lo, d_max)
+        density = distribution.truncated(d_lo, d_hi).density
+        classes.append((d_lo, d_hi, max(d_hi, density**-0.5)))
+        d_lo = d_hi
+    return classes
+
+
+def lattice_craters(
+        distribution: PowerDistribution,
+        d_lo: float,
+        d_hi: float,
+        cell: float,
+        ci: NDArray[np.int64],
+        cj: NDArray[np.int64],
+        seed: int = 0
+) -> tuple[NDArray[np.float64], NDArray[np.float64],
+           NDArray[np.float64], NDArray[np.float64]]:
+    '''
+    the craters with diameters between `d_lo` and `d_hi` placed in the
+    lattice cells `(ci, cj)` of size `cell`. Each cell deterministically
+    yields its craters from its hash, regardless of the other cells queried.
+
+    Returns the crater centers, diameters and ages (in [0 - 1)).
+    '''
+    distribution = distribution.truncated(d_lo, d_hi)
+    key = cash(np.asarray(ci, np.int64), np.asarray(cj, np.int64), seed)
+
+    # the number of craters in each cell, and their index within the cell
+    counts = poisson_icdf(distribution.density*cell**2, cash_uniform(key, 0))
+    owner = np.repeat(np.arange(len(key)), counts)
+    m = np.arange(len(owner)) - np.repeat(np.cumsum(counts)-counts, counts)
+    key = key[owner]
+
+    cx = (ci[owner] + cash_uniform(key, m, 1)) * cell
+    cy = (cj[owner] + cash_uniform(key, m, 2)) * cell
+    d = distribution.diameter(cash_uniform(key, m, 3))
+    age = cash_uniform(key, m, 4)
+    return cx, cy, d, age
+
+
+def cell_key(ci: NDArray[np.int64],
+             cj: NDArray[np.int64]) -> NDArray[np.int64]:
+    '''
+    a unique integer key for each cell of a lattice, such that the keys of
+    neighbouring cells can be found by adding the keys of their offsets
+    '''
+    return (ci << 32) + cj
+
+
+def cell_index(key: NDArray[np.int64]) -> tuple[NDArray[np.int64],
+                                                NDArray[np.int64]]:
+    '''the lattice cell of each key (see `cell_key`)'''
+    cj = ((key + 2**31) & 0xffffffff) - 2**31
+    return (key - cj) >> 32, cj
+
+
+def _procedural_craters(
+        distribution: PowerDistribution,
+        d_max: float | None,
+        seed: int,
+        extent: float,
+        cells: Callable[[float, float], tuple[NDArray[np.int64],
+                                              NDArray[np.int64]]]
 ) -> NDArray[np.float64]:
-    # create a grid based on the millimeter point location
-    xx, yy = np.meshgrid(x, y, indexing='ij')
-    chaos_grid = cash(
-        (1000*xx).astype(np.int64),
-        (1000*yy).astype(np.int64),
-        1234567890
-    )
+    '''
+    the craters of all size classes in the lattice cells returned by
+    `cells(cell_size, reach)`, stacked as (centers, diameters, ages),
+    oldest first
+    '''
+    craters = []
+    for k, (d_lo, d_hi, cell) in enumerate(
+            crater_size_classes(distribution, d_max)):
+        ci, cj = cells(cell, extent*d_hi/2)
+        craters.append(np.stack(lattice_craters(
+            distribution, d_lo, d_hi, cell, ci, cj, seed + 1000003*k
+        )))
 
-    # sanity check
-    assert z.shape == chaos_grid.shape
+    if not craters:
+        return np.zeros((4, 0))
+    craters = np.concatenate(craters, axis=1)
+    return craters[:, np.argsort(-craters[3], kind='stable')]
 
-    # the areas greater than thresh will have a crater center.
-    # NOTE: `np.nonzero returns row, column index`
-    row_idx, col_idx = np.nonzero(chaos_grid > thresh*(2**63))
 
-    # the age of the crater will be calculated from the chaos value
-    ages = chaos_grid[row_idx, col_idx].argsort()
+def procedural_craters(
+        x_range: tuple[float, float],
+        y_range: tuple[float, float],
+        distribution: PowerDistribution = crater_density_young,
+        d_max: float | None = None,
+        seed: int = 0,
+        extent: float = 5.
+) -> tuple[NDArray[np.float64], NDArray[np.float64],
+           NDArray[np.float64], NDArray[np.float64]]:
+    '''
+    enumerate the procedurally placed craters whose footprint (of `extent`
+    radii) intersects the region `x_range` x `y_range`.
+
+    The craters of each size class are placed in hashed lattice cells (see
+    `lattice_craters`), so the cost is proportional to the number of
+    craters, and the population does not depend on any grid resolution.
+
+    Returns the crater centers, diameters and ages, oldest first.
+    '''
+    (x0, x1), (y0, y1) = x_range, y_range
+
+    def cells(cell: float, reach: float):
+        ci, cj = np.meshgrid(
+            np.arange(np.floor((x0-reach)/cell), np.floor((x1+reach)/cell)+1),
+            np.arange(np.floor((y0-reach)/cell), np.floor((y1+reach)/cell)+1),
+            indexing='ij'
+        )
+        return ci.ravel().astype(np.int64), cj.ravel().astype(np.int64)
 
-    cxs, cys = x[row_idx[ages]], y[col_idx[ages]]
-    radii = crater_density_young.diameter(
-        cash_norm(
-            cxs.astype(np.int64),
-            cys.astype(np.int64)
+    cx, cy, d, age = _procedural_craters(distribution, d_max, seed, extent,
+                                         cells)
+    reach = extent*d/2
+    keep = (cx + reach >= x0) & (cx - reach <= x1) & \
+        (cy + reach >= y0) & (cy - reach <= y1)
+    return cx[keep], cy[keep], d[keep], age[keep]
+
+
+def procedural_craters_near(
+        xs: NDArray[np.float64],
+        ys: NDArray[np.float64],
+        distribution: PowerDistribution = crater_density_young,
+        d_max: float | None = None,
+        seed: int = 0,
+        extent: float = 5.
+) -> tuple[NDArray[np.float64], NDArray[np.float64],
+           NDArray[np.float64], NDArray[np.float64]]:
+    '''
+    enumerate the procedurally placed craters (see `procedural_craters`)
+    whose footprint may cover any of the scattered points `(xs, ys)`.
+    Only the lattice cells around the points are visited, so sparse
+    points far apart do not require placing the craters in between.
+
+    Returns the crater centers, diameters and ages, oldest first.
+    '''
+    def cells(cell: float, reach: float):
+        occupied = np.unique(cell_key(
+            np.floor(np.ravel(xs)/cell).astype(np.int64),
+            np.floor(np.ravel(ys)/cell).astype(np.int64)
+        ))
+        m = int(np.ceil(reach/cell))
+        di, dj = np.meshgrid(np.arange(-m, m+1), np.arange(-m, m+1))
+        near = np.unique(
+            occupied.reshape((-1, 1)) + cell_key(di.ravel(), dj.ravel())
         )
+        return cell_index(near)
+
+    cx, cy, d, age = _procedural_craters(distribution, d_max, seed, extent,
+                                         cells)
+    return cx, cy, d, age
+
+
+def make_procedural_craters(
+        x: NDArray[np.float64],
+        y: NDArray[np.float64],
+        z: NDArray[np.float64],
+        distribution: PowerDistribution = crater_density_young,
+        seed: int = 1234567890,
+        d_max: float | None = None,
+        profile: CraterProfile | None = None,
+        return_catalog: bool = False
+) -> NDArray[np.float64] | tuple[NDArray[np.float64], CraterCatalog]:
+    '''
+    make procedurally placed craters (see `procedural_craters`) in the
+    given `z` surface.
+
+    If `return_catalog` is set, the catalog of the craters is also returned.
+    '''
+    if profile is None:
+        profile = crater_profile()
+
+    cxs, cys, diameters, ages = procedural_craters(
+        (np.min(x), np.max(x)), (np.min(y), np.max(y)),
+        distribution, d_max, seed, profile.extent
     )
 
     # apply craters in order of appearance : oldest first
-    print(f"generating {len(radii)} craters")
-    for radius, cx, cy in zip(radii, cxs, cys):
-        z = make_crater(x, y, z, radius, (cx, cy))
+    print(f"generating {len(diameters)} craters")
+    z = z.copy()
+    for d, cx, cy in zip(diameters, cxs, cys):
+        stamp_crater(x, y, z, d/2, (cx, cy), profile)
 
+    if return_catalog:
+        return z, CraterCatalog.from_arrays(diameters/2, (cxs, cys), ages)
     return z
 
 
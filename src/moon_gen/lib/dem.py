@@ -0,0 +1,111 @@
+'''
+DEM.PY
+
+This submodule contains a base-terrain source backed by a real digital
+elevation model, which reads only the window of the DEM covering the
+requested grid.
+'''
+
+import os
+
+import numpy as np
+from numpy.typing import NDArray
+
+from moon_gen.lib.loaders import load_image, read_metadata
+
+
+def _linear_indices(
+        grid: NDArray[np.float64],
+        start: float,
+        spacing: float,
+        n: int
+) -> tuple[NDArray[np.intp], NDArray[np.float64]]:
+    '''
+    the index of the sample below each grid coordinate, and the weight of
+    the sample above it (clamped to the edges of the DEM)
+    '''
+    f = np.clip((grid - start)/spacing, 0, n - 1)
+    i = np.minimum(np.floor(f).astype(np.intp), n - 2)
+    return i, f - i
+
+
+class DEMSource:
+    '''
+    a base terrain taken from a (large) DEM. The DEM is kept memory-mapped
+    where possible, and only the window covering a requested grid is read
+    and bilinearly resampled onto it, so the full DEM is never loaded.
+    Grids which extend past the DEM are clamped to its edges.
+    '''
+
+    def __init__(
+            self,
+            x: NDArray[np.float64],
+            y: NDArray[np.float64],
+            z: NDArray,
+            offset: float = 0.,
+            scale: float = 1.
+    ) -> None:
+        '''
+        Args:
+        * x, y :   the coordinates of the DEM's samples (uniformly spaced)
+        * z :      the samples of the DEM (e.g. a memory-mapped array)
+        * offset : the elevation of a sample of 0
+        * scale :  the elevation step of a sample of 1
+        '''
+        self.start = float(x[0]), float(y[0])
+        self.spacing = (float(x[-1] - x[0]) / (len(x) - 1),
+                        float(y[-1] - y[0]) / (len(y) - 1))
+        self.z = z
+        self.offset = offset
+        self.scale = scale
+
+    @classmethod
+    def open(
+            cls,
+            filename: str | os.PathLike,
+            extents: dict | None = None
+    ) -> 'DEMSource':
+        '''
+        open a DEM file (see `load_dem`). Raw, numpy and TIFF files are
+        memory-mapped; PNG files have to be decoded, so are best avoided
+        for large DEMs.
+        '''
+        metadata = read_metadata(filename)
+        metadata.update(extents or {})
+        image, full_scale = load_image(filename)
+        z = image.T[::-1]
+
+        offset, scale = 0., 1.
+        if full_scale is not None:
+            z_min, z_max = metadata.get('z', (0., 1.))
+            offset, scale = z_min, (z_max - z_min)/full_scale
+        x = np.linspace(*metadata.get('x', (0, z.shape[0] - 1)), z.shape[0])
+        y = np.linspace(*metadata.get('y', (0, z.shape[1] - 1)), z.shape[1])
+        return cls(x, y, z, offset, scale)
+
+    @property
+    def extents(self) -> tuple[tuple[float, float], tuple[float, float]]:
+        '''the x and y ranges covered by the DEM'''
+        return tuple(  # type: ignore
+            (s, s + d*(n - 1))
+            for s, d, n in zip(self.start, self.spacing, self.z.shape)
+        )
+
+    def __call__(
+            self,
+            x: NDArray[np.float64],
+            y: NDArray[np.float64]
+    ) -> NDArray[np.float64]:
+        '''the elevation of the DEM, resampled on the grid spanned by x, y'''
+        i, tx = _linear_indices(np.asarray(x), self.start[0],
+                                self.spacing[0], self.z.shape[0])
+        j, ty = _linear_indices(np.asarray(y), self.start[1],
+                                self.spacing[1], self.z.shape[1])
+
+        # read the window once, and interpolate along each axis in turn
+        i0, j0 = i.min(), j.min()
+        window = np.asarray(self.z[i0:i.max()+2, j0:j.max()+2], np.float64)
+        i, j = i - i0, j - j0
+        rows = window[i]*(1 - tx[:, None]) + window[i+1]*tx[:, None]
+        z = rows[:, j]*(1 - ty) + rows[:, j+1]*ty
+        return self.offset + self.scale*z
@@ -0,0 +1,99 @@
+'''
+DERIVED.PY
+
+This submodule contains functions for deriving terrain products, such as
+slope, curvature, roughness and hazard maps, from a surface, e.g. for rover
+path planning.
+'''
+
+import numpy as np
+from numpy.typing import NDArray
+
+from scipy.ndimage import correlate1d
+
+from moon_gen.lib.tiling import iter_tiles
+from moon_gen.lib.utils import SurfaceType
+
+PRODUCTS = ('slope', 'curvature', 'roughness', 'hazard')
+'''the names of the derived products'''
+
+
+def _box(z: NDArray[np.float64], size: int) -> NDArray[np.float64]:
+    '''
+    the mean over a `size` x `size` window (unlike `uniform_filter`, the
+    result does not depend on where the array starts, so tiles match)
+    '''
+    weights = np.full(size, 1/size)
+    return correlate1d(correlate1d(z, weights, axis=0), weights, axis=1)
+
+
+def _products(
+        z: NDArray[np.float64],
+        spacing: tuple[float, float],
+        slope_window: int,
+        roughness_window: int
+) -> dict[str, NDArray]:
+    '''the slope, curvature and roughness of a (tile of a) heightmap'''
+    smooth = _box(z, slope_window) if slope_window > 1 else z
+
+    dzdx, dzdy = np.gradient(smooth, *spacing)
+    curvature = correlate1d(smooth, [1., -2., 1.], axis=0)/spacing[0]**2 + \
+        correlate1d(smooth, [1., -2., 1.], axis=1)/spacing[1]**2
+
+    # RMS deviation from the local mean
+    residual = z - _box(z, roughness_window)
+    roughness = np.sqrt(_box(residual**2, roughness_window))
+
+    return {
+        'slope': np.degrees(np.arctan(np.hypot(dzdx, dzdy))),
+        'curvature': curvature,
+        'roughness': roughness,
+    }
+
+
+def terrain_products(
+        surface: SurfaceType,
+        slope_window: int = 3,
+        roughness_window: int = 5,
+        max_slope: float = 20.,
+        max_roughness: float = 0.1,
+        tile: int = 1024,
+        out: dict[str, NDArray] | None = None
+) -> dict[str, NDArray]:
+    '''
+    derive the slope (in degrees), the curvature (the laplacian), the
+    roughness (the RMS deviation from the local mean) and the hazard mask
+    (where the slope or the roughness exceed their limits) of a surface.
+
+    All products are computed in a single tiled pass, which reads each
+    sample of the heightmap once (plus a halo around each tile), so the
+    heightmap and the outputs can be memory-mapped arrays.
+
+    Args:
+    * surface :          the surface
+    * slope_window :     the size of the smoothing window for the slope
+                         and the curvature
+    * roughness_window : the size of the window for the roughness
+    * max_slope :        the steepest traversable slope, in degrees
+    * max_roughness :    the roughest traversable terrain
+    * tile :             the size of the tiles
+    * out :              arrays in which to store (some of) the products
+    '''
+    x, y, z, *_ = surface
+    spacing = (float(x[-1] - x[0]) / (len(x) - 1),
+               float(y[-1] - y[0]) / (len(y) - 1))
+    halo = max(slope_window//2 + 1, 2*(roughness_window//2))
+
+    out = dict(out or {})
+    for name in PRODUCTS:
+        if name not in out:
+            out[name] = np.empty(z.shape, bool if name == 'hazard' else None)
+
+    for block, window, inner in iter_tiles(z.shape, tile, halo):
+        products = _products(np.asarray(z[window], np.float64), spacing,
+                             slope_window, roughness_window)
+        for name, product in products.items():
+            out[name][block] = product[inner]
+        out['hazard'][block] = (products['slope'][inner] > max_slope) | \
+            (products['roughness'][inner] > max_roughness)
+    return out
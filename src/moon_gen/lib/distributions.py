@@ -5,6 +5,7 @@ This sub-module contains the probabilites and distributions to draw from
 for the different surface generators.
 '''
 
+import math
 import typing
 
 import numpy as np
@@ -25,30 +26,56 @@ class PowerDistribution:
     '''
     roughly based on LUNAR SURFACE MODELS, Marshall Space Center, p 21
     https://ntrs.nasa.gov/api/citations/19700009596/downloads/19700009596.pdf
+
+    Distributions are immutable, so they can be shared safely between
+    threads: use `truncated` to get a distribution with other bounds.
     '''
 
     def __init__(self, intercept: float, power: float = -2.,
-                 d_min: float = 0.1) -> None:
+                 d_min: float = 0.1, d_max: float = math.inf) -> None:
         '''
         Args:
         * intercept : the intercept of the x=1 axis in the cumulative
                         distribution chart
         * power :     the power of the distribution
         * d_min :     the minimum admissible diameter
+        * d_max :     the maximum admissible diameter
         '''
-        self.intercept = intercept
-        self.power = power
+        self._intercept = intercept
+        self._power = power
         self._d_min = d_min
-        self.d_min = d_min
+        self._d_max = d_max
+        self._density = self.cdf(d_min) - self.cdf(d_max)
+
+    @property
+    def intercept(self) -> float:
+        return self._intercept
 
     @property
-    def d_min(self):
+    def power(self) -> float:
+        return self._power
+
+    @property
+    def d_min(self) -> float:
         return self._d_min
 
-    @d_min.setter
-    def d_min(self, value: float):
-        self._d_min = value
-        self._cdf = self.cdf(value)
+    @property
+    def d_max(self) -> float:
+        return self._d_max
+
+    @property
+    def density(self) -> float:
+        '''number of items between d_min and d_max per unit area'''
+        return self._density
+
+    def truncated(self, d_min: float | None = None,
+                  d_max: float | None = None) -> 'PowerDistribution':
+        '''the same distribution, with other diameter bounds'''
+        return PowerDistribution(
+            self._intercept, self._power,
+            self._d_min if d_min is None else d_min,
+            self._d_max if d_max is None else d_max
+        )
 
     @typing.overload
     def cdf(self, d_min: float) -> float:
@@ -59,24 +86,24 @@ class PowerDistribution:
         ...
 
     def cdf(self, d_min):
-        return self.intercept * d_min**self.power
-
-    @typing.overload
-    def icdf(self, n: float) -> float:
-        ...
+        return self._intercept * d_min**self._power
 
     def number(self, x: NDArray, y: NDArray) -> int:
         '''
-        number of items greater than d_min in a given area, based on cdf
+        number of items between d_min and d_max in a given area, based on cdf
         '''
-        return int((np.ptp(x) * np.ptp(y)) * self._cdf)
+        return int((np.ptp(x) * np.ptp(y)) * self._density)
+
+    @typing.overload
+    def icdf(self, n: float) -> float:
+        ...
 
     @typing.overload
     def icdf(self, n: NDArray) -> NDArray:
         ...
 
     def icdf(self, n):
-        return (n/self.intercept)**(1/self.power)
+        return (n/self._intercept)**(1/self._power)
 
     @typing.overload
     def diameter(self, u: float) -> float:
@@ -89,8 +116,35 @@ class PowerDistribution:
     def diameter(self, u):
         '''
         a diameter, based on the input u, which is between 0 and 1; and the cdf
+        truncated to [d_min, d_max]
         '''
-        return self.icdf(u*self._cdf)
+        return self.icdf(self.cdf(self._d_max) + u*self._density)
+
+    def sample(
+        self,
+        x: NDArray,
+        y: NDArray,
+        rng: np.random.Generator | np.random.BitGenerator | int | None = None
+    ) -> tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64]]:
+        '''
+        draw a Poisson-distributed number of items, uniformly placed in the
+        area spanned by `x` and `y`, in one vectorized call.
+
+        `rng` can be a generator, a (counter-based) bit generator such as
+        `np.random.Philox`, or a seed. Generators should not be shared
+        between threads, whereas distributions can be.
+        Items larger than the area are not drawn.
+
+        Returns the item centers and diameters.
+        '''
+        rng = np.random.default_rng(rng)
+        extent = max(np.ptp(x), np.ptp(y))
+        distribution = self if self._d_max <= extent else \
+            self.truncated(d_max=max(extent, self._d_min))
+        n = rng.poisson(np.ptp(x) * np.ptp(y) * distribution.density)
+        cx = rng.uniform(np.min(x), np.max(x), n)
+        cy = rng.uniform(np.min(y), np.max(y), n)
+        return cx, cy, distribution.diameter(rng.random(n))
 
 
 crater_density_fresh = PowerDistribution(2e-3, -2.)
@@ -98,6 +152,12 @@ crater_density_young = PowerDistribution(2e-2, -2.)
 crater_density_mature = PowerDistribution(1e-1, -2.)
 crater_density_old = PowerDistribution(2e-1, -2.)
 
+# rocks per square meter larger than a diameter, roughly based on the
+# Surveyor counts (Shoemaker & Morris, 1969) of mare surfaces
+rock_density_sparse = PowerDistribution(1e-3, -2.11, d_min=.05, d_max=5.)
+rock_density_typical = PowerDistribution(7.9e-3, -2.11, d_min=.05, d_max=5.)
+rock_density_dense = PowerDistribution(5e-2, -2.11, d_min=.05, d_max=5.)
+
 
 @typing.overload
 def surface_psd_smooth(f: float) -> float:
@@ -202,6 +262,42 @@ def cash_norm(x_coord, y_coord, seed: int = 0):
     return (cash(x_coord, y_coord, seed=seed)) / 2**63
 
 
+def cash_uniform(x_coord: NDArray[np.int64], y_coord: NDArray[np.int64],
+                 seed: int = 0) -> NDArray[np.float64]:
+    '''
+    return 52 bits of the output of `cash`, as uniform values in [0 - 1)
+    '''
+    h = cash(np.asarray(x_coord, np.int64), np.asarray(y_coord, np.int64),
+             seed=seed)
+    h = np.asarray(h).astype(np.uint64)
+    # nearby seeds (the channels) give nearly the same output of `cash` :
+    # scramble it with the finalizer of splitmix64 to decorrelate them
+    h ^= h >> np.uint64(30)
+    h *= np.uint64(0xbf58476d1ce4e5b9)
+    h ^= h >> np.uint64(27)
+    h *= np.uint64(0x94d049bb133111eb)
+    h ^= h >> np.uint64(31)
+    return (h >> np.uint64(12)) * 2.**-52
+
+
+def poisson_icdf(lam: float, u: NDArray[np.float64]) -> NDArray[np.int64]:
+    '''
+    invert the cumulative Poisson distribution of mean `lam` at the
+    uniform values `u`, i.e. draw deterministic Poisson-distributed counts.
+    '''
+    k = np.zeros(np.shape(u), np.int64)
+    p = cdf = math.exp(-lam)
+    active = u >= cdf
+    n = 0
+    while p > 0 and active.any():
+        k += active
+        n += 1
+        p *= lam/n
+        cdf += p
+        active &= u >= cdf
+    return k
+
+
 if __name__ == "__main__":
     import matplotlib.pyplot as plt
 
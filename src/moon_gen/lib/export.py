@@ -0,0 +1,221 @@
+'''
+EXPORT.PY
+
+This submodule contains functions for exporting surfaces as digital
+elevation models (16-bit PNG, raw float32 or numpy arrays), streamed strip
+by strip so that memory-mapped surfaces never need to fit in memory.
+'''
+
+import os
+import json
+import zlib
+import struct
+import typing
+
+import numpy as np
+from numpy.typing import NDArray
+
+from moon_gen.lib.sampling import HeightfieldSampler
+from moon_gen.lib.utils import SurfaceType, albedo_from_colors
+
+DEM_FORMATS = ('.png', '.r32', '.npy')
+'''the supported DEM file extensions'''
+
+
+def gazebo_size(n: int) -> int:
+    '''the smallest size of the form 2**k + 1 which is at least `n`'''
+    return 2**int(np.ceil(np.log2(max(n - 1, 1)))) + 1
+
+
+def array_rows(
+        surface: SurfaceType,
+        strip: int = 256,
+        size: int | None = None
+) -> typing.Iterator[NDArray[np.float64]]:
+    '''
+    iterate over blocks of rows of a surface's heightmap, in the orientation
+    of `z`. These are contiguous in a C-ordered (memory-mapped) `z`.
+    If `size` is given, the surface is resampled to `size` x `size`.
+    '''
+    x, y, z, *_ = surface
+    if size is None:
+        for i in range(0, z.shape[0], strip):
+            yield np.asarray(z[i:i+strip], np.float64)
+        return
+
+    sampler = HeightfieldSampler((x, y, z))
+    xs = np.linspace(x[0], x[-1], size)
+    ys = np.linspace(y[0], y[-1], size)
+    for i in range(0, size, strip):
+        yield sampler(*np.meshgrid(xs[i:i+strip], ys, indexing='ij'))
+
+
+def dem_metadata(surface: SurfaceType, strip: int = 256) -> dict:
+    '''the extents of a surface, as stored next to an exported DEM'''
+    x, y, *_ = surface
+    z_min, z_max = np.inf, -np.inf
+    for block in array_rows(surface, strip):
+        z_min = min(z_min, float(np.min(block)))
+        z_max = max(z_max, float(np.max(block)))
+    return {
+        'shape': [len(x), len(y)],
+        'x': [float(x[0]), float(x[-1])],
+        'y': [float(y[0]), float(y[-1])],
+        'z': [z_min, z_max],
+    }
+
+
+def image_rows(
+        surface: SurfaceType,
+        strip: int = 256,
+        size: int | None = None
+) -> typing.Iterator[NDArray[np.float64]]:
+    '''
+    iterate over strips of the rows of a surface's heightmap image, in which
+    rows follow `y` and columns follow `x` (mirrored).
+    If `size` is given, the surface is resampled to `size` x `size`.
+
+    The image rows are columns of `z`, so each strip is a strided read
+    through every row of a C-ordered (memory-mapped) `z`, and the file is
+    read in runs of `strip` samples. Use `array_rows` where the orientation
+    of `z` will do.
+    '''
+    x, y, z, *_ = surface
+    if size is None:
+        for j in range(0, z.shape[1], strip):
+            yield np.asarray(z[::-1, j:j+strip], np.float64).T
+        return
+
+    sampler = HeightfieldSampler((x, y, z))
+    xs = np.linspace(x[-1], x[0], size)
+    ys = np.linspace(y[0], y[-1], size)
+    for j in range(0, size, strip):
+        yield sampler(*np.meshgrid(xs, ys[j:j+strip]))
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    '''a PNG chunk, with its length and checksum'''
+    return struct.pack('>I', len(data)) + kind + data + \
+        struct.pack('>I', zlib.crc32(kind + data))
+
+
+def write_png(
+        filename: str | os.PathLike,
+        rows: typing.Iterable[NDArray],
+        width: int,
+        height: int,
+        depth: int = 16,
+        channels: int = 1
+) -> None:
+    '''
+    write strips of rows to an 8 or 16-bit grayscale (1 channel) or RGB
+    (3 channels) PNG, without buffering. RGB strips have a last axis of
+    size 3.
+    '''
+    dtype = '>u2' if depth == 16 else np.uint8
+    stride = width*channels*depth//8
+    color = {1: 0, 3: 2}[channels]
+    compressor = zlib.compressobj(6)
+    with open(filename, 'wb') as file:
+        file.write(b'\x89PNG\r\n\x1a\n')
+        file.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                                   depth, color, 0, 0, 0)))
+        for block in rows:
+            # each row starts with its filter type (0 : none)
+            raw = np.zeros((len(block), 1 + stride), np.uint8)
+            raw[:, 1:] = np.ascontiguousarray(block, dtype).view(
+                np.uint8).reshape((len(block), stride))
+            data = compressor.compress(raw.tobytes())
+            if data:
+                file.write(_png_chunk(b'IDAT', data))
+        file.write(_png_chunk(b'IDAT', compressor.flush()))
+        file.write(_png_chunk(b'IEND', b''))
+
+
+def write_png16(
+        filename: str | os.PathLike,
+        rows: typing.Iterable[NDArray[np.uint16]],
+        width: int,
+        height: int
+) -> None:
+    '''write strips of rows to a 16-bit grayscale PNG, without buffering'''
+    write_png(filename, rows, width, height)
+
+
+def export_dem(
+        surface: SurfaceType,
+        filename: str | os.PathLike,
+        size: int | None = None,
+        strip: int = 256
+) -> dict:
+    '''
+    export a surface as a DEM, in the format given by the file extension :
+     - `.png` : a 16-bit grayscale image, spanning the range of `z`
+     - `.r32` : raw little-endian float32 image rows
+     - `.npy` : a float32 numpy array, in the orientation of `z`
+
+    The extents of the surface are written to a `.json` file next to it.
+    If the surface has colors (or an albedo map), they are written next to
+    it too (see `export_albedo`).
+    If `size` is given, the surface is resampled to `size` x `size`
+    (see `gazebo_size`). Returns the metadata.
+    '''
+    extension = os.path.splitext(filename)[1].casefold()
+    if extension not in DEM_FORMATS:
+        raise ValueError(f"unsupported DEM format `{extension}`")
+
+    metadata = dem_metadata(surface, strip)
+    if size is not None:
+        metadata['shape'] = [size, size]
+    width, height = metadata['shape']
+
+    if extension == '.png':
+        z_min, z_max = metadata['z']
+        scale = (2**16 - 1) / ((z_max - z_min) or 1.)
+        write_png16(filename, (np.round((r - z_min)*scale)
+                               for r in image_rows(surface, strip, size)),
+                    width, height)
+    elif extension == '.r32':
+        with open(filename, 'wb') as file:
+            for r in image_rows(surface, strip, size):
+                file.write(r.astype('<f4').tobytes())
+    else:
+        out = np.lib.format.open_memmap(filename, 'w+', np.float32,
+                                        (width, height))
+        for i, block in zip(range(0, width, strip),
+                            array_rows(surface, strip, size)):
+            out[i:i+len(block)] = block
+        out.flush()
+
+    if len(surface) > 3:
+        metadata['albedo'] = os.path.basename(
+            export_albedo(surface, filename, size, strip))
+
+    with open(f'{filename}.json', 'w') as file:
+        json.dump(metadata, file, indent=2)
+    return metadata
+
+
+def export_albedo(
+        surface: SurfaceType,
+        filename: str | os.PathLike,
+        size: int | None = None,
+        strip: int = 256,
+        ground: float = .45,
+        fresh: float = .9
+) -> str:
+    '''
+    export the albedo of a surface, i.e. its `C` array, or the albedo of
+    its colors (made by `albedo_colors`, with the given `ground` and
+    `fresh` grays), as a 16-bit grayscale PNG image spanning [0, 1], in
+    the orientation of the DEM exported to `filename`. Returns the name of
+    the image, i.e. `<filename>_albedo.png`.
+    '''
+    x, y, _, c = surface
+    albedo = c if c.ndim == 2 else albedo_from_colors(c, ground, fresh)
+    width, height = (len(x), len(y)) if size is None else (size, size)
+    name = f'{os.path.splitext(filename)[0]}_albedo.png'
+    write_png16(name, (np.round(np.clip(r, 0, 1)*(2**16 - 1))
+                       for r in image_rows((x, y, albedo), strip, size)),
+                width, height)
+    return name
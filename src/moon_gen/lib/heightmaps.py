@@ -37,9 +37,29 @@ def interpolate(low, high, w):
     return (high - low) * (3.0 - w * 2.0) * w * w + low
 
 
+GRADIENT_BITS = 8
+'''the number of hash bits which select the gradient of a lattice point'''
+
+GRADIENTS = np.stack((
+    np.cos(2*np.pi*np.arange(2**GRADIENT_BITS)/2**GRADIENT_BITS),
+    np.sin(2*np.pi*np.arange(2**GRADIENT_BITS)/2**GRADIENT_BITS),
+))
+'''the unit gradients of the lattice points, evenly spread over a circle'''
+GRADIENTS.setflags(write=False)
+
+
+def gradient_index(h):
+    '''
+    the index into `GRADIENTS` given by a `cash` output. The bits are taken
+    from the middle of the hash, which are well mixed, and are the same for
+    numpy's wrapping int64 as for python's unbounded integers.
+    '''
+    return (h >> 24) & (2**GRADIENT_BITS - 1)
+
+
 def random_gradient(ix: int, iy: int, seed: int = 0):
-    r = cash(ix, iy, seed)
-    return math.cos(r), math.sin(r)
+    k = gradient_index(cash(ix, iy, seed))
+    return float(GRADIENTS[0, k]), float(GRADIENTS[1, k])
 
 
 def dot_grid_gradient(ix: int, iy: int, x: float, y: float):
@@ -84,7 +104,8 @@ def _perlin_grid(x: NDArray, y: NDArray) -> NDArray:
 
 
 def perlin_grid(x: NDArray[np.float64],
-                y: NDArray[np.float64]) -> NDArray[np.float64]:
+                y: NDArray[np.float64],
+                seed: int = 0) -> NDArray[np.float64]:
     '''
     generate a perlin noise grid using numpy.
     Fast-ish, but consumes a lot of memory.
@@ -94,17 +115,21 @@ def perlin_grid(x: NDArray[np.float64],
     dx0, dy0 = x-x0, y-y0
     dx1, dy1 = x-x1, y-y1
 
-    # get a "noise vector angle thing" for each gridpoint
-    c00 = cash(*np.meshgrid(x0, y0, indexing='ij'), seed=0)
-    c01 = cash(*np.meshgrid(x0, y1, indexing='ij'), seed=0)
-    c10 = cash(*np.meshgrid(x1, y0, indexing='ij'), seed=0)
-    c11 = cash(*np.meshgrid(x1, y1, indexing='ij'), seed=0)
+    # get a gradient for each gridpoint
+    g00 = GRADIENTS[:, gradient_index(
+        cash(*np.meshgrid(x0, y0, indexing='ij'), seed=seed))]
+    g01 = GRADIENTS[:, gradient_index(
+        cash(*np.meshgrid(x0, y1, indexing='ij'), seed=seed))]
+    g10 = GRADIENTS[:, gradient_index(
+        cash(*np.meshgrid(x1, y0, indexing='ij'), seed=seed))]
+    g11 = GRADIENTS[:, gradient_index(
+        cash(*np.meshgrid(x1, y1, indexing='ij'), seed=seed))]
 
     # get the noise values at each grid point
-    n00 = (np.cos(c00).T*dx0).T + (np.sin(c00)*dy0)
-    n01 = (np.cos(c01).T*dx0).T + (np.sin(c01)*dy1)
-    n10 = (np.cos(c10).T*dx1).T + (np.sin(c10)*dy0)
-    n11 = (np.cos(c11).T*dx1).T + (np.sin(c11)*dy1)
+    n00 = (g00[0].T*dx0).T + (g00[1]*dy0)
+    n01 = (g01[0].T*dx0).T + (g01[1]*dy1)
+    n10 = (g10[0].T*dx1).T + (g10[1]*dy0)
+    n11 = (g11[0].T*dx1).T + (g11[1]*dy1)
 
     # interpolate
     nx0 = interpolate(n00.T, n10.T, dx0)
@@ -114,11 +139,151 @@ def perlin_grid(x: NDArray[np.float64],
     return n
 
 
+def perlin_points(x: NDArray[np.float64],
+                  y: NDArray[np.float64],
+                  seed: int = 0) -> NDArray[np.float64]:
+    '''
+    generate perlin noise at scattered points `(x, y)` using numpy.
+    Gives the same values as `perlin_grid` on the points of a grid.
+    '''
+    x0, y0 = np.floor(x).astype(np.int64), np.floor(y).astype(np.int64)
+    dx0, dy0 = x-x0, y-y0
+
+    def noise(ix, iy, dx, dy):
+        gx, gy = GRADIENTS[:, gradient_index(cash(ix, iy, seed=seed))]
+        return gx*dx + gy*dy
+
+    nx0 = interpolate(noise(x0, y0, dx0, dy0),
+                      noise(x0+1, y0, dx0-1, dy0), dx0)
+    nx1 = interpolate(noise(x0, y0+1, dx0, dy0-1),
+                      noise(x0+1, y0+1, dx0-1, dy0-1), dx0)
+    return interpolate(nx0, nx1, dy0)
+
+
+def _octaves(
+        cycle: float,
+        width: float,
+        octaves: int,
+        psd: typing.Callable[[float], float]
+) -> typing.Iterator[tuple[float, float]]:
+    '''the cycle and weight of each octave of multiscale perlin noise'''
+    for _ in range(octaves):
+        weight = math.sqrt(psd(1/cycle))
+        weight *= math.sqrt(10*width/cycle)  # heuristic ????
+        # print(f"f={1/cycle:6.3f} /m\t{weight=:05.3f}\t({cycle=:7.2f} m)")
+        yield cycle, weight
+        cycle /= 2
+
+
+def catmull_rom_weights(s: NDArray[np.float64]) -> NDArray[np.float64]:
+    '''the weights of the four samples around a point `s` in [0, 1)'''
+    s2, s3 = s*s, s*s*s
+    return np.stack(((-s3 + 2*s2 - s)/2, (3*s3 - 5*s2 + 2)/2,
+                     (-3*s3 + 4*s2 + s)/2, (s3 - s2)/2))
+
+
+def _upsample(
+        a: NDArray[np.float64],
+        axis: int,
+        factor: int,
+        lo: int,
+        count: int,
+        pad: int
+) -> NDArray[np.float64]:
+    '''
+    upsample `a` along an axis by an integer `factor`, with Catmull-Rom
+    splines, to the samples `lo` to `lo+count` of the finer grid, where the
+    first sample of `a` is at `-pad` on its own grid
+    '''
+    t = np.arange(lo, lo + count)
+    m = t // factor
+    if factor == 1:
+        return np.take(a, m + pad, axis=axis)
+    w = catmull_rom_weights((t - m*factor)/factor)
+    shape = [1]*a.ndim
+    shape[axis] = count
+    return sum(w[k].reshape(shape) * np.take(a, m - 1 + k + pad, axis=axis)
+               for k in range(4))  # type: ignore
+
+
+_PAD = 3
+'''the number of samples around the coarse grids of an octave plan'''
+
+
+def octave_plan(
+        cycle: float,
+        width: float,
+        octaves: int,
+        psd: typing.Callable[[float], float],
+        spacing: tuple[float, float],
+        oversampling: int = 16,
+        tolerance: float = 1e-3
+) -> list[tuple[float, float, tuple[int, int]]]:
+    '''
+    plan the evaluation of multiscale perlin noise on a grid with the given
+    `spacing`: each octave is given as `(cycle, weight, levels)`, where it
+    is evaluated on a grid `2**levels` times coarser than the full grid,
+    with at least `oversampling` samples per noise cell.
+    Octaves finer than the Nyquist limit of the grid (which would only add
+    aliasing), or with a weight below `tolerance` times the total weight,
+    are skipped.
+    '''
+    kept = [(c, w) for c, w in _octaves(cycle, width, octaves, psd)
+            if c/2 >= 2*max(spacing)]
+    total = sum(w for _, w in kept)
+    return [
+        (c, w, tuple(  # type: ignore
+            max(0, int(np.floor(np.log2(c/2 / (oversampling*d)))))
+            for d in spacing))
+        for c, w in kept if w >= tolerance*total
+    ]
+
+
+def _planned_grid(
+        x: NDArray[np.float64],
+        y: NDArray[np.float64],
+        plan: list[tuple[float, float, tuple[int, int]]],
+        seed: int
+) -> NDArray[np.float64]:
+    '''
+    evaluate an octave plan on a uniform grid: the octaves are accumulated
+    from the coarsest, and the accumulator is upsampled whenever the next
+    octave needs a finer grid, down to the full grid.
+    '''
+    n = len(x), len(y)
+    spacing = (x[-1] - x[0])/(n[0] - 1), (y[-1] - y[0])/(n[1] - 1)
+
+    def samples(level: int, axis: int) -> int:
+        return -(-(n[axis] - 1) // 2**level) + 1 + 2*_PAD
+
+    z, levels = np.zeros((1, 1)), None
+    for c, weight, new in plan:
+        if levels is None:
+            z = np.zeros((samples(new[0], 0), samples(new[1], 1)))
+        elif new != levels:
+            for axis in (0, 1):
+                z = _upsample(z, axis, 2**(levels[axis] - new[axis]), -_PAD,
+                              samples(new[axis], axis), _PAD)
+        levels = new
+        xc = x[0] + (np.arange(len(z)) - _PAD)*spacing[0]*2**new[0]
+        yc = y[0] + (np.arange(z.shape[1]) - _PAD)*spacing[1]*2**new[1]
+        z += weight * perlin_grid(2*xc/c, 2*yc/c, seed)
+
+    if levels is None:
+        return np.zeros(n)
+    for axis in (0, 1):
+        z = _upsample(z, axis, 2**levels[axis], 0, n[axis], _PAD)
+    return z
+
+
 def perlin_multiscale_grid(
         x: NDArray[np.float64],
         y: NDArray[np.float64],
         octaves: int = 8,
-        psd: typing.Callable[[float], float] = surface_psd_rough
+        psd: typing.Callable[[float], float] = surface_psd_rough,
+        cycle: float | None = None,
+        seed: int = 0,
+        plan: bool = True
 ) -> NDArray[np.float64]:
     '''
     generate multiscale perlin noise with a given power spectral density
@@ -128,23 +293,50 @@ def perlin_multiscale_grid(
         x   :   x coordinates
         y   :   y coordinates
         psd :   desired power spectral density function
+        cycle : the longest wavelength, by default the extent of the grid
+        seed :  the seed of the noise
+        plan :  on uniform grids, evaluate each octave on the coarsest grid
+                which resolves it, and skip the unresolvable or negligible
+                ones (see `octave_plan`)
     '''
+    if cycle is None:
+        cycle, width = max(np.ptp(x), np.ptp(y)), np.ptp(x)
+    else:
+        width = cycle
+
+    uniform = len(x) > 1 and len(y) > 1 and \
+        np.allclose(np.diff(x), np.diff(x).mean()) and \
+        np.allclose(np.diff(y), np.diff(y).mean())
+    if plan and uniform:
+        spacing = np.ptp(x)/(len(x) - 1), np.ptp(y)/(len(y) - 1)
+        return _planned_grid(x, y, octave_plan(cycle, width, octaves, psd,
+                                               spacing), seed)
 
-    cycle_max = max(np.ptp(x), np.ptp(y))
-    cycle = cycle_max
     grids: list[NDArray[np.float64]] = []
-    for _ in range(octaves):
+    for c, weight in _octaves(cycle, width, octaves, psd):
+        grids.append(weight * perlin_grid(2*x/c, 2*y/c, seed))
 
-        xx = 2*x/cycle
-        yy = 2*y/cycle
-        weight = math.sqrt(psd(1/cycle))
-        weight *= math.sqrt(10*np.ptp(x)/cycle)  # heuristic ????
-        # print(f"f={1/cycle:6.3f} /m\t{weight=:05.3f}\t({cycle=:7.2f} m)")
+    return sum(grids, start=np.zeros((len(x), len(y))))
 
-        grids.append(weight * perlin_grid(xx, yy))
-        cycle /= 2
 
-    return sum(grids, start=np.zeros((len(x), len(y))))
+def perlin_multiscale_points(
+        x: NDArray[np.float64],
+        y: NDArray[np.float64],
+        cycle: float,
+        octaves: int = 8,
+        psd: typing.Callable[[float], float] = surface_psd_rough,
+        seed: int = 0
+) -> NDArray[np.float64]:
+    '''
+    generate multiscale perlin noise at scattered points `(x, y)`.
+    Gives the same values as `perlin_multiscale_grid` with the same `cycle`
+    and `plan=False` only: planned grids skip the octaves they cannot
+    resolve, and upsample the others.
+    '''
+    z = np.zeros(np.broadcast(x, y).shape)
+    for c, weight in _octaves(cycle, cycle, octaves, psd):
+        z += weight * perlin_points(2*x/c, 2*y/c, seed)
+    return z
 
 
 if __name__ == "__main__":
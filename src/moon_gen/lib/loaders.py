@@ -0,0 +1,345 @@
+'''
+LOADERS.PY
+
+This submodule contains functions for loading heightmaps from DEM files
+(16-bit PNG, uncompressed TIFF, raw float32 or numpy arrays) without Qt,
+memory-mapping them where possible, and optionally decimating them while
+they are read.
+'''
+
+import os
+import json
+import zlib
+import struct
+import typing
+import itertools
+
+import numpy as np
+from numpy.typing import NDArray
+
+from moon_gen.lib.utils import SurfaceType
+
+HEIGHTMAP_FORMATS = ('.png', '.tif', '.tiff', '.r32', '.npy')
+'''the supported heightmap file extensions'''
+
+DecimationType = typing.Literal['box', 'stride']
+'''
+how to shrink a heightmap : `box` averages blocks of samples, `stride`
+keeps every n-th sample
+'''
+
+
+def read_metadata(filename: str | os.PathLike) -> dict:
+    '''the metadata stored next to a DEM (see `export_dem`), if any'''
+    try:
+        with open(f'{filename}.json') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def _png_header(file: typing.BinaryIO) -> tuple[int, int, int]:
+    '''check the header of a PNG file, and return its size and bit depth'''
+    if file.read(8) != b'\x89PNG\r\n\x1a\n':
+        raise ValueError("not a PNG file")
+    length, kind = struct.unpack('>I4s', file.read(8))
+    width, height, depth, color, _, _, interlace = \
+        struct.unpack('>IIBBBBB', file.read(length))
+    file.read(4)
+    if kind != b'IHDR' or color != 0 or depth not in (8, 16) or interlace:
+        raise ValueError("only non-interlaced 8 or 16-bit grayscale PNG "
+                         "images are supported")
+    return width, height, depth
+
+
+def _png_data(file: typing.BinaryIO) -> typing.Iterator[bytes]:
+    '''iterate over the decompressed image data of a PNG file'''
+    decompressor = zlib.decompressobj()
+    while True:
+        length, kind = struct.unpack('>I4s', file.read(8))
+        if kind == b'IEND':
+            break
+        data = file.read(length)
+        file.read(4)
+        if kind == b'IDAT':
+            yield decompressor.decompress(data)
+    yield decompressor.flush()
+
+
+def _unfilter(
+        row: NDArray[np.uint8],
+        previous: NDArray[np.uint8],
+        kind: int,
+        bpp: int
+) -> NDArray[np.uint8]:
+    '''undo the None, Sub or Up filter of a PNG image row'''
+    if kind == 0:
+        return row
+    if kind == 1:
+        sums = np.cumsum(row.reshape((-1, bpp)), axis=0, dtype=np.uint64)
+        return (sums % 256).astype(np.uint8).ravel()
+    return row + previous
+
+
+def _skewed(rows: NDArray, length: int) -> NDArray:
+    '''
+    the pixels of a block of rows (padded with a column on the left), laid
+    out along their anti-diagonals : pixel `(r, k)` goes to `(r + k, r)`
+    '''
+    n, w = rows.shape[:2]
+    skewed = np.zeros((length, n, *rows.shape[2:]), rows.dtype)
+    for r in range(n):
+        skewed[r+1:r+1+w, r] = rows[r]
+    return skewed
+
+
+def _unfilter_wavefront(
+        data: NDArray[np.uint8],
+        kinds: NDArray[np.uint8],
+        previous: NDArray[np.uint8],
+        bpp: int
+) -> NDArray[np.uint8]:
+    '''
+    undo the filters of a block of PNG image rows, some of which use the
+    Average or Paeth filters. A pixel only depends on its left, upper and
+    upper-left neighbours, so the pixels of each anti-diagonal of the block
+    are decoded at once, which takes one vectorized step per diagonal
+    rather than per pixel.
+    '''
+    n = len(data)
+    w = data.shape[1] // bpp
+    # the row above the block comes first
+    rows = np.concatenate((previous.reshape((1, w, bpp)),
+                           data.reshape((n, w, bpp)))).astype(np.int16)
+    raw = _skewed(rows, n + w + 1)
+    out = np.zeros_like(raw)
+    out[1:w+1, 0] = rows[0]
+    kinds = np.concatenate(([0], kinds)).reshape((-1, 1))
+    masks = [kinds == k for k in range(5)]
+
+    for d in range(2, n + w + 1):
+        j = slice(max(1, d - w), min(n, d - 1) + 1)
+        above = slice(j.start - 1, j.stop - 1)
+        a, b, c = out[d-1, j], out[d-1, above], out[d-2, above]
+        m = [mask[j] for mask in masks]
+        predictor = np.where(m[1], a, 0) + np.where(m[2], b, 0) + \
+            np.where(m[3], (a + b) >> 1, 0)
+        if m[4].any():
+            p = a + b - c
+            pa, pb, pc = np.abs(p - a), np.abs(p - b), np.abs(p - c)
+            paeth = np.where((pa <= pb) & (pa <= pc), a,
+                             np.where(pb <= pc, b, c))
+            predictor += np.where(m[4], paeth, 0)
+        out[d, j] = (raw[d, j] + predictor) & 255
+
+    # back to rows
+    decoded = np.empty((n, w, bpp), np.uint8)
+    for r in range(1, n + 1):
+        decoded[r-1] = out[r+1:r+1+w, r]
+    return decoded.reshape((n, w*bpp))
+
+
+def _unfilter_rows(
+        block: NDArray[np.uint8],
+        previous: NDArray[np.uint8],
+        bpp: int
+) -> NDArray[np.uint8]:
+    '''undo the filters of a block of raw PNG image rows'''
+    kinds, data = block[:, 0], block[:, 1:]
+    if np.any(kinds > 4):
+        raise ValueError("invalid PNG filter")
+    if np.any(kinds >= 3):
+        return _unfilter_wavefront(data, kinds, previous, bpp)
+
+    out = np.empty_like(data)
+    for r in range(len(data)):
+        previous = out[r] = _unfilter(data[r], previous, kinds[r], bpp)
+    return out
+
+
+def png_rows(
+        filename: str | os.PathLike,
+        block: int = 256
+) -> tuple[tuple[int, int], int, typing.Iterator[NDArray]]:
+    '''
+    the size and bit depth of a grayscale PNG image, and an iterator over
+    its rows, which are decoded as they are read, in blocks of `block`
+    rows (so the image is never fully in memory)
+    '''
+    with open(filename, 'rb') as file:
+        width, height, depth = _png_header(file)
+    bpp = depth // 8
+    stride = 1 + width*bpp
+
+    def rows() -> typing.Iterator[NDArray]:
+        previous = np.zeros(width*bpp, np.uint8)
+        buffer = bytearray()
+        with open(filename, 'rb') as file:
+            _png_header(file)
+            for data in itertools.chain(_png_data(file), [None]):
+                if data is not None:
+                    buffer += data
+                n = len(buffer) // stride
+                if n == 0 or (data is not None and n < block):
+                    continue
+                raw = np.frombuffer(bytes(buffer[:n*stride]), np.uint8)
+                decoded = _unfilter_rows(raw.reshape((n, stride)), previous,
+                                         bpp)
+                previous = decoded[-1]
+                for row in decoded:
+                    yield row.view('>u2' if depth == 16 else np.uint8)
+                del buffer[:n*stride]
+
+    return (height, width), depth, rows()
+
+
+def tiff_memmap(filename: str | os.PathLike) -> NDArray:
+    '''
+    memory-map an uncompressed, single-channel TIFF image, whose strips
+    are stored contiguously
+    '''
+    with open(filename, 'rb') as file:
+        order = {b'II': '<', b'MM': '>'}.get(file.read(2))
+        if order is None:
+            raise ValueError("not a TIFF file")
+        _, offset = struct.unpack(order + 'HI', file.read(6))
+        file.seek(offset)
+        (count,) = struct.unpack(order + 'H', file.read(2))
+        entries = [struct.unpack(order + 'HHI4s', file.read(12))
+                   for _ in range(count)]
+
+        tags = {}
+        for tag, kind, n, value in entries:
+            fmt = {3: 'H', 4: 'I'}.get(kind, 'I')
+            if n*struct.calcsize(fmt) > 4:
+                file.seek(struct.unpack(order + 'I', value)[0])
+                value = file.read(n*struct.calcsize(fmt))
+            tags[tag] = struct.unpack(order + n*fmt,
+                                      value[:n*struct.calcsize(fmt)])
+
+    width, height = tags[256][0], tags[257][0]
+    bits, sample_format = tags[258][0], tags.get(339, (1,))[0]
+    offsets, counts = tags[273], tags[279]
+    contiguous = all(o + c == n for o, c, n in zip(offsets, counts,
+                                                   offsets[1:]))
+    if tags.get(259, (1,))[0] != 1 or tags.get(277, (1,))[0] != 1 or \
+            not contiguous:
+        raise ValueError("only uncompressed, single-channel TIFF images "
+                         "with contiguous strips are supported")
+    dtype = np.dtype(order + {1: 'u', 2: 'i', 3: 'f'}[sample_format] +
+                     str(bits//8))
+    return np.memmap(filename, dtype, 'r', offsets[0], (height, width))
+
+
+def _reduce(
+        rows: typing.Iterable[NDArray],
+        shape: tuple[int, int],
+        factor: int,
+        method: DecimationType
+) -> NDArray[np.float64]:
+    '''shrink an image, given as an iterator over its rows, by `factor`'''
+    height, width = shape
+    out = np.empty((-(-height//factor), -(-width//factor)))
+    columns = np.arange(0, width, factor)
+    counts = np.diff(np.r_[columns, width])
+    total = np.zeros(len(columns))
+    for r, row in enumerate(rows):
+        if method == 'stride':
+            if r % factor == 0:
+                out[r//factor] = row[::factor]
+            continue
+        total += np.add.reduceat(row, columns, dtype=np.float64)
+        if r % factor == factor - 1 or r == height - 1:
+            out[r//factor] = total / (counts*(r % factor + 1))
+            total[:] = 0
+    return out
+
+
+def _memmap(filename: str | os.PathLike, extension: str) -> NDArray:
+    '''memory-map a raster file, in the orientation in which it is stored'''
+    if extension in ('.tif', '.tiff'):
+        return tiff_memmap(filename)
+    if extension == '.npy':
+        return np.load(filename, mmap_mode='r')
+    shape = read_metadata(filename).get('shape')
+    if shape is None:
+        raise ValueError("the size of a raw heightmap must be given in "
+                         "its metadata")
+    return np.memmap(filename, '<f4', 'r', shape=(shape[1], shape[0]))
+
+
+def image_size(filename: str | os.PathLike) -> tuple[int, int]:
+    '''the width and height of a heightmap image, without loading it'''
+    extension = os.path.splitext(filename)[1].casefold()
+    if extension == '.png':
+        with open(filename, 'rb') as file:
+            width, height, _ = _png_header(file)
+        return width, height
+    shape = _memmap(filename, extension).shape
+    return shape if extension == '.npy' else shape[::-1]
+
+
+def load_image(
+        filename: str | os.PathLike,
+        max_size: int | None = None,
+        method: DecimationType = 'box'
+) -> tuple[NDArray, int | None]:
+    '''
+    load a heightmap as an image (rows follow `y`, columns follow `x`,
+    mirrored), without scaling, along with the full range of its integer
+    samples (or `None` for floats).
+    All but PNG files are memory-mapped, and returned as views when they
+    are not decimated. If the image is larger than `max_size`, it is
+    decimated as it is read.
+    '''
+    extension = os.path.splitext(filename)[1].casefold()
+    if extension not in HEIGHTMAP_FORMATS:
+        raise ValueError(f"unsupported heightmap format `{extension}`")
+
+    if extension == '.png':
+        shape, depth, rows = png_rows(filename)
+        scale: int | None = 2**depth - 1
+    else:
+        array = _memmap(filename, extension)
+        shape, rows = array.shape, iter(array)
+        scale = np.iinfo(array.dtype).max \
+            if np.issubdtype(array.dtype, np.integer) else None
+
+    factor = 1 if max_size is None else -(-max(shape)//max_size)
+    if factor > 1:
+        image = _reduce(rows, shape, factor, method)
+    elif extension == '.png':
+        image = np.stack(list(rows))
+    else:
+        image = array
+
+    if extension == '.npy':  # stored in the orientation of the surface
+        image = image[::-1].T
+    return image, scale
+
+
+def load_dem(
+        filename: str | os.PathLike,
+        max_size: int | None = None,
+        method: DecimationType = 'box',
+        extents: dict | None = None
+) -> SurfaceType:
+    '''
+    load a heightmap as a surface. The `x`, `y` and `z` ranges come from the
+    metadata next to the file (see `export_dem`), or from `extents`, given
+    as `{'x': [x0, x1], 'y': [y0, y1], 'z': [z0, z1]}`.
+    Integer images are scaled from their full range to the `z` range,
+    float images are taken as they are.
+    '''
+    metadata = read_metadata(filename)
+    metadata.update(extents or {})
+    image, scale = load_image(filename, max_size, method)
+
+    z = image.T[::-1]
+    if scale is not None:
+        z_min, z_max = metadata.get('z', (0., 1.))
+        z = z_min + z*((z_max - z_min)/scale)
+
+    x = np.linspace(*metadata.get('x', (0, z.shape[0] - 1)), z.shape[0])
+    y = np.linspace(*metadata.get('y', (0, z.shape[1] - 1)), z.shape[1])
+    return x, y, z
@@ -0,0 +1,267 @@
+'''
+MESH.PY
+
+This submodule contains functions for turning a surface into a decimated
+triangle mesh, using an error-bounded restricted quadtree, and for
+exporting such meshes (OBJ, binary STL or COLLADA), e.g. for Gazebo.
+'''
+
+import os
+import struct
+import functools
+
+import numpy as np
+from numpy.typing import NDArray
+from numpy.lib.stride_tricks import sliding_window_view
+
+from moon_gen.lib.export import gazebo_size
+from moon_gen.lib.sampling import HeightfieldSampler
+from moon_gen.lib.utils import SurfaceType
+
+MeshType = tuple[NDArray[np.float64], NDArray[np.intp]]
+'''
+a triangle mesh, defined as (`vertices`, `triangles`), where `vertices` is
+an (n, 3) array of points and `triangles` an (m, 3) array of indices into
+it, counter-clockwise when seen from above
+'''
+
+MESH_FORMATS = ('.obj', '.stl', '.dae')
+'''the supported mesh file extensions'''
+
+
+@functools.lru_cache(maxsize=None)
+def _fan_weights(s: int) -> NDArray[np.float64]:
+    '''
+    the weights of the corners (00, 10, 11, 01) and of the center of a node
+    of `s` x `s` cells, for interpolating its samples with a fan of four
+    triangles around the center
+    '''
+    u, v = np.meshgrid(np.linspace(0, 1, s+1), np.linspace(0, 1, s+1),
+                       indexing='ij')
+    w = np.zeros((5, s+1, s+1))
+    triangles = [
+        ((v <= u) & (v <= 1-u), (0, 1), (1-u-v, u-v, 2*v)),
+        ((u >= v) & (u >= 1-v), (1, 2), (u-v, u+v-1, 2*(1-u))),
+        ((v >= u) & (v >= 1-u), (2, 3), (u+v-1, v-u, 2*(1-v))),
+        ((u <= v) & (u <= 1-v), (3, 0), (v-u, 1-u-v, 2*u)),
+    ]
+    for inside, (a, b), (wa, wb, wc) in triangles:
+        w[a][inside], w[b][inside], w[4][inside] = \
+            wa[inside], wb[inside], wc[inside]
+    w.setflags(write=False)
+    return w
+
+
+def _fan_errors(z: NDArray[np.float64], s: int) -> NDArray[np.float64]:
+    '''the largest vertical error of each node of `s` x `s` cells'''
+    m = (len(z) - 1)//s
+    weights = _fan_weights(s)
+    errors = np.empty((m, m))
+    rows = max(1, 2**22 // ((s+1)*len(z)))  # bound the temporary arrays
+    for r in range(0, m, rows):
+        blocks = sliding_window_view(
+            z[r*s:(r+rows)*s+1], (s+1, s+1))[::s, ::s]
+        vertices = np.stack((blocks[..., 0, 0], blocks[..., s, 0],
+                             blocks[..., s, s], blocks[..., 0, s],
+                             blocks[..., s//2, s//2]))
+        approx = np.einsum('kij,kab->abij', weights, vertices)
+        errors[r:r+rows] = np.abs(blocks - approx).max(axis=(2, 3))
+    return errors
+
+
+def _any_child(split: NDArray[np.bool_]) -> NDArray[np.bool_]:
+    '''whether any of the four children of each parent node is split'''
+    m = len(split)//2
+    return split.reshape((m, 2, m, 2)).any(axis=(1, 3))
+
+
+def _dilate(mask: NDArray[np.bool_]) -> NDArray[np.bool_]:
+    '''a mask, grown by one node along both axes'''
+    out = mask.copy()
+    out[1:] |= mask[:-1]
+    out[:-1] |= mask[1:]
+    out[:, 1:] |= mask[:, :-1]
+    out[:, :-1] |= mask[:, 1:]
+    return out
+
+
+def quadtree_splits(
+        z: NDArray[np.float64],
+        tolerance: float
+) -> list[NDArray[np.bool_]]:
+    '''
+    which nodes of a restricted quadtree over a (2**k + 1)-sized heightmap
+    are split: level `L` holds the nodes of `2**L` x `2**L` cells.
+    A node is split if its fan of triangles deviates from the heightmap by
+    more than `tolerance`, and the tree is restricted so that neighbouring
+    leaves differ by at most one level.
+    '''
+    levels = int(np.log2(len(z) - 1))
+    splits = [np.zeros((len(z) - 1,)*2, bool)]
+    for level in range(1, levels + 1):
+        children = _any_child(splits[-1])
+        split = (_fan_errors(z, 2**level) > tolerance) | _dilate(children)
+        splits.append(split)
+    return splits
+
+
+def _leaf_triangles(
+        splits: list[NDArray[np.bool_]],
+        level: int,
+        leaves: NDArray[np.bool_]
+) -> NDArray[np.intp]:
+    '''
+    the triangles of the leaves at a level, as the grid indices of their
+    vertices (3 x 2 x n): a fan around each center, through the edge
+    midpoints shared with finer neighbours
+    '''
+    i, j = np.nonzero(leaves)
+    s = 2**level
+    corners = [(i*s, j*s), ((i+1)*s, j*s), ((i+1)*s, (j+1)*s),
+               (i*s, (j+1)*s)]
+    if level == 0:
+        return np.concatenate((np.stack([corners[k] for k in (0, 1, 2)]),
+                               np.stack([corners[k] for k in (0, 2, 3)])),
+                              axis=-1)
+
+    center = (i*s + s//2, j*s + s//2)
+    neighbours = [(i, j-1), (i+1, j), (i, j+1), (i-1, j)]
+    padded = np.pad(splits[level], 1)
+    triangles = []
+    for e in range(4):
+        a, b = corners[e], corners[(e+1) % 4]
+        mid = ((a[0]+b[0])//2, (a[1]+b[1])//2)
+        finer = padded[neighbours[e][0]+1, neighbours[e][1]+1]
+        triangles.append(np.where(finer, (center, a, mid), (center, a, b)))
+        triangles.append(np.stack((center, mid, b))[..., finer])
+    return np.concatenate(triangles, axis=-1)
+
+
+def decimate(surface: SurfaceType, tolerance: float) -> MeshType:
+    '''
+    triangulate a surface with a restricted quadtree, such that it deviates
+    from the heightmap by about `tolerance` at most: flat regions get large
+    triangles, and rough ones (e.g. crater rims) small ones.
+
+    The quadtree needs a square grid of 2**k + 1 samples, so other surfaces
+    are resampled to one first (see `gazebo_size`).
+    '''
+    x, y, z, *_ = surface
+    n = gazebo_size(max(z.shape))
+    if z.shape != (n, n):
+        x, y = np.linspace(x[0], x[-1], n), np.linspace(y[0], y[-1], n)
+        z = HeightfieldSampler(surface)(*np.meshgrid(x, y, indexing='ij'))
+
+    splits = quadtree_splits(z, tolerance)
+    triangles = []
+    for level, split in enumerate(splits):
+        parent = np.ones((1, 1), bool) if level == len(splits) - 1 else \
+            splits[level+1].repeat(2, axis=0).repeat(2, axis=1)
+        triangles.append(_leaf_triangles(splits, level, parent & ~split))
+    i, j = np.concatenate(triangles, axis=-1).transpose((1, 2, 0))
+
+    # keep the vertices which are used
+    used, index = np.unique(i*n + j, return_inverse=True)
+    vi, vj = np.divmod(used, n)
+    vertices = np.stack((x[vi], y[vj], z[vi, vj]), axis=-1)
+    return vertices, index.reshape(i.shape).astype(np.intp)
+
+
+def terrain_lods(
+        surface: SurfaceType,
+        collision_tolerance: float = 0.05,
+        visual_tolerance: float = 0.01
+) -> dict[str, MeshType]:
+    '''
+    a coarse mesh for collisions (physics), and a finer one for visuals,
+    with the given vertical tolerances
+    '''
+    return {
+        'collision': decimate(surface, collision_tolerance),
+        'visual': decimate(surface, visual_tolerance),
+    }
+
+
+def triangle_normals(mesh: MeshType) -> NDArray[np.float64]:
+    '''the unit normals of the triangles of a mesh'''
+    vertices, triangles = mesh
+    a, b, c = (vertices[triangles[:, k]] for k in range(3))
+    normals = np.cross(b - a, c - a)
+    return normals / np.linalg.norm(normals, axis=-1, keepdims=True)
+
+
+def write_obj(filename: str | os.PathLike, mesh: MeshType) -> None:
+    '''write a mesh to a Wavefront OBJ file'''
+    vertices, triangles = mesh
+    with open(filename, 'w') as file:
+        np.savetxt(file, vertices, fmt='v %.6f %.6f %.6f')
+        np.savetxt(file, triangles + 1, fmt='f %d %d %d')
+
+
+def write_stl(filename: str | os.PathLike, mesh: MeshType) -> None:
+    '''write a mesh to a binary STL file'''
+    vertices, triangles = mesh
+    records = np.zeros(len(triangles), np.dtype([
+        ('normal', '<f4', 3), ('vertices', '<f4', (3, 3)), ('attr', '<u2')
+    ]))
+    records['normal'] = triangle_normals(mesh)
+    records['vertices'] = vertices[triangles]
+    with open(filename, 'wb') as file:
+        file.write(b'moon_gen terrain'.ljust(80, b' '))
+        file.write(struct.pack('<I', len(triangles)))
+        file.write(records.tobytes())
+
+
+def write_dae(filename: str | os.PathLike, mesh: MeshType) -> None:
+    '''write a mesh to a (minimal) COLLADA file'''
+    vertices, triangles = mesh
+    positions = ' '.join(f'{v:.6f}' for v in vertices.ravel())
+    indices = ' '.join(map(str, triangles.ravel()))
+    with open(filename, 'w') as file:
+        file.write(f'''<?xml version="1.0" encoding="utf-8"?>
+<COLLADA xmlns="http://www.collada.org/2005/11/COLLADASchema" version="1.4.1">
+  <asset><unit name="meter" meter="1"/><up_axis>Z_UP</up_axis></asset>
+  <library_geometries>
+    <geometry id="terrain" name="terrain">
+      <mesh>
+        <source id="terrain-positions">
+          <float_array id="terrain-array" count="{vertices.size}">\
+{positions}</float_array>
+          <technique_common>
+            <accessor source="#terrain-array" count="{len(vertices)}" \
+stride="3">
+              <param name="X" type="float"/>
+              <param name="Y" type="float"/>
+              <param name="Z" type="float"/>
+            </accessor>
+          </technique_common>
+        </source>
+        <vertices id="terrain-vertices">
+          <input semantic="POSITION" source="#terrain-positions"/>
+        </vertices>
+        <triangles count="{len(triangles)}">
+          <input semantic="VERTEX" source="#terrain-vertices" offset="0"/>
+          <p>{indices}</p>
+        </triangles>
+      </mesh>
+    </geometry>
+  </library_geometries>
+  <library_visual_scenes>
+    <visual_scene id="scene">
+      <node id="terrain-node">
+        <instance_geometry url="#terrain"/>
+      </node>
+    </visual_scene>
+  </library_visual_scenes>
+  <scene><instance_visual_scene url="#scene"/></scene>
+</COLLADA>
+''')
+
+
+def export_mesh(mesh: MeshType, filename: str | os.PathLike) -> None:
+    '''write a mesh, in the format given by the file extension'''
+    writers = {'.obj': write_obj, '.stl': write_stl, '.dae': write_dae}
+    extension = os.path.splitext(filename)[1].casefold()
+    if extension not in writers:
+        raise ValueError(f"unsupported mesh format `{extension}`")
+    writers[extension](filename, mesh)
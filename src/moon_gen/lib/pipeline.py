@@ -0,0 +1,327 @@
+'''
+PIPELINE.PY
+
+This submodule contains declarative surface recipes, i.e. sequences of
+generation stages (background, craters, wasting, noise, ...), and the
+engine which executes them.
+'''
+
+import os
+import abc
+import typing
+
+import numpy as np
+from numpy.typing import NDArray
+
+from moon_gen.lib.catalog import CraterCatalog
+from moon_gen.lib.craters import (
+    CraterProfile, ejecta_brightness, erode_thermal, make_craters,
+    waste_gaussian,
+)
+from moon_gen.lib.distributions import PowerDistribution
+from moon_gen.lib.heightmaps import perlin_multiscale_grid, surface_psd_nominal
+
+
+class Context:
+    '''the state shared by the stages of a recipe while it is executed'''
+
+    def __init__(
+            self,
+            x: NDArray[np.float64],
+            y: NDArray[np.float64],
+            rng: np.random.Generator,
+            workers: int | None = None,
+            tile: int | None = None,
+            albedo: NDArray[np.float64] | None = None
+    ) -> None:
+        self.x = x
+        self.y = y
+        self.rng = rng
+        self.workers = workers
+        self.tile = tile
+        self.albedo = albedo
+        self.resolution = np.ptp(x)/len(x)
+        self.craters = np.zeros((0, 3))
+        self.ages = np.zeros(0)
+
+
+class Stage(abc.ABC):
+    '''
+    a stage of a recipe, which transforms the elevation `z`.
+    Elementwise stages (which only depend on each sample) derive from
+    `ElementwiseStage` instead, so that the engine can fuse consecutive
+    ones into a single pass over `z`.
+    '''
+    elementwise = False
+
+    @abc.abstractmethod
+    def __call__(self, z: NDArray[np.float64],
+                 context: Context) -> NDArray[np.float64]:
+        '''the transformed elevation'''
+
+    def __add__(self, other: 'Stage | Recipe') -> 'Recipe':
+        return Recipe([self]) + other
+
+    def __repr__(self) -> str:
+        params = ', '.join(f'{k}={v!r}' for k, v in vars(self).items())
+        return f'{self.__class__.__name__}({params})'
+
+
+class ElementwiseStage(Stage):
+    '''
+    a stage which only depends on each sample, and transforms `z` block
+    by block of rows (see `apply`)
+    '''
+    elementwise = True
+
+    def __call__(self, z, context):
+        return _fused([self], z, context)
+
+    @abc.abstractmethod
+    def apply(self, block: NDArray[np.float64], context: Context,
+              state: typing.Any) -> None:
+        '''transform a block of rows of `z`, in place'''
+
+    def prepare(self, context: Context) -> typing.Any:
+        '''the state of the stage, shared by its blocks'''
+        return None
+
+
+class Background(Stage):
+    '''
+    replace the elevation with a background: multiscale perlin noise, or
+    the result of `source(x, y)` (e.g. a `DEMSource`).
+    Without a `seed`, the noise is seeded from the recipe's generator.
+    '''
+
+    def __init__(
+            self,
+            octaves: int = 6,
+            psd: typing.Callable[[float], float] = surface_psd_nominal,
+            source: typing.Callable | None = None,
+            seed: int | None = None
+    ) -> None:
+        self.octaves = octaves
+        self.psd = psd
+        self.source = source
+        self.seed = seed
+
+    def __call__(self, z, context):
+        if self.source is not None:
+            return self.source(context.x, context.y)
+        seed = self.seed
+        if seed is None:
+            seed = int(context.rng.integers(2**31))
+        return perlin_multiscale_grid(context.x, context.y,
+                                      octaves=self.octaves, psd=self.psd,
+                                      seed=seed)
+
+
+class UniformNoise(ElementwiseStage):
+    '''add uniform noise in [0, `amplitude`)'''
+
+    def __init__(self, amplitude: float) -> None:
+        self.amplitude = amplitude
+
+    def prepare(self, context):
+        return np.random.default_rng(context.rng.integers(2**63))
+
+    def apply(self, block, context, state):
+        block += self.amplitude*state.random(block.shape)
+
+
+class GaussianNoise(ElementwiseStage):
+    '''
+    add gaussian noise (e.g. micro-meteorite impacts), with a standard
+    deviation of `scale` grid cells
+    '''
+
+    def __init__(self, scale: float) -> None:
+        self.scale = scale
+
+    def prepare(self, context):
+        return np.random.default_rng(context.rng.integers(2**63))
+
+    def apply(self, block, context, state):
+        block += state.normal(scale=self.scale*context.resolution,
+                              size=block.shape)
+
+
+class CraterPopulation(Stage):
+    '''
+    draw the craters of a size-frequency distribution over the surface,
+    ignoring those smaller than `min_cells` grid cells. They are made by
+    the following `Impacts` stages.
+    '''
+
+    def __init__(self, distribution: PowerDistribution,
+                 min_cells: float = 4.) -> None:
+        self.distribution = distribution
+        self.min_cells = min_cells
+
+    def __call__(self, z, context):
+        distribution = self.distribution.truncated(
+            d_min=self.min_cells*np.ptp(context.x)/len(context.x))
+        context.craters = np.stack(
+            distribution.sample(context.x, context.y, context.rng), axis=-1)
+        context.ages = np.zeros(len(context.craters))
+        print(f"generating {len(context.craters)} craters")
+        return z
+
+
+class Impacts(Stage):
+    '''
+    make the `epoch`-th of `epochs` equal shares of the crater population,
+    recording their `age` (in the units of the durations of `Wasting`, as
+    for `ejecta_brightness`; the `epochs`-th share is the remainder), and
+    painting their ejecta into the albedo map with the given `brightness`
+    '''
+
+    def __init__(self, epoch: int, epochs: int, age: float = 0.,
+                 profile: CraterProfile | None = None,
+                 brightness: float = 1.) -> None:
+        self.epoch = epoch
+        self.epochs = epochs
+        self.age = age
+        self.profile = profile
+        self.brightness = brightness
+
+    def __call__(self, z, context):
+        per_epoch = len(context.craters)//self.epochs
+        stop = None if self.epoch == self.epochs else \
+            (self.epoch + 1)*per_epoch
+        share = slice(self.epoch*per_epoch, stop)
+        context.ages[share] = self.age
+        cx, cy, d = context.craters[share].T
+        return make_craters(context.x, context.y, z, d/2, (cx, cy),
+                            self.profile, workers=context.workers,
+                            albedo=context.albedo,
+                            brightness=self.brightness,
+                            rng=np.random.default_rng(
+                                context.rng.integers(2**63)))
+
+
+class Wasting(Stage):
+    '''mass wasting, as a gaussian blur (see `waste_gaussian`)'''
+
+    def __init__(self, duration: float) -> None:
+        self.duration = duration
+
+    def __call__(self, z, context):
+        return waste_gaussian(z, context.resolution, self.duration,
+                              tile=context.tile)
+
+
+class ThermalErosion(Stage):
+    '''mass wasting of the slopes steeper than `angle` (see `erode_thermal`)'''
+
+    def __init__(self, angle: float = 35., iterations: int = 10000) -> None:
+        self.angle = angle
+        self.iterations = iterations
+
+    def __call__(self, z, context):
+        return erode_thermal(z, context.resolution, self.angle,
+                             iterations=self.iterations)
+
+
+class Recipe:
+    '''a sequence of stages, which describes how to generate a surface'''
+
+    def __init__(self, stages: typing.Iterable[Stage] = ()) -> None:
+        self.stages = list(stages)
+
+    def __add__(self, other: 'Stage | Recipe') -> 'Recipe':
+        if isinstance(other, Stage):
+            other = Recipe([other])
+        return Recipe(self.stages + other.stages)
+
+    def __iter__(self) -> typing.Iterator[Stage]:
+        return iter(self.stages)
+
+    def __repr__(self) -> str:
+        return 'Recipe([\n' + ''.join(f'    {s!r},\n' for s in self) + '])'
+
+
+def weathered_craters(
+        distribution: PowerDistribution,
+        epochs: int = 6,
+        micro_noise: float | None = 2e-2,
+        profile: CraterProfile | None = None
+) -> Recipe:
+    '''
+    the craters of a distribution, made over `epochs`, oldest first, with
+    mass wasting after each epoch in proportion to the time left, then
+    micro-meteorite noise (of `micro_noise` grid cells) and the remaining
+    craters, unweathered. The ejecta of older craters are darker (see
+    `ejecta_brightness`).
+    '''
+    stages: list[Stage] = [CraterPopulation(distribution)]
+    for k, w in enumerate(reversed(range(epochs))):
+        stages.append(Impacts(k, epochs, w/epochs, profile,
+                              float(ejecta_brightness(w/epochs))))
+        if w > 0:
+            stages.append(Wasting(w/epochs))
+    if micro_noise is not None:
+        stages.append(GaussianNoise(micro_noise))
+    stages.append(Impacts(epochs, epochs, 0., profile))
+    return Recipe(stages)
+
+
+def _fused(
+        stages: list[ElementwiseStage],
+        z: NDArray[np.float64],
+        context: Context,
+        rows: int = 64
+) -> NDArray[np.float64]:
+    '''apply consecutive elementwise stages in a single pass over `z`'''
+    states = [s.prepare(context) for s in stages]
+    for i in range(0, len(z), rows):
+        for stage, state in zip(stages, states):
+            stage.apply(z[i:i+rows], context, state)
+    return z
+
+
+def run_recipe(
+        recipe: Recipe,
+        x: NDArray[np.float64],
+        y: NDArray[np.float64],
+        seed: int | None = None,
+        workers: int | None = None,
+        tile: int | None = None,
+        return_catalog: bool = False,
+        albedo: NDArray[np.float64] | None = None
+) -> NDArray[np.float64] | tuple[NDArray[np.float64], CraterCatalog]:
+    '''
+    execute a recipe on the grid spanned by `x` and `y`.
+
+    Consecutive elementwise stages are fused into one pass over `z`,
+    craters are stamped in parallel on `workers` threads (all cores by
+    default) with the small ones splatted in batches, and stencil stages
+    run in tiles of `tile` samples for grids too large for that (by
+    default, grids larger than 4096 x 4096).
+
+    If an `albedo` map is given (of the shape of `z`), the ejecta of the
+    craters are painted into it as they are made.
+    '''
+    if workers is None:
+        workers = os.cpu_count()
+    if tile is None and len(x)*len(y) > 2**24:
+        tile = 1024
+    context = Context(x, y, np.random.default_rng(seed), workers, tile,
+                      albedo)
+
+    z = np.zeros((len(x), len(y)))
+    stages = list(recipe)
+    while stages:
+        if stages[0].elementwise:
+            n = next((k for k, s in enumerate(stages) if not s.elementwise),
+                     len(stages))
+            z = _fused(stages[:n], z, context)
+            stages = stages[n:]
+        else:
+            z = stages.pop(0)(z, context)
+
+    if return_catalog:
+        cx, cy, d = context.craters.T
+        return z, CraterCatalog.from_arrays(d/2, (cx, cy), context.ages)
+    return z
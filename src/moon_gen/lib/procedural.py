@@ -0,0 +1,362 @@
+'''
+PROCEDURAL.PY
+
+This submodule contains functions for evaluating a deterministic,
+resolution-independent terrain at arbitrary points, without generating
+a full grid.
+'''
+
+import typing
+
+import numpy as np
+from numpy.typing import NDArray
+
+from moon_gen.lib.catalog import CraterCatalog
+from moon_gen.lib.distributions import (
+    PowerDistribution,
+    crater_density_young,
+    surface_psd_nominal,
+)
+from moon_gen.lib.craters import (
+    CraterProfile,
+    crater_profile,
+    cell_key,
+    procedural_craters,
+    procedural_craters_near,
+)
+from moon_gen.lib.heightmaps import perlin_multiscale_points
+
+
+class ProceduralTerrain:
+    '''
+    a recipe for a deterministic terrain: a multiscale perlin background,
+    with procedurally placed craters on top (see `procedural_craters`).
+
+    Since nothing depends on a grid, the terrain can be evaluated at any
+    point (see `height_at`).
+    '''
+
+    def __init__(
+            self,
+            cycle: float = 20.,
+            octaves: int = 6,
+            psd: typing.Callable[[float], float] = surface_psd_nominal,
+            distribution: PowerDistribution = crater_density_young.truncated(
+                d_min=0.5),
+            d_max: float | None = None,
+            profile: CraterProfile = crater_profile(noise=0.)
+    ) -> None:
+        '''
+        Args:
+        * cycle :         the longest wavelength of the background
+        * octaves :       the number of octaves of the background
+        * psd :           the power spectral density of the background
+        * distribution :  the size-frequency distribution of the craters
+        * d_max :         the largest crater diameter
+        * profile :       the profile of the craters
+        '''
+        self.cycle = cycle
+        self.octaves = octaves
+        self.psd = psd
+        self.distribution = distribution
+        self.d_max = d_max
+        self.profile = profile
+
+    def background(self, xs: NDArray[np.float64], ys: NDArray[np.float64],
+                   seed: int = 0) -> NDArray[np.float64]:
+        '''the background elevation at the points `(xs, ys)`'''
+        return perlin_multiscale_points(xs, ys, self.cycle, self.octaves,
+                                        self.psd, seed)
+
+    def craters_near(self, xs: NDArray[np.float64], ys: NDArray[np.float64],
+                     seed: int = 0) -> NDArray[np.float64]:
+        '''
+        the craters which may cover the points `(xs, ys)`, stacked as
+        (centers, radii, ages), oldest first
+        '''
+        cx, cy, d, age = procedural_craters_near(
+            xs, ys, self.distribution, self.d_max, seed, self.profile.extent
+        )
+        return np.stack((cx, cy, d/2, age))
+
+    def catalog(self, x_range: tuple[float, float],
+                y_range: tuple[float, float],
+                seed: int = 0) -> CraterCatalog:
+        '''the catalog of the craters which intersect the given region'''
+        cx, cy, d, age = procedural_craters(
+            x_range, y_range, self.distribution, self.d_max, seed,
+            self.profile.extent
+        )
+        return CraterCatalog.from_arrays(d/2, (cx, cy), age)
+
+
+def _bucket_pairs(
+        xs: NDArray[np.float64],
+        ys: NDArray[np.float64],
+        craters: NDArray[np.float64],
+        reach: NDArray[np.float64],
+        bucket: float
+) -> tuple[NDArray[np.intp], NDArray[np.intp]]:
+    '''
+    the (point, crater) pairs for which the point lies within `reach` of
+    the crater, using a uniform grid of buckets no smaller than `reach`
+    '''
+    cx, cy = craters[0], craters[1]
+    keys = cell_key(np.floor(cx/bucket).astype(np.int64),
+                    np.floor(cy/bucket).astype(np.int64))
+    order = np.argsort(keys)
+    keys, first, count = np.unique(keys[order], return_index=True,
+                                   return_counts=True)
+
+    bx = np.floor(xs/bucket).astype(np.int64)
+    by = np.floor(ys/bucket).astype(np.int64)
+    points, indices = [], []
+    for di in (-1, 0, 1):
+        for dj in (-1, 0, 1):
+            key = cell_key(bx+di, by+dj)
+            k = np.minimum(np.searchsorted(keys, key), len(keys)-1)
+            lo, n = first[k], np.where(keys[k] == key, count[k], 0)
+            p = np.repeat(np.arange(len(xs)), n)
+            c = order[np.repeat(lo - np.cumsum(n) + n, n) + np.arange(len(p))]
+
+            near = (xs[p]-cx[c])**2 + (ys[p]-cy[c])**2 < reach[c]**2
+            points.append(p[near])
+            indices.append(c[near])
+
+    return np.concatenate(points), np.concatenate(indices)
+
+
+def _crater_pairs(
+        xs: NDArray[np.float64],
+        ys: NDArray[np.float64],
+        craters: NDArray[np.float64],
+        extent: float
+) -> tuple[NDArray[np.intp], NDArray[np.intp]]:
+    '''
+    the (point, crater) pairs for which the point lies in the crater's
+    footprint. The craters are split into dyadic size levels, each indexed
+    in a uniform grid of buckets as large as its largest footprint, so only
+    neighbouring buckets need to be checked.
+    '''
+    reach = extent*craters[2]
+    levels = np.ceil(np.log2(reach))
+    points, indices = [np.zeros(0, np.intp)], [np.zeros(0, np.intp)]
+    for level in np.unique(levels):
+        subset = np.flatnonzero(levels == level)
+        p, c = _bucket_pairs(xs, ys, craters[:, subset], reach[subset],
+                             2**level)
+        points.append(p)
+        indices.append(subset[c])
+    return np.concatenate(points), np.concatenate(indices)
+
+
+def _compose(
+        z: NDArray[np.float64],
+        xs: NDArray[np.float64],
+        ys: NDArray[np.float64],
+        craters: NDArray[np.float64],
+        bases: NDArray[np.float64],
+        pairs: tuple[NDArray[np.intp], NDArray[np.intp]],
+        profile: CraterProfile,
+        inside: bool = False
+) -> NDArray[np.float64]:
+    '''
+    apply the craters to the elevations `z` of the points, in place.
+    Each point sees its craters oldest first: the k-th crater of every
+    point is applied in the k-th vectorized round.
+    With `inside`, the bowls only cut the points inside them (see
+    `_floors`).
+    '''
+    p, c = pairs
+    order = np.lexsort((c, p))  # craters are sorted oldest first
+    p, c = p[order], c[order]
+
+    # rank of each pair among the pairs of its point
+    first = np.flatnonzero(np.r_[True, p[1:] != p[:-1]])
+    rank = np.arange(len(p)) - np.repeat(first, np.diff(np.r_[first, len(p)]))
+
+    order = np.argsort(rank, kind='stable')
+    for r in np.split(order, np.flatnonzero(np.diff(rank[order])) + 1):
+        pr, cr = p[r], c[r]
+        cx, cy, radius, _ = craters[:, cr]
+        s = ((xs[pr]-cx)**2 + (ys[pr]-cy)**2) / radius**2
+        bowl = bases[cr] + radius*profile.bowl(s)
+        if inside:
+            bowl[s >= 1] = np.inf
+        z[pr] = np.minimum(bowl, z[pr] + radius*profile.ejecta(s))
+    return z
+
+
+def _older_craters(
+        craters: NDArray[np.float64],
+        near: typing.Callable[[NDArray[np.float64], NDArray[np.float64]],
+                              NDArray[np.float64]],
+        extent: float
+) -> tuple[NDArray[np.float64], NDArray[np.bool_]]:
+    '''
+    add to `craters` the older craters which cover their centers, and
+    recursively those which cover the centers of the older craters whose
+    bowl lies over them, since their floors are needed too (see
+    `_floors`). `near(xs, ys)` gives the craters which may cover the
+    points `(xs, ys)`.
+
+    Returns the distinct craters, oldest first, and which of them need
+    their floor. Ties in age are broken by position and radius, so the
+    order does not depend on the query.
+    '''
+    craters = np.unique(craters, axis=1)
+    expanded = np.ones(craters.shape[1], bool)
+    frontier = craters
+    while frontier.shape[1]:
+        found = near(frontier[0], frontier[1])
+        p, c = _crater_pairs(frontier[0], frontier[1], found, extent)
+        older = found[3, c] >= frontier[3, p]
+        p, c = p[older], c[older]
+        bowl = (frontier[0, p] - found[0, c])**2 + \
+            (frontier[1, p] - found[1, c])**2 < found[2, c]**2
+
+        # merge the older craters found, and expand those not yet expanded
+        n = craters.shape[1]
+        craters, index = np.unique(np.concatenate((craters, found), axis=1),
+                                   axis=1, return_inverse=True)
+        index = index.ravel()
+        known = np.zeros(craters.shape[1], bool)
+        known[index[:n]] = known[index[n + c]] = True
+        needed = np.zeros(craters.shape[1], bool)
+        needed[index[n + c[bowl]]] = True
+        was_expanded = np.zeros(craters.shape[1], bool)
+        was_expanded[index[:n]] = expanded
+        needed &= ~was_expanded
+
+        craters, needed = craters[:, known], needed[known]
+        expanded = was_expanded[known] | needed
+        frontier = craters[:, needed]
+
+    order = np.lexsort((craters[2], craters[1], craters[0], -craters[3]))
+    return craters[:, order], expanded[order]
+
+
+def _floors(
+        craters: NDArray[np.float64],
+        needed: NDArray[np.bool_],
+        background: typing.Callable[[NDArray[np.float64],
+                                     NDArray[np.float64]],
+                                    NDArray[np.float64]],
+        profile: CraterProfile
+) -> NDArray[np.float64]:
+    '''
+    the floor of each `needed` crater, i.e. the elevation at its center
+    before the impact (`nan` for the others).
+
+    The older craters are applied over the center as usual, except that
+    their bowl only cuts the centers which lie inside it. Their own floors
+    are thus only needed for the centers inside their bowl, which keeps
+    the craters a floor depends on few and close, whichever points are
+    queried (see `_older_craters`).
+    '''
+    centers = np.flatnonzero(needed)
+    cx, cy = craters[0, centers], craters[1, centers]
+    q, c = _crater_pairs(cx, cy, craters, profile.extent)
+    older = c < centers[q]
+    q, c = q[older], c[older]
+
+    # each floor depends on the floors of the older craters whose bowl
+    # covers its center, which are settled in earlier generations
+    bowl = (cx[q] - craters[0, c])**2 + (cy[q] - craters[1, c])**2 < \
+        craters[2, c]**2
+    generation = np.zeros(craters.shape[1], np.intp)
+    while True:
+        deeper = generation.copy()
+        np.maximum.at(deeper, centers[q[bowl]], generation[c[bowl]] + 1)
+        if np.array_equal(deeper, generation):
+            break
+        generation = deeper
+
+    floors = np.full(craters.shape[1], np.nan)
+    for g in np.unique(generation[centers]):
+        at = generation[centers] == g
+        pairs = at[q]
+        rank = np.cumsum(at) - 1
+        floors[centers[at]] = _compose(
+            background(cx[at], cy[at]), cx[at], cy[at], craters, floors,
+            (rank[q[pairs]], c[pairs]), profile, inside=True
+        )
+    return floors
+
+
+def _height_at(
+        xs: NDArray[np.float64],
+        ys: NDArray[np.float64],
+        recipe: ProceduralTerrain,
+        seed: int,
+        catalog: CraterCatalog | None = None
+) -> NDArray[np.float64]:
+    '''the elevation of the terrain at the (nearby) points `(xs, ys)`'''
+    profile = recipe.profile
+
+    def near(xs: NDArray[np.float64],
+             ys: NDArray[np.float64]) -> NDArray[np.float64]:
+        if catalog is None:
+            return recipe.craters_near(xs, ys, seed)
+        found = catalog.in_box((xs.min(), xs.max()), (ys.min(), ys.max()),
+                               profile.extent)
+        return np.stack((found.x, found.y, found.radius, found.age))
+
+    # the floor of each crater is relative to the elevation at its
+    # center before the impact, which includes the older craters
+    craters = near(xs, ys)
+    pairs = _crater_pairs(xs, ys, craters, profile.extent)
+    craters, needed = _older_craters(craters[:, np.unique(pairs[1])], near,
+                                     profile.extent)
+    bases = _floors(craters, needed,
+                    lambda x, y: recipe.background(x, y, seed), profile)
+
+    z = recipe.background(xs, ys, seed)
+    return _compose(z, xs, ys, craters, bases,
+                    _crater_pairs(xs, ys, craters, profile.extent), profile)
+
+
+def height_at(
+        xs: NDArray[np.float64],
+        ys: NDArray[np.float64],
+        recipe: ProceduralTerrain,
+        seed: int = 0,
+        chunk: int = 2**16,
+        catalog: CraterCatalog | None = None
+) -> NDArray[np.float64]:
+    '''
+    evaluate the elevation of a procedural terrain at arbitrary points.
+
+    The points are processed in spatially coherent chunks of `chunk`
+    points, and only the craters near each chunk are placed, so sparse
+    queries do not require generating a full grid. The elevations do not
+    depend on how the points are chunked.
+    If a `catalog` of the craters (see `ProceduralTerrain.catalog`) is
+    given, the craters are looked up instead of being placed again.
+    '''
+    xs, ys = np.broadcast_arrays(np.asarray(xs, np.float64),
+                                 np.asarray(ys, np.float64))
+    z = np.empty(xs.shape)
+    flat_x, flat_y, flat_z = xs.ravel(), ys.ravel(), z.reshape(-1)
+
+    # sort the points along a coarse grid, so that chunks are compact
+    coarse = recipe.cycle/4
+    order = np.lexsort((flat_y, np.floor(flat_y/coarse),
+                        np.floor(flat_x/coarse)))
+    for start in range(0, len(order), chunk):
+        idx = order[start:start+chunk]
+        flat_z[idx] = _height_at(flat_x[idx], flat_y[idx], recipe, seed,
+                                 catalog)
+    return z
+
+
+def height_grid(
+        x: NDArray[np.float64],
+        y: NDArray[np.float64],
+        recipe: ProceduralTerrain,
+        seed: int = 0,
+        catalog: CraterCatalog | None = None
+) -> NDArray[np.float64]:
+    '''evaluate a procedural terrain on the grid spanned by `x` and `y`'''
+    return height_at(*np.meshgrid(x, y, indexing='ij'), recipe, seed,
+                     catalog=catalog)
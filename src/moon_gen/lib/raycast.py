@@ -0,0 +1,221 @@
+'''
+RAYCAST.PY
+
+This submodule contains functions for intersecting rays with a surface,
+e.g. to simulate lidar or stereo cameras, using a maximum-mipmap of the
+heightmap to skip over empty space.
+'''
+
+import math
+
+import numpy as np
+from numpy.typing import NDArray
+
+from moon_gen.lib.utils import SurfaceType
+
+
+def max_mipmap(z: NDArray[np.float64]) -> list[NDArray[np.float64]]:
+    '''
+    the maximum-mipmap of a heightmap : level 0 holds the highest corner of
+    each grid cell, and each following level the maximum over 2x2 cells of
+    the previous one, down to a single cell.
+    '''
+    level = np.maximum(np.maximum(z[:-1, :-1], z[1:, :-1]),
+                       np.maximum(z[:-1, 1:], z[1:, 1:]))
+    levels = [level]
+    while level.shape != (1, 1):
+        nx, ny = level.shape
+        padded = np.full((nx + nx % 2, ny + ny % 2), -np.inf)
+        padded[:nx, :ny] = level
+        level = padded.reshape((-1, 2, padded.shape[1]//2, 2)).max(axis=(1, 3))
+        levels.append(level)
+    return levels
+
+
+def _enter_grid(
+        origins: NDArray[np.float64],
+        directions: NDArray[np.float64],
+        shape: tuple[int, int]
+) -> tuple[NDArray[np.float64], NDArray[np.float64]]:
+    '''the interval of the rays' parameter over the (grid coordinate) box'''
+    t_in, t_out = np.zeros(origins.shape[1]), np.full(origins.shape[1], np.inf)
+    for o, d, n in zip(origins[:2], directions[:2], shape):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t0, t1 = (0 - o)/d, (n - 1 - o)/d
+        inside = (o >= 0) & (o <= n - 1)
+        t0 = np.where(d == 0, np.where(inside, -np.inf, np.inf), t0)
+        t1 = np.where(d == 0, np.where(inside, np.inf, -np.inf), t1)
+        t_in = np.maximum(t_in, np.minimum(t0, t1))
+        t_out = np.minimum(t_out, np.maximum(t0, t1))
+    return t_in, t_out
+
+
+def _cell_exit(
+        o: NDArray[np.float64],
+        d: NDArray[np.float64],
+        cell: NDArray[np.int64],
+        size: NDArray[np.int64]
+) -> NDArray[np.float64]:
+    '''the parameter at which the rays leave their cells along one axis'''
+    bound = np.where(d > 0, (cell + 1)*size, cell*size)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(d == 0, np.inf, (bound - o)/d)
+
+
+def _patch_intersection(
+        z: NDArray[np.float64],
+        i: NDArray[np.int64],
+        j: NDArray[np.int64],
+        start: NDArray[np.float64],
+        d: NDArray[np.float64],
+        length: NDArray[np.float64]
+) -> NDArray[np.float64]:
+    '''
+    the parameter (from `start`, within `length`) of the first intersection
+    of the rays with the bilinear patches of the cells `(i, j)`, or `inf`
+    '''
+    a = z[i, j]
+    b, c = z[i+1, j] - a, z[i, j+1] - a
+    e = z[i+1, j+1] - a - b - c
+    u, v = start[0] - i, start[1] - j
+
+    # the ray's height above the patch is quadratic in the parameter
+    qa = -e*d[0]*d[1]
+    qb = d[2] - b*d[0] - c*d[1] - e*(u*d[1] + v*d[0])
+    qc = start[2] - a - b*u - c*v - e*u*v
+    with np.errstate(divide='ignore', invalid='ignore'):
+        q = -(qb + np.copysign(np.sqrt(qb*qb - 4*qa*qc), qb))/2
+        roots = np.stack((q/qa, qc/q))
+    roots = np.where(np.isnan(roots) | (roots < 0), np.inf, roots).min(axis=0)
+    return np.where(qc <= 0, 0, np.where(roots <= length, roots, np.inf))
+
+
+class HeightfieldRaycaster:
+    '''
+    intersects rays with the bilinear interpolant of a (uniformly gridded)
+    surface.
+
+    Rays are traversed as vectorized packets through a maximum-mipmap of the
+    heightmap: a ray climbs to coarser levels while it passes above them,
+    and only descends to the exact patch test where it may hit the surface.
+    '''
+
+    def __init__(self, surface: SurfaceType) -> None:
+        x, y, z, *_ = surface
+        self.origin = np.array([x[0], y[0], 0.])
+        self.spacing = np.array([(x[-1] - x[0]) / (len(x) - 1),
+                                 (y[-1] - y[0]) / (len(y) - 1), 1.])
+        self.z = z
+        self.levels = max_mipmap(z)
+
+    def intersect(
+            self,
+            origins: NDArray[np.float64],
+            directions: NDArray[np.float64],
+            t_max: float | NDArray[np.float64] = np.inf
+    ) -> NDArray[np.float64]:
+        '''
+        the parameter `t` at which each ray `origin + t*direction` first hits
+        the surface, or `inf` if it misses it (within `t_max`).
+        `origins` and `directions` have shape (3, n).
+        Rays which enter the grid below the surface hit it where they enter.
+        '''
+        o = (np.asarray(origins, np.float64).reshape((3, -1)) -
+             self.origin.reshape((3, 1))) / self.spacing.reshape((3, 1))
+        d = np.asarray(directions, np.float64).reshape((3, -1)) / \
+            self.spacing.reshape((3, 1))
+        t_in, t_out = _enter_grid(o, d, self.z.shape)
+        t_out = np.minimum(t_out, t_max)
+
+        hits = np.full(o.shape[1], np.inf)
+        active = np.flatnonzero(t_in <= t_out)
+        self._traverse(o[:, active], d[:, active], t_in[active],
+                       t_out[active], active, hits)
+        return hits
+
+    def _traverse(
+            self,
+            o: NDArray[np.float64],
+            d: NDArray[np.float64],
+            t: NDArray[np.float64],
+            t_out: NDArray[np.float64],
+            index: NDArray[np.intp],
+            hits: NDArray[np.float64]
+    ) -> None:
+        '''walk the active rays through the mipmap, recording their hits'''
+        top = len(self.levels) - 1
+        level = np.full(len(t), top)
+        # probe slightly past `t`, to find the cell being entered
+        nudge = 1e-9 / np.maximum(np.abs(d[:2]).max(axis=0), 1e-300)
+        while len(t):
+            p = o + (t + nudge)*d
+            size = np.left_shift(1, level)
+            ci = np.clip(np.floor(p[0]), 0, self.z.shape[0]-2).astype(np.int64)
+            cj = np.clip(np.floor(p[1]), 0, self.z.shape[1]-2).astype(np.int64)
+            ci, cj = ci >> level, cj >> level
+            t_exit = np.minimum(np.minimum(_cell_exit(o[0], d[0], ci, size),
+                                           _cell_exit(o[1], d[1], cj, size)),
+                                t_out)
+            z_low = o[2] + np.where(d[2] < 0, d[2]*t_exit, d[2]*t)
+
+            peak = np.empty(len(t))
+            for k in np.unique(level):
+                at = level == k
+                peak[at] = self.levels[k][ci[at], cj[at]]
+            below = z_low <= peak
+
+            hit = np.full(len(t), np.inf)
+            exact = below & (level == 0)
+            o_exact, d_exact, t_exact = o[:, exact], d[:, exact], t[exact]
+            hit[exact] = t_exact + _patch_intersection(
+                self.z, ci[exact], cj[exact], o_exact + t_exact*d_exact,
+                d_exact, t_exit[exact] - t_exact
+            )
+            hits[index[np.isfinite(hit)]] = hit[np.isfinite(hit)]
+
+            # descend where the ray may hit, otherwise advance and ascend
+            advance = ~below | exact
+            t = np.where(advance, t_exit, t)
+            level = np.where(advance, np.minimum(level + 1, top), level - 1)
+
+            keep = np.isfinite(t) & (t < t_out) & ~np.isfinite(hit)
+            o, d, t, t_out, index = o[:, keep], d[:, keep], t[keep], \
+                t_out[keep], index[keep]
+            level, nudge = level[keep], nudge[keep]
+
+    def cast(
+            self,
+            origins: NDArray[np.float64],
+            directions: NDArray[np.float64],
+            t_max: float | NDArray[np.float64] = np.inf
+    ) -> NDArray[np.float64]:
+        '''the points at which the rays hit the surface (`nan` on misses)'''
+        origins = np.asarray(origins, np.float64).reshape((3, -1))
+        directions = np.asarray(directions, np.float64).reshape((3, -1))
+        t = self.intersect(origins, directions, t_max)
+        with np.errstate(invalid='ignore'):
+            points = origins + t*directions
+        points[:, ~np.isfinite(t)] = np.nan
+        return points
+
+
+def lidar_rays(
+        position: tuple[float, float, float],
+        beams: int = 64,
+        azimuths: int = 1024,
+        elevation: tuple[float, float] = (-25., 5.),
+        heading: float = 0.
+) -> tuple[NDArray[np.float64], NDArray[np.float64]]:
+    '''
+    the origins and (unit) directions of a full sweep of a spinning lidar at
+    `position`, with `beams` beams spread over the `elevation` range
+    (in degrees) and `azimuths` firings per revolution
+    '''
+    el = np.radians(np.linspace(*elevation, beams)).reshape((-1, 1))
+    az = (np.radians(heading) +
+          np.linspace(0, 2*math.pi, azimuths, endpoint=False))
+    directions = np.stack(np.broadcast_arrays(np.cos(el)*np.cos(az),
+                                              np.cos(el)*np.sin(az),
+                                              np.sin(el))).reshape((3, -1))
+    origins = np.broadcast_to(np.reshape(position, (3, 1)), directions.shape)
+    return origins, directions
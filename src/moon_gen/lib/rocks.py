@@ -0,0 +1,340 @@
+'''
+ROCKS.PY
+
+This submodule contains a procedural generator of rock fields : the rocks
+of a size-frequency distribution are placed in hashed lattice cells (like
+the procedural craters), more densely on the ejecta of fresh craters, and
+stored in a compact structured array with a spatial hash for footprint
+queries. Rocks are exported as instanced placements of a few rock models,
+rather than as geometry.
+'''
+
+import os
+import typing
+
+import numpy as np
+from numpy.typing import NDArray
+
+from moon_gen.lib.catalog import CraterCatalog
+from moon_gen.lib.craters import (
+    CraterProfile, cell_index, cell_key, crater_footprint, crater_profile,
+    crater_size_classes, ejecta_brightness,
+)
+from moon_gen.lib.distributions import (
+    PowerDistribution, cash, cash_uniform, poisson_icdf, rock_density_typical,
+)
+from moon_gen.lib.sampling import HeightfieldSampler
+from moon_gen.lib.utils import SurfaceType
+
+ROCK_DTYPE = np.dtype([
+    ('x', np.float32),
+    ('y', np.float32),
+    ('diameter', np.float32),
+    ('height', np.float32),
+    ('yaw', np.float32),
+    ('model', np.uint16),
+])
+'''
+the record of a rock : its center, its diameter and height, its rotation
+about the vertical (in radians), and the index of its rock model
+'''
+
+INSTANCE_DTYPE = np.dtype([
+    ('model', np.uint16),
+    ('x', np.float32),
+    ('y', np.float32),
+    ('z', np.float32),
+    ('yaw', np.float32),
+    ('diameter', np.float32),
+    ('height', np.float32),
+])
+'''the record of an instanced rock placement, as exported'''
+
+RockinessType = tuple[NDArray[np.float64], NDArray[np.float64],
+                      NDArray[np.float64]]
+'''a rockiness map, as `(x, y, weight)` on a regular grid'''
+
+
+def _region_cells(
+        x_range: tuple[float, float],
+        y_range: tuple[float, float],
+        cell: float
+) -> tuple[NDArray[np.int64], NDArray[np.int64]]:
+    '''the lattice cells of size `cell` which intersect a region'''
+    (x0, x1), (y0, y1) = x_range, y_range
+    ci, cj = np.meshgrid(
+        np.arange(np.floor(x0/cell), np.floor(x1/cell)+1, dtype=np.int64),
+        np.arange(np.floor(y0/cell), np.floor(y1/cell)+1, dtype=np.int64),
+        indexing='ij'
+    )
+    return ci.ravel(), cj.ravel()
+
+
+def rockiness(
+        x_range: tuple[float, float],
+        y_range: tuple[float, float],
+        craters: CraterCatalog,
+        profile: CraterProfile | None = None,
+        freshness: typing.Callable = ejecta_brightness,
+        spacing: float = 1.
+) -> RockinessType:
+    '''
+    the weight (in [0, 1]) of the extra rocks of fresh craters over a
+    region, on a grid of `spacing` aligned with the origin : the blocks
+    excavated by a crater lie inside it and on its ejecta blanket (as its
+    fresh albedo, see `CraterProfile.brightness`), and are buried as the
+    crater weathers (`freshness(age)`, see `ejecta_brightness`).
+    '''
+    if profile is None:
+        profile = crater_profile()
+    (x0, x1), (y0, y1) = x_range, y_range
+    gx = spacing*np.arange(np.floor(x0/spacing), np.ceil(x1/spacing)+1)
+    gy = spacing*np.arange(np.floor(y0/spacing), np.ceil(y1/spacing)+1)
+    weight = np.zeros((len(gx), len(gy)))
+
+    craters = craters.in_box(x_range, y_range, profile.extent)
+    fresh = np.broadcast_to(freshness(craters.age), (len(craters),))
+    for k in np.flatnonzero(fresh > 1e-3):
+        crater = craters.craters[k]
+        center = (crater['x'], crater['y'])
+        sx, sy = crater_footprint(gx, gy, crater['radius'], center,
+                                  profile.extent)
+        ww = weight[sx, sy]
+        if ww.size == 0:
+            continue
+        s = ((gx[sx]-center[0])**2).reshape((-1, 1)) + \
+            ((gy[sy]-center[1])**2).reshape((1, -1))
+        s *= 1/crater['radius']**2
+        np.maximum(ww, fresh[k]*profile.brightness(s), out=ww)
+    return gx, gy, weight
+
+
+def _weight_at(
+        weight: RockinessType,
+        xs: NDArray[np.float64],
+        ys: NDArray[np.float64]
+) -> NDArray[np.float64]:
+    '''the rockiness at the points, from its nearest sample'''
+    gx, gy, w = weight
+    spacing = gx[1] - gx[0] if len(gx) > 1 else 1.
+    i = np.clip(np.rint((xs - gx[0])/spacing), 0, len(gx)-1).astype(np.intp)
+    j = np.clip(np.rint((ys - gy[0])/spacing), 0, len(gy)-1).astype(np.intp)
+    return w[i, j]
+
+
+def _rocky_cells(
+        weight: RockinessType,
+        cell: float
+) -> tuple[NDArray[np.int64], NDArray[np.int64]]:
+    '''the lattice cells of size `cell` where the rockiness isn't zero'''
+    gx, gy, w = weight
+    spacing = gx[1] - gx[0] if len(gx) > 1 else 1.
+    i, j = np.nonzero(w)
+    occupied = np.unique(cell_key(
+        np.floor(gx[i]/cell).astype(np.int64),
+        np.floor(gy[j]/cell).astype(np.int64)
+    ))
+    # the cells within half a sample of the rocky samples
+    m = int(np.ceil(spacing/(2*cell)))
+    di, dj = np.meshgrid(np.arange(-m, m+1), np.arange(-m, m+1))
+    near = np.unique(
+        occupied.reshape((-1, 1)) + cell_key(di.ravel(), dj.ravel())
+    )
+    return cell_index(near)
+
+
+def lattice_rocks(
+        distribution: PowerDistribution,
+        d_lo: float,
+        d_hi: float,
+        cell: float,
+        ci: NDArray[np.int64],
+        cj: NDArray[np.int64],
+        seed: int = 0,
+        models: int = 8,
+        rate: float = 1.,
+        weight: RockinessType | None = None
+) -> NDArray:
+    '''
+    the rocks with diameters between `d_lo` and `d_hi` placed in the
+    lattice cells `(ci, cj)` of size `cell`, as `ROCK_DTYPE` records. Each
+    cell deterministically yields its rocks from its hash, regardless of
+    the other cells queried (see `lattice_craters`).
+
+    The density is multiplied by `rate`, and if a rockiness map is given,
+    each rock is only kept with the probability of the rockiness under it.
+    '''
+    distribution = distribution.truncated(d_lo, d_hi)
+    key = cash(np.asarray(ci, np.int64), np.asarray(cj, np.int64), seed)
+
+    counts = poisson_icdf(rate*distribution.density*cell**2,
+                          cash_uniform(key, 0))
+    owner = np.repeat(np.arange(len(key)), counts)
+    m = np.arange(len(owner)) - np.repeat(np.cumsum(counts)-counts, counts)
+    key = key[owner]
+
+    rocks = np.zeros(len(owner), ROCK_DTYPE)
+    rocks['x'] = (ci[owner] + cash_uniform(key, m, 1)) * cell
+    rocks['y'] = (cj[owner] + cash_uniform(key, m, 2)) * cell
+    rocks['diameter'] = distribution.diameter(cash_uniform(key, m, 3))
+    # height-to-diameter ratios of about .5 (Demidov & Basilevsky, 2014)
+    rocks['height'] = rocks['diameter']*(.3 + .4*cash_uniform(key, m, 4))
+    rocks['yaw'] = 2*np.pi*cash_uniform(key, m, 5)
+    rocks['model'] = models*cash_uniform(key, m, 6)
+
+    if weight is not None:
+        rocks = rocks[cash_uniform(key, m, 7) <
+                      _weight_at(weight, rocks['x'], rocks['y'])]
+    return rocks
+
+
+def place_rocks(
+        x_range: tuple[float, float],
+        y_range: tuple[float, float],
+        distribution: PowerDistribution = rock_density_typical,
+        seed: int = 0,
+        craters: CraterCatalog | None = None,
+        boost: float = 10.,
+        profile: CraterProfile | None = None,
+        freshness: typing.Callable = ejecta_brightness,
+        spacing: float = 1.,
+        models: int = 8,
+        bucket: float = 4.
+) -> 'RockField':
+    '''
+    place the rocks of a size-frequency distribution (e.g.
+    `rock_density_typical`) centered in the region `x_range` x `y_range`.
+
+    The rocks of each size class are placed in hashed lattice cells (see
+    `lattice_rocks`), so a rock doesn't depend on the region queried. If a
+    crater catalog is given, up to `boost` times more rocks are placed on
+    the fresh craters (see `rockiness`), in the lattice cells they cover.
+
+    Returns the rocks as a `RockField`, hashed in buckets of `bucket`.
+    '''
+    weight = None
+    if craters is not None and len(craters) and boost > 0:
+        weight = rockiness(x_range, y_range, craters, profile, freshness,
+                           spacing)
+
+    rocks = []
+    for k, (d_lo, d_hi, cell) in enumerate(
+            crater_size_classes(distribution)):
+        rocks.append(lattice_rocks(
+            distribution, d_lo, d_hi, cell, *_region_cells(x_range, y_range,
+                                                           cell),
+            seed + 1000003*k, models
+        ))
+        if weight is not None:
+            rocks.append(lattice_rocks(
+                distribution, d_lo, d_hi, cell, *_rocky_cells(weight, cell),
+                seed + 1000003*k + 500009, models, boost, weight
+            ))
+
+    rocks = np.concatenate(rocks)
+    (x0, x1), (y0, y1) = x_range, y_range
+    return RockField(rocks[(rocks['x'] >= x0) & (rocks['x'] <= x1) &
+                           (rocks['y'] >= y0) & (rocks['y'] <= y1)], bucket)
+
+
+class RockField:
+    '''
+    a field of rocks, stored as a structured numpy array of `ROCK_DTYPE`
+    records sorted by the bucket of a spatial hash (of `bucket` x `bucket`
+    square buckets), so that the rocks of a region are found by looking up
+    the buckets it covers.
+    '''
+
+    def __init__(self, rocks: NDArray | None = None,
+                 bucket: float = 4.) -> None:
+        if rocks is None:
+            rocks = np.zeros(0, ROCK_DTYPE)
+        self.bucket = bucket
+        keys = self._keys(rocks['x'], rocks['y'])
+        if np.any(np.diff(keys) < 0):
+            order = np.argsort(keys, kind='stable')
+            rocks, keys = rocks[order], keys[order]
+        self.rocks = rocks
+        # the buckets, and where their rocks start
+        self._buckets, self._starts = np.unique(keys, return_index=True)
+        self._starts = np.append(self._starts, len(keys))
+
+    def _keys(self, xs: NDArray, ys: NDArray) -> NDArray[np.int64]:
+        '''the bucket of each point'''
+        return cell_key(np.floor(np.asarray(xs)/self.bucket).astype(np.int64),
+                        np.floor(np.asarray(ys)/self.bucket).astype(np.int64))
+
+    def __len__(self) -> int:
+        return len(self.rocks)
+
+    def _gather(self, x_range: tuple[float, float],
+                y_range: tuple[float, float]) -> NDArray:
+        '''the rocks of all the buckets which cover a box'''
+        ci, cj = _region_cells(x_range, y_range, self.bucket)
+        keys = cell_key(ci, cj)
+        k = np.searchsorted(self._buckets, keys)
+        k = k[(k < len(self._buckets)) & (self._buckets[
+            np.minimum(k, len(self._buckets) - 1)] == keys)]
+        if not len(k):
+            return self.rocks[:0]
+        return self.rocks[np.concatenate([
+            np.arange(self._starts[i], self._starts[i+1]) for i in k
+        ])]
+
+    def query(self, x: float, y: float, radius: float) -> NDArray:
+        '''the rocks centered within `radius` of `(x, y)`'''
+        rocks = self._gather((x - radius, x + radius),
+                             (y - radius, y + radius))
+        distance = np.hypot(rocks['x'] - x, rocks['y'] - y)
+        return rocks[distance <= radius]
+
+    def in_box(self, x_range: tuple[float, float],
+               y_range: tuple[float, float]) -> NDArray:
+        '''the rocks centered in the box `x_range` x `y_range`'''
+        rocks = self._gather(x_range, y_range)
+        return rocks[(rocks['x'] >= x_range[0]) & (rocks['x'] <= x_range[1]) &
+                     (rocks['y'] >= y_range[0]) & (rocks['y'] <= y_range[1])]
+
+    def save(self, filename: str | os.PathLike) -> None:
+        '''save the rocks as a `.npy` file'''
+        np.save(filename, self.rocks)
+
+    @classmethod
+    def load(cls, filename: str | os.PathLike, bucket: float = 4.,
+             mmap: bool = True) -> 'RockField':
+        '''load rocks from a `.npy` file, memory-mapped by default'''
+        rocks = np.load(filename, mmap_mode='r' if mmap else None)
+        if rocks.dtype != ROCK_DTYPE:
+            raise ValueError(f"not a rock field (dtype {rocks.dtype})")
+        return cls(rocks, bucket)
+
+
+def export_instances(
+        field: RockField,
+        filename: str | os.PathLike,
+        surface: SurfaceType | None = None
+) -> NDArray:
+    '''
+    export the rocks as instanced placements of their models : one
+    `INSTANCE_DTYPE` record per rock, resting on the `surface` (if given),
+    written as a `.npy` file, or as a `.csv` table with a header (e.g. to
+    be instanced by a Gazebo world plugin or a Blender script).
+    Returns the records.
+    '''
+    rocks = field.rocks
+    instances = np.zeros(len(rocks), INSTANCE_DTYPE)
+    for name in ('model', 'x', 'y', 'yaw', 'diameter', 'height'):
+        instances[name] = rocks[name]
+    if surface is not None:
+        instances['z'] = HeightfieldSampler(surface)(rocks['x'], rocks['y'])
+
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.npy':
+        np.save(filename, instances)
+    elif extension == '.csv':
+        np.savetxt(filename, instances, delimiter=',', comments='',
+                   header=','.join(INSTANCE_DTYPE.names),
+                   fmt=['%d'] + ['%.4f']*(len(INSTANCE_DTYPE) - 1))
+    else:
+        raise ValueError(f"unknown instance format `{extension}`")
+    return instances
@@ -0,0 +1,215 @@
+'''
+SAMPLING.PY
+
+This submodule contains a sampler for evaluating the height and gradient
+of a gridded surface at arbitrary points.
+'''
+
+import typing
+
+import numpy as np
+from numpy.typing import NDArray
+
+from scipy.ndimage import spline_filter
+
+from moon_gen.lib.utils import SurfaceType
+
+BoundsPolicy = typing.Literal['clamp', 'wrap', 'nan', 'raise']
+'''
+what to do with points outside of the surface :
+ - `clamp` : use the nearest point on the edge of the surface
+ - `wrap` :  treat the surface as periodic
+ - `nan` :   return `nan`
+ - `raise` : raise a `ValueError`
+'''
+
+
+def spline_coefficients(
+        z: NDArray[np.float64],
+        out: NDArray[np.float64] | None = None,
+        wrap: bool = False
+) -> NDArray[np.float64]:
+    '''
+    the cubic B-spline coefficients of a heightmap, for bicubic sampling.
+    `out` can be a memory-mapped array, so large heightmaps do not need to
+    fit in memory.
+
+    With `wrap`, the heightmap is periodic, its last samples repeating the
+    first ones (see the `wrap` bounds policy).
+    '''
+    if out is None:
+        out = np.empty(z.shape)
+    if not wrap:
+        return spline_filter(z, order=3, output=out, mode='mirror')
+
+    spline_filter(z[:-1, :-1], order=3, output=out[:-1, :-1], mode='grid-wrap')
+    out[-1, :-1] = out[0, :-1]
+    out[:, -1] = out[:, 0]
+    return out
+
+
+def _linear_weights(t: NDArray[np.float64]):
+    '''the weights (and their derivatives) of the two nearest samples'''
+    return (1-t, t), (-np.ones_like(t), np.ones_like(t))
+
+
+def _cubic_weights(t: NDArray[np.float64]):
+    '''the weights (and their derivatives) of the cubic B-spline basis'''
+    t2, t3 = t*t, t*t*t
+    w = ((1-t)**3/6, (3*t3 - 6*t2 + 4)/6, (-3*t3 + 3*t2 + 3*t + 1)/6, t3/6)
+    dw = (-(1-t)**2/2, (3*t2 - 4*t)/2, (-3*t2 + 2*t + 1)/2, t2/2)
+    return w, dw
+
+
+def _mirror(index: NDArray[np.intp], n: int) -> NDArray[np.intp]:
+    '''mirror indices about the first and last samples'''
+    index = np.abs(index)
+    return np.where(index > n-1, 2*(n-1) - index, index)
+
+
+def _wrap(index: NDArray[np.intp], n: int) -> NDArray[np.intp]:
+    '''wrap indices around, the last sample repeating the first'''
+    return index % (n-1)
+
+
+class HeightfieldSampler:
+    '''
+    samples a (uniformly gridded) surface at arbitrary points, with bilinear
+    or bicubic B-spline interpolation, and gives the analytic gradient of
+    the interpolant.
+
+    Points are processed in vectorized batches, and only the samples around
+    the points are read, so `z` can be a memory-mapped array.
+    '''
+
+    def __init__(
+            self,
+            surface: SurfaceType,
+            method: typing.Literal['linear', 'cubic'] = 'linear',
+            bounds: BoundsPolicy = 'clamp',
+            coefficients: NDArray[np.float64] | None = None,
+            batch: int = 2**18
+    ) -> None:
+        '''
+        Args:
+        * surface :      the surface to sample
+        * method :       the interpolation method
+        * bounds :       the policy for points outside the surface
+        * coefficients : precomputed spline coefficients, for cubic sampling
+                         (see `spline_coefficients`, with `wrap` for the
+                         `wrap` bounds policy)
+        * batch :        the number of points processed at once
+        '''
+        x, y, z, *_ = surface
+        if method not in ('linear', 'cubic'):
+            raise ValueError(f"unknown interpolation method `{method}`")
+        if bounds not in typing.get_args(BoundsPolicy):
+            raise ValueError(f"unknown bounds policy `{bounds}`")
+
+        self.origin = float(x[0]), float(y[0])
+        self.spacing = (float(x[-1] - x[0]) / (len(x) - 1),
+                        float(y[-1] - y[0]) / (len(y) - 1))
+        self.shape = z.shape
+        self.method = method
+        self.bounds = bounds
+        self.batch = batch
+
+        if method == 'cubic':
+            if coefficients is None:
+                coefficients = spline_coefficients(z, wrap=bounds == 'wrap')
+            self._data = coefficients
+            self._weights = _cubic_weights
+            self._offsets = np.arange(-1, 3)
+        else:
+            self._data = z
+            self._weights = _linear_weights
+            self._offsets = np.arange(0, 2)
+
+    def _grid_coordinates(
+            self,
+            xs: NDArray[np.float64],
+            ys: NDArray[np.float64]
+    ) -> tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.bool_]]:
+        '''the fractional grid indices of the points, and which are inside'''
+        fx = (xs - self.origin[0]) / self.spacing[0]
+        fy = (ys - self.origin[1]) / self.spacing[1]
+        nx, ny = self.shape
+        inside = (fx >= 0) & (fx <= nx-1) & (fy >= 0) & (fy <= ny-1)
+
+        if self.bounds == 'raise' and not inside.all():
+            raise ValueError("points outside of the surface")
+        if self.bounds == 'wrap':
+            fx, fy = fx % (nx-1), fy % (ny-1)
+        else:
+            fx, fy = np.clip(fx, 0, nx-1), np.clip(fy, 0, ny-1)
+        return fx, fy, inside
+
+    def _sample(
+            self,
+            xs: NDArray[np.float64],
+            ys: NDArray[np.float64],
+            out: NDArray[np.float64]
+    ) -> None:
+        '''the height (and the gradient) at a batch of points, into `out`'''
+        fx, fy, inside = self._grid_coordinates(xs, ys)
+        nx, ny = self.shape
+        i = np.minimum(np.floor(fx).astype(np.intp), nx-2)
+        j = np.minimum(np.floor(fy).astype(np.intp), ny-2)
+        (wx, dwx), (wy, dwy) = self._weights(fx - i), self._weights(fy - j)
+
+        extend = _wrap if self.bounds == 'wrap' else _mirror
+
+        out[...] = 0
+        for a, ox in enumerate(self._offsets):
+            rows = extend(i + ox, nx)
+            for b, oy in enumerate(self._offsets):
+                c = self._data[rows, extend(j + oy, ny)]
+                out[0] += wx[a]*wy[b]*c
+                if len(out) > 1:
+                    out[1] += dwx[a]*wy[b]*c/self.spacing[0]
+                    out[2] += wx[a]*dwy[b]*c/self.spacing[1]
+
+        if self.bounds == 'nan':
+            out[:, ~inside] = np.nan
+
+    def _sample_all(
+            self,
+            xs: NDArray[np.float64],
+            ys: NDArray[np.float64],
+            outputs: int
+    ) -> NDArray[np.float64]:
+        '''sample the points in batches'''
+        xs, ys = np.broadcast_arrays(np.asarray(xs, np.float64),
+                                     np.asarray(ys, np.float64))
+        flat_x, flat_y = xs.ravel(), ys.ravel()
+        out = np.empty((outputs, len(flat_x)))
+        for start in range(0, len(flat_x), self.batch):
+            batch = slice(start, start + self.batch)
+            self._sample(flat_x[batch], flat_y[batch], out[:, batch])
+        return out.reshape((outputs, *xs.shape))
+
+    def sample(
+            self,
+            xs: NDArray[np.float64],
+            ys: NDArray[np.float64]
+    ) -> tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64]]:
+        '''the height and the gradient `(dz/dx, dz/dy)` at the points'''
+        z, dzdx, dzdy = self._sample_all(xs, ys, 3)
+        return z, dzdx, dzdy
+
+    def __call__(
+            self,
+            xs: NDArray[np.float64],
+            ys: NDArray[np.float64]
+    ) -> NDArray[np.float64]:
+        '''the height at the points'''
+        return self._sample_all(xs, ys, 1)[0]
+
+    def gradient(
+            self,
+            xs: NDArray[np.float64],
+            ys: NDArray[np.float64]
+    ) -> tuple[NDArray[np.float64], NDArray[np.float64]]:
+        '''the gradient `(dz/dx, dz/dy)` at the points'''
+        _, dzdx, dzdy = self._sample_all(xs, ys, 3)
+        return dzdx, dzdy
@@ -0,0 +1,422 @@
+'''
+STORE.PY
+
+This submodule contains an on-disk store for (large) generated surfaces :
+a directory of fixed-size compressed chunks of the elevation and of the
+colors, with an index holding the extents and the metadata, and the
+crater catalog. Windows can be read back without decompressing more than
+the chunks they touch, and chunks can be written concurrently by worker
+processes.
+'''
+
+import os
+import json
+import lzma
+import math
+import zlib
+import typing
+import concurrent.futures
+
+import numpy as np
+from numpy.typing import NDArray
+
+from moon_gen.lib.catalog import CraterCatalog
+from moon_gen.lib.tiling import iter_tiles
+from moon_gen.lib.utils import SurfaceType
+
+STORE_EXTENSION = '.mgs'
+'''the extension of the store directories'''
+
+COMPRESSIONS = ('zlib', 'lzma', 'none')
+'''the supported chunk compressions'''
+
+_INDEX = 'index.json'
+_CATALOG = 'craters.npy'
+
+
+def _compress(data: bytes, compression: str) -> bytes:
+    '''compress the bytes of a chunk'''
+    if compression == 'zlib':
+        return zlib.compress(data, 6)
+    if compression == 'lzma':
+        return lzma.compress(data)
+    return data
+
+
+def _decompress(data: bytes, compression: str) -> bytes:
+    '''decompress the bytes of a chunk'''
+    if compression == 'zlib':
+        return zlib.decompress(data)
+    if compression == 'lzma':
+        return lzma.decompress(data)
+    return data
+
+
+def _atomic_write(filename: str, data: bytes) -> None:
+    '''
+    write a file through a temporary file, so that concurrent readers and
+    writers never see it partially written
+    '''
+    temporary = f'{filename}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(data)
+    os.replace(temporary, filename)
+
+
+class TileStore:
+    '''
+    a store of a surface, on disk. Its layers (`z`, and optionally `color`)
+    are split into chunks of `chunk` x `chunk` samples, each compressed in
+    its own file, so that windows can be read (see `StoreArray`) and
+    chunks can be written independently. Missing chunks read as NaN (or
+    zero, for integer layers).
+    '''
+
+    def __init__(self, path: str | os.PathLike) -> None:
+        '''open an existing store (see `create`)'''
+        self.path = os.fspath(path)
+        try:
+            with open(os.path.join(self.path, _INDEX)) as file:
+                self.index = json.load(file)
+        except FileNotFoundError:
+            raise ValueError(f"not a surface store `{self.path}`") from None
+
+    @classmethod
+    def create(
+            cls,
+            path: str | os.PathLike,
+            x: NDArray[np.float64],
+            y: NDArray[np.float64],
+            chunk: int = 256,
+            compression: str = 'zlib',
+            layers: dict[str, tuple[typing.Any,
+                                    tuple[int, ...]]] | None = None,
+            metadata: dict | None = None
+    ) -> 'TileStore':
+        '''
+        create an empty store for a surface on the grid spanned by the
+        (uniformly spaced) `x` and `y`. The `layers` are given as
+        `{name: (dtype, shape of a sample)}`, by default a float32 `z`.
+        An existing store at `path` is overwritten.
+        '''
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"unknown compression `{compression}`")
+        if layers is None:
+            layers = {'z': (np.float32, ())}
+
+        os.makedirs(path, exist_ok=True)
+        for name in layers:
+            os.makedirs(os.path.join(path, name), exist_ok=True)
+            # the chunks of a previous store
+            for old in os.listdir(os.path.join(path, name)):
+                if old.endswith('.chunk'):
+                    os.remove(os.path.join(path, name, old))
+        if os.path.exists(os.path.join(path, _CATALOG)):
+            os.remove(os.path.join(path, _CATALOG))
+        index = {
+            'shape': [len(x), len(y)],
+            'x': [float(x[0]), float(x[-1])],
+            'y': [float(y[0]), float(y[-1])],
+            'chunk': chunk,
+            'compression': compression,
+            'layers': {name: {'dtype': np.dtype(dtype).str,
+                              'shape': list(shape)}
+                       for name, (dtype, shape) in layers.items()},
+            'metadata': metadata or {},
+        }
+        _atomic_write(os.path.join(path, _INDEX),
+                      json.dumps(index, indent=2).encode())
+        return cls(path)
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return tuple(self.index['shape'])  # type: ignore
+
+    @property
+    def chunk(self) -> int:
+        return self.index['chunk']
+
+    @property
+    def x(self) -> NDArray[np.float64]:
+        return np.linspace(*self.index['x'], self.shape[0])
+
+    @property
+    def y(self) -> NDArray[np.float64]:
+        return np.linspace(*self.index['y'], self.shape[1])
+
+    @property
+    def metadata(self) -> dict:
+        return self.index['metadata']
+
+    @property
+    def layers(self) -> tuple[str, ...]:
+        return tuple(self.index['layers'])
+
+    @property
+    def chunks(self) -> tuple[int, int]:
+        '''the number of chunks along `x` and `y`'''
+        return tuple(math.ceil(n/self.chunk)  # type: ignore
+                     for n in self.shape)
+
+    def _layer(self, layer: str) -> tuple[np.dtype, tuple[int, ...]]:
+        '''the dtype and the shape of a sample of a layer'''
+        try:
+            spec = self.index['layers'][layer]
+        except KeyError:
+            raise ValueError(f"no layer `{layer}` in the store") from None
+        return np.dtype(spec['dtype']), tuple(spec['shape'])
+
+    def _chunk_file(self, layer: str, ci: int, cj: int) -> str:
+        return os.path.join(self.path, layer, f'{ci}_{cj}.chunk')
+
+    def chunk_window(self, ci: int, cj: int) -> tuple[slice, slice]:
+        '''the samples covered by a chunk'''
+        c = self.chunk
+        return (slice(ci*c, min((ci + 1)*c, self.shape[0])),
+                slice(cj*c, min((cj + 1)*c, self.shape[1])))
+
+    def has_chunk(self, layer: str, ci: int, cj: int) -> bool:
+        return os.path.exists(self._chunk_file(layer, ci, cj))
+
+    def read_chunk(self, layer: str, ci: int, cj: int) -> NDArray | None:
+        '''the samples of a chunk, or none if it hasn't been written'''
+        dtype, sample = self._layer(layer)
+        try:
+            with open(self._chunk_file(layer, ci, cj), 'rb') as file:
+                data = _decompress(file.read(), self.index['compression'])
+        except FileNotFoundError:
+            return None
+        sx, sy = self.chunk_window(ci, cj)
+        shape = (sx.stop - sx.start, sy.stop - sy.start, *sample)
+        if len(data) != math.prod(shape)*dtype.itemsize:
+            raise ValueError(f"corrupt chunk {ci}, {cj} of layer `{layer}`")
+        return np.frombuffer(data, dtype).reshape(shape)
+
+    def write_chunk(self, layer: str, ci: int, cj: int,
+                    data: NDArray) -> None:
+        '''write (or replace) the samples of a chunk, atomically'''
+        dtype, sample = self._layer(layer)
+        sx, sy = self.chunk_window(ci, cj)
+        shape = (sx.stop - sx.start, sy.stop - sy.start, *sample)
+        if np.shape(data) != shape:
+            raise ValueError(f"chunk {ci}, {cj} should be of shape {shape}, "
+                             f"not {np.shape(data)}")
+        data = np.ascontiguousarray(data, dtype)
+        _atomic_write(self._chunk_file(layer, ci, cj),
+                      _compress(data.tobytes(), self.index['compression']))
+
+    def __getitem__(self, layer: str) -> 'StoreArray':
+        '''an array-like view of a layer (see `StoreArray`)'''
+        self._layer(layer)
+        return StoreArray(self, layer)
+
+    def surface(self) -> SurfaceType:
+        '''
+        the stored surface, whose `z` (and `C`) are views of the store,
+        read as they are indexed
+        '''
+        if 'color' in self.layers:
+            return self.x, self.y, self['z'], self['color']
+        return self.x, self.y, self['z']
+
+    @property
+    def catalog(self) -> CraterCatalog | None:
+        '''the stored crater catalog, if any'''
+        filename = os.path.join(self.path, _CATALOG)
+        if not os.path.exists(filename):
+            return None
+        return CraterCatalog.load(filename)
+
+    def save_catalog(self, catalog: CraterCatalog) -> None:
+        '''store a crater catalog with the surface'''
+        catalog.save(os.path.join(self.path, _CATALOG))
+
+
+class StoreArray:
+    '''
+    an array-like view of a layer of a `TileStore`. Indexing it with
+    integers or slices reads the window it covers, decompressing only the
+    chunks it touches; assigning to it writes the chunks it touches
+    (partially covered chunks are read and rewritten, so concurrent writers
+    should only write whole chunks).
+    '''
+
+    def __init__(self, store: TileStore, layer: str) -> None:
+        self.store = store
+        self.layer = layer
+        self.dtype, self._sample = store._layer(layer)
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        return (*self.store.shape, *self._sample)
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None) -> NDArray:
+        a = self[:, :]
+        return a if dtype is None else a.astype(dtype)
+
+    def _window(self, key) -> tuple[tuple[slice, slice], tuple]:
+        '''
+        the window of the store covered by an index, and the index
+        relative to that window
+        '''
+        key = key if isinstance(key, tuple) else (key,)
+        key = key + (slice(None),)*(2 - len(key))
+        window, relative = [], []
+        for k, n in zip(key[:2], self.store.shape):
+            if isinstance(k, slice):
+                start, stop, step = k.indices(n)
+                if step < 0:
+                    raise ValueError("negative steps are not supported")
+                stop = max(stop, start)
+                window.append(slice(start, stop))
+                relative.append(slice(0, stop - start, step))
+            else:
+                k = int(k) + n if int(k) < 0 else int(k)
+                if not 0 <= k < n:
+                    raise IndexError(f"index {k} out of bounds")
+                window.append(slice(k, k + 1))
+                relative.append(0)
+        return tuple(window), (*relative, *key[2:])  # type: ignore
+
+    def _chunks(self, window: tuple[slice, slice]) -> typing.Iterator[
+            tuple[int, int, tuple[slice, slice], tuple[slice, slice]]]:
+        '''
+        the chunks overlapping a window, with their overlap, relative to
+        the window and to the chunk
+        '''
+        c = self.store.chunk
+        sx, sy = window
+        for ci in range(sx.start//c, -(-sx.stop//c)):
+            for cj in range(sy.start//c, -(-sy.stop//c)):
+                bx, by = self.store.chunk_window(ci, cj)
+                ox = slice(max(sx.start, bx.start), min(sx.stop, bx.stop))
+                oy = slice(max(sy.start, by.start), min(sy.stop, by.stop))
+                yield (ci, cj,
+                       (slice(ox.start - sx.start, ox.stop - sx.start),
+                        slice(oy.start - sy.start, oy.stop - sy.start)),
+                       (slice(ox.start - bx.start, ox.stop - bx.start),
+                        slice(oy.start - by.start, oy.stop - by.start)))
+
+    def _fill(self) -> typing.Any:
+        '''the value of the samples of missing chunks'''
+        return np.nan if self.dtype.kind in 'fc' else 0
+
+    def __getitem__(self, key) -> NDArray:
+        window, relative = self._window(key)
+        sx, sy = window
+        out = np.full((sx.stop - sx.start, sy.stop - sy.start,
+                       *self._sample), self._fill(), self.dtype)
+        for ci, cj, inner, part in self._chunks(window):
+            data = self.store.read_chunk(self.layer, ci, cj)
+            if data is not None:
+                out[inner] = data[part]
+        return out[relative]
+
+    def __setitem__(self, key, value: NDArray) -> None:
+        window, relative = self._window(key)
+        if len(relative) > 2 or any(isinstance(k, slice) and k.step != 1
+                                    for k in relative):
+            raise ValueError("only contiguous windows can be written")
+        sx, sy = window
+        value = np.asarray(value, self.dtype)
+        rows = [a for a, k in enumerate(relative) if not isinstance(k, slice)]
+        if value.ndim == self.ndim - len(rows):
+            value = np.expand_dims(value, rows)
+        value = np.broadcast_to(value, (sx.stop - sx.start, sy.stop - sy.start,
+                                        *self._sample))
+        for ci, cj, inner, part in self._chunks(window):
+            bx, by = self.store.chunk_window(ci, cj)
+            if (part[0].stop - part[0].start, part[1].stop - part[1].start) \
+                    == (bx.stop - bx.start, by.stop - by.start):
+                data = value[inner]
+            else:
+                data = self.store.read_chunk(self.layer, ci, cj)
+                data = np.full((bx.stop - bx.start, by.stop - by.start,
+                                *self._sample), self._fill(), self.dtype) \
+                    if data is None else data.copy()
+                data[part] = value[inner]
+            self.store.write_chunk(self.layer, ci, cj, data)
+
+
+def save_surface(
+        surface: SurfaceType,
+        path: str | os.PathLike,
+        chunk: int = 256,
+        compression: str = 'zlib',
+        catalog: CraterCatalog | None = None,
+        metadata: dict | None = None,
+        dtype: typing.Any = np.float32
+) -> TileStore:
+    '''
+    save a surface (and its crater catalog) as a store (see `TileStore`),
+    chunk by chunk, so `z` and `C` can be memory-mapped arrays. The colors
+    `C` (e.g. an albedo map, or RGBA colors) are stored as the `color`
+    layer.
+    '''
+    x, y, z, *c = surface
+    layers = {'z': (dtype, ())}
+    if c:
+        layers['color'] = (dtype, np.shape(c[0])[2:])
+    store = TileStore.create(path, x, y, chunk, compression, layers, metadata)
+
+    for (sx, sy), _, _ in iter_tiles(z.shape, chunk):
+        ci, cj = sx.start//chunk, sy.start//chunk
+        store.write_chunk('z', ci, cj, np.asarray(z[sx, sy]))
+        if c:
+            store.write_chunk('color', ci, cj, np.asarray(c[0][sx, sy]))
+    if catalog is not None:
+        store.save_catalog(catalog)
+    return store
+
+
+def _fill_chunk(
+        path: str,
+        func: typing.Callable,
+        ci: int,
+        cj: int
+) -> tuple[int, int]:
+    '''generate a chunk of a store with `func`, and write it'''
+    store = TileStore(path)
+    sx, sy = store.chunk_window(ci, cj)
+    result = func(store.x[sx], store.y[sy])
+    z, *c = result if isinstance(result, tuple) else (result,)
+    if c and 'color' in store.layers:
+        store.write_chunk('color', ci, cj, c[0])
+    store.write_chunk('z', ci, cj, z)
+    return ci, cj
+
+
+def fill_store(
+        path: str | os.PathLike,
+        func: typing.Callable,
+        processes: int | None = None
+) -> int:
+    '''
+    fill the missing chunks of a store with `func(x, y)`, which returns the
+    `z` (or `(z, C)`) of the grid spanned by `x` and `y`, across
+    `processes` processes (all cores by default). Each chunk is generated
+    independently, so `func` should be seamless (e.g. a procedural terrain,
+    see `height_at`), and it must be picklable.
+
+    The chunks are written as soon as they are done, so an interrupted fill
+    can be resumed by running it again. Returns the number of chunks
+    written.
+    '''
+    path = os.fspath(path)
+    store = TileStore(path)
+    todo = [(ci, cj) for ci in range(store.chunks[0])
+            for cj in range(store.chunks[1])
+            if not store.has_chunk('z', ci, cj)]
+    with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+        futures = [pool.submit(_fill_chunk, path, func, ci, cj)
+                   for ci, cj in todo]
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+    return len(todo)
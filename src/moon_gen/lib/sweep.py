@@ -0,0 +1,175 @@
+'''
+SWEEP.PY
+
+This submodule contains a runner for parameter sweeps : it generates a
+surface for each combination of a grid of parameters, across a pool of
+processes, and writes the surfaces and a table of summary metrics, so
+that partially finished sweeps can be resumed.
+'''
+
+import os
+import csv
+import typing
+import itertools
+import concurrent.futures
+
+import numpy as np
+from numpy.typing import NDArray
+
+from moon_gen.lib.catalog import CraterCatalog
+from moon_gen.lib.distributions import surface_psd_nominal
+from moon_gen.lib.pipeline import Recipe, run_recipe
+from moon_gen.lib.validation import compare_psd, profile_psd
+
+JobType = tuple[int, dict[str, str], dict[str, typing.Any]]
+'''a job of a sweep, as (`index`, parameter labels, parameter values)'''
+
+METRICS = ('z_min', 'z_max', 'height_range', 'rms_slope', 'craters',
+           'psd_gain', 'psd_error')
+'''the summary metrics of each surface of a sweep'''
+
+
+def _label(value: typing.Any) -> str:
+    '''how a parameter value is written in the summary table'''
+    return getattr(value, '__name__', str(value))
+
+
+def parameter_grid(grid: dict[str, typing.Any]) -> list[JobType]:
+    '''
+    the combinations of a grid of parameters, in order. The options of each
+    parameter are given as a list, or as a dict of labelled values (e.g.
+    `{'young': crater_density_young, 'old': crater_density_old}`) for
+    values which don't print well.
+    '''
+    options = [
+        list(o.items()) if isinstance(o, dict) else
+        [(_label(v), v) for v in o]
+        for o in grid.values()
+    ]
+    return [
+        (k, {n: label for n, (label, _) in zip(grid, combination)},
+         {n: value for n, (_, value) in zip(grid, combination)})
+        for k, combination in enumerate(itertools.product(*options))
+    ]
+
+
+class RecipeTarget:
+    '''
+    a sweep target which builds a recipe from the parameters of a job
+    (`factory(**params)`) and runs it
+    '''
+
+    def __init__(self, factory: typing.Callable[..., Recipe]) -> None:
+        self.factory = factory
+
+    def __call__(self, x, y, seed=None, **params):
+        return run_recipe(self.factory(**params), x, y, seed, workers=1,
+                          return_catalog=True)
+
+
+def summarize(
+        x: NDArray[np.float64],
+        y: NDArray[np.float64],
+        z: NDArray[np.float64],
+        catalog: CraterCatalog | None = None,
+        psd: typing.Callable[[float], float] = surface_psd_nominal
+) -> dict[str, float]:
+    '''
+    the summary metrics of a surface (see `METRICS`). The PSD gain and
+    error are in decades (see `compare_psd`).
+    '''
+    dzdx, dzdy = np.gradient(z, x, y)
+    z_min, z_max = float(z.min()), float(z.max())
+    gain, error = compare_psd(*profile_psd((x, y, z)), psd)
+    return {
+        'z_min': z_min,
+        'z_max': z_max,
+        'height_range': z_max - z_min,
+        'rms_slope': float(np.sqrt(np.mean(dzdx**2 + dzdy**2))),
+        'craters': len(catalog) if catalog is not None else 0,
+        'psd_gain': gain,
+        'psd_error': error,
+    }
+
+
+def run_job(
+        target: typing.Callable,
+        x: NDArray[np.float64],
+        y: NDArray[np.float64],
+        job: JobType,
+        seed: int,
+        directory: str | os.PathLike
+) -> dict[str, typing.Any]:
+    '''
+    generate the surface of a job, save it (and its crater catalog, if
+    any) in `directory`, and return its row of the summary table
+    '''
+    k, labels, params = job
+    result = target(x, y, seed=seed, **params)
+    z, catalog = result if isinstance(result, tuple) else (result, None)
+
+    name = os.path.join(directory, f'job_{k:04d}')
+    np.save(f'{name}.npy', z.astype(np.float32))
+    if catalog is not None:
+        catalog.save(f'{name}_craters.npy')
+
+    metrics = summarize(x, y, z, catalog,
+                        params.get('psd', surface_psd_nominal))
+    return {'job': k, 'seed': seed, **labels, **metrics}
+
+
+def read_summary(filename: str | os.PathLike) -> list[dict[str, str]]:
+    '''the rows of a sweep's summary table, or none if it doesn't exist'''
+    try:
+        with open(filename, newline='') as file:
+            return list(csv.DictReader(file))
+    except FileNotFoundError:
+        return []
+
+
+def run_sweep(
+        target: typing.Callable,
+        grid: dict[str, typing.Any],
+        x: NDArray[np.float64],
+        y: NDArray[np.float64],
+        directory: str | os.PathLike,
+        seed: int = 0,
+        processes: int | None = None
+) -> list[dict[str, str]]:
+    '''
+    run a parameter sweep : generate a surface with `target(x, y, seed=...,
+    **params)` for each combination of the parameter `grid` (see
+    `parameter_grid`), across `processes` processes (all cores by default).
+    The target returns `z`, or `(z, catalog)`, e.g. `parametric_surface`
+    with `return_catalog=True` (see `functools.partial`), or a
+    `RecipeTarget`. It must be picklable.
+
+    Each job gets its own seed, derived from `seed` and its index (and
+    recorded, so the target must be reproducible from it), and writes its
+    surface to `directory`, and its metrics to `summary.csv` as soon as
+    it is done. Jobs which are already in the summary are
+    skipped, so an interrupted sweep can be resumed by running it again.
+    Returns the rows of the summary, in job order.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    summary = os.path.join(directory, 'summary.csv')
+    jobs = parameter_grid(grid)
+    seeds = [int(s.generate_state(1)[0])
+             for s in np.random.SeedSequence(seed).spawn(len(jobs))]
+    done = {int(row['job']) for row in read_summary(summary)}
+    todo = [job for job in jobs if job[0] not in done]
+
+    fields = ['job', 'seed', *grid, *METRICS]
+    new = not os.path.exists(summary) or os.path.getsize(summary) == 0
+    with open(summary, 'a', newline='') as file, \
+            concurrent.futures.ProcessPoolExecutor(processes) as pool:
+        writer = csv.DictWriter(file, fields)
+        if new:
+            writer.writeheader()
+        futures = [pool.submit(run_job, target, x, y, job, seeds[job[0]],
+                               directory) for job in todo]
+        for future in concurrent.futures.as_completed(futures):
+            writer.writerow(future.result())
+            file.flush()
+
+    return sorted(read_summary(summary), key=lambda row: int(row['job']))
@@ -0,0 +1,61 @@
+'''
+TILING.PY
+
+This submodule contains functions for processing large heightmaps in tiles,
+e.g. memory-mapped ones, with a halo of neighbouring samples around each
+tile so that stencil operations give the same result as on the whole map.
+'''
+
+import typing
+
+import numpy as np
+from numpy.typing import NDArray
+
+TileType = tuple[
+    tuple[slice, slice],
+    tuple[slice, slice],
+    tuple[slice, slice],
+]
+'''
+a tile, given as (`block`, `window`, `inner`), where `block` is the part of
+the array covered by the tile, `window` the part to read (the block and its
+halo), and `inner` the block relative to the window
+'''
+
+
+def iter_tiles(
+        shape: tuple[int, int],
+        tile: int = 1024,
+        halo: int = 0
+) -> typing.Iterator[TileType]:
+    '''
+    iterate over the tiles of an array of the given shape, in row-major
+    order. The halos are cut at the edges of the array.
+    '''
+    for i in range(0, shape[0], tile):
+        for j in range(0, shape[1], tile):
+            block = (slice(i, min(i + tile, shape[0])),
+                     slice(j, min(j + tile, shape[1])))
+            window = tuple(slice(max(b.start - halo, 0), min(b.stop + halo, n))
+                           for b, n in zip(block, shape))
+            inner = tuple(slice(b.start - w.start, b.stop - w.start)
+                          for b, w in zip(block, window))
+            yield block, window, inner  # type: ignore
+
+
+def map_tiles(
+        func: typing.Callable[[NDArray[np.float64]], NDArray],
+        z: NDArray[np.float64],
+        halo: int,
+        tile: int = 1024,
+        out: NDArray | None = None
+) -> NDArray:
+    '''
+    apply a stencil operation `func`, which reaches at most `halo` samples,
+    tile by tile. `z` and `out` can be memory-mapped arrays.
+    '''
+    if out is None:
+        out = np.empty(z.shape)
+    for block, window, inner in iter_tiles(z.shape, tile, halo):
+        out[block] = func(np.asarray(z[window]))[inner]
+    return out
@@ -31,3 +31,25 @@ It is expected to optionally take an integer `size` argument, which will
 specify the size or resolution of the resulting surface.
 Sadly, I can't figure out how to typehint this...
 '''
+
+
+def albedo_colors(
+        albedo: NDArray[np.float64],
+        ground: float = .45,
+        fresh: float = .9
+) -> NDArray[np.float64]:
+    '''
+    the RGBA colors of an albedo map (e.g. the `C` of a surface), in shades
+    of gray from `ground` (at 0) to `fresh` (at 1)
+    '''
+    gray = ground + (fresh - ground)*np.clip(albedo, 0, 1)
+    return np.stack((gray, gray, gray, np.ones_like(gray)), axis=-1)
+
+
+def albedo_from_colors(
+        colors: NDArray[np.float64],
+        ground: float = .45,
+        fresh: float = .9
+) -> NDArray[np.float64]:
+    '''the albedo map of colors made by `albedo_colors`, from their red'''
+    return np.clip((colors[..., 0] - ground)/(fresh - ground), 0, 1)
@@ -0,0 +1,160 @@
+'''
+VALIDATION.PY
+
+This submodule contains fast checks of the statistics of generated
+terrain: its power spectral density, estimated Welch-style over tiles
+(so it works on large or memory-mapped surfaces), and the size-frequency
+distribution of its craters.
+'''
+
+import typing
+
+import numpy as np
+from numpy.typing import NDArray
+from numpy.lib.stride_tricks import sliding_window_view
+import scipy.stats
+
+from moon_gen.lib.distributions import PowerDistribution
+from moon_gen.lib.utils import SurfaceType
+
+
+def _detrended(tiles: NDArray[np.float64]) -> NDArray[np.float64]:
+    '''a stack of tiles, minus the best-fitting plane of each'''
+    s = tiles.shape[-1]
+    u = np.linspace(-1, 1, s)
+    a = np.einsum('kij,i->k', tiles, u) / (s*np.sum(u**2))
+    b = np.einsum('kij,j->k', tiles, u) / (s*np.sum(u**2))
+    mean = tiles.mean(axis=(1, 2))
+    return tiles - mean[:, None, None] - a[:, None, None]*u[:, None] \
+        - b[:, None, None]*u
+
+
+def welch_spectrum(
+        z: NDArray[np.float64],
+        spacing: tuple[float, float],
+        tile: int = 256
+) -> tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64]]:
+    '''
+    the 2D power spectral density of a heightmap (m^2 / (cycles/m)^2),
+    averaged over detrended, Hann-windowed tiles of `tile` x `tile`
+    samples, overlapping by half. Only one row of tiles is in memory at a
+    time, so `z` can be memory-mapped.
+
+    Returns the `x` frequencies (non-negative only), the `y` frequencies,
+    and the spectrum.
+    '''
+    tile = min(tile, *z.shape)
+    step = max(tile//2, 1)
+    dx, dy = spacing
+    window = np.outer(np.hanning(tile + 2)[1:-1], np.hanning(tile + 2)[1:-1])
+    norm = dx*dy / (tile*tile*np.mean(window**2))
+
+    total = np.zeros((tile//2 + 1, tile))
+    count = 0
+    for i in range(0, z.shape[0] - tile + 1, step):
+        rows = np.asarray(z[i:i+tile], np.float64)
+        tiles = sliding_window_view(rows, (tile, tile))[0, ::step]
+        spectra = np.fft.rfft2(_detrended(tiles)*window, axes=(2, 1))
+        total += np.sum(np.abs(spectra)**2, axis=0)
+        count += len(tiles)
+
+    fx = np.fft.rfftfreq(tile, dx)
+    fy = np.fft.fftfreq(tile, dy)
+    return fx, fy, total*norm/count
+
+
+def radial_psd(
+        surface: SurfaceType,
+        tile: int = 256
+) -> tuple[NDArray[np.float64], NDArray[np.float64]]:
+    '''
+    the radially averaged 2D power spectral density of a surface, in bins
+    of the frequency resolution of a tile (see `welch_spectrum`)
+    '''
+    x, y, z, *_ = surface
+    fx, fy, spectrum = welch_spectrum(z, _spacing(x, y), tile)
+    df = fx[1]
+    k = np.rint(np.hypot(fx[:, None], fy)/df).astype(np.intp)
+    # the negative x frequencies mirror the positive ones
+    weight = np.full(fx.shape, 2.)
+    weight[0] = weight[-1] = 1.
+    weight = np.broadcast_to(weight[:, None], k.shape)
+    sums = np.bincount(k.ravel(), (weight*spectrum).ravel())
+    counts = np.bincount(k.ravel(), weight.ravel())
+    n = len(fx)
+    return df*np.arange(1, n), sums[1:n]/counts[1:n]
+
+
+def profile_psd(
+        surface: SurfaceType,
+        tile: int = 256
+) -> tuple[NDArray[np.float64], NDArray[np.float64]]:
+    '''
+    the one-sided power spectral density of the profiles of a surface
+    along `x` (m^2 / (cycles/m)), as used by `surface_psd_*`, integrated
+    from the 2D spectrum (see `welch_spectrum`)
+    '''
+    x, y, z, *_ = surface
+    fx, fy, spectrum = welch_spectrum(z, _spacing(x, y), tile)
+    psd = 2*spectrum.sum(axis=1)*abs(fy[1])
+    return fx[1:-1], psd[1:-1]
+
+
+def _spacing(x: NDArray, y: NDArray) -> tuple[float, float]:
+    '''the (uniform) spacing of a grid'''
+    return np.ptp(x)/(len(x) - 1), np.ptp(y)/(len(y) - 1)
+
+
+def compare_psd(
+        f: NDArray[np.float64],
+        estimate: NDArray[np.float64],
+        psd: typing.Callable[[NDArray], NDArray],
+        band: tuple[float, float] | None = None
+) -> tuple[float, float]:
+    '''
+    compare an estimated PSD with a reference (e.g. `surface_psd_nominal`)
+    over a frequency `band` (by default, but the lowest bin and the top
+    half, which are biased by the window and by interpolation).
+
+    The generators scale their octaves heuristically, so the comparison is
+    of the shapes: returns the gain of the estimate with respect to the
+    reference, and the RMS error around it, both in decades.
+    '''
+    if band is None:
+        band = f[1], f[-1]/2
+    inside = (f >= band[0]) & (f <= band[1])
+    residual = np.log10(estimate[inside]/psd(f[inside]))
+    gain = float(residual.mean())
+    return gain, float(np.sqrt(np.mean((residual - gain)**2)))
+
+
+def crater_statistics(
+        diameters: NDArray[np.float64],
+        area: float,
+        distribution: PowerDistribution
+) -> dict[str, float]:
+    '''
+    compare the diameters of the craters of an `area` with the ones
+    expected from a (truncated) size-frequency distribution :
+     - `count`, `expected` : the number of craters, and the expected one
+     - `count_z` :           the deviation of the count, in standard
+                             deviations of the Poisson distribution
+     - `ks`, `p_value` :     the Kolmogorov-Smirnov statistic of the
+                             diameters against `distribution.cdf`
+    '''
+    d = np.asarray(diameters)
+    d = d[(d >= distribution.d_min) & (d <= distribution.d_max)]
+    expected = area*distribution.density
+
+    def cdf(d):
+        return (distribution.cdf(distribution.d_min) - distribution.cdf(d)) \
+            / distribution.density
+
+    ks = scipy.stats.kstest(d, cdf) if len(d) else None
+    return {
+        'count': len(d),
+        'expected': expected,
+        'count_z': (len(d) - expected)/np.sqrt(max(expected, 1e-12)),
+        'ks': float(ks.statistic) if ks else np.nan,
+        'p_value': float(ks.pvalue) if ks else np.nan,
+    }
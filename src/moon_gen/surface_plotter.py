@@ -18,11 +18,47 @@ if TYPE_CHECKING:
 else:
     from pyqtgraph.Qt import QtCore, QtGui, QtWidgets
 
+from moon_gen.lib.baking import cached_normals, export_baked, surface_normals
+from moon_gen.lib.export import DEM_FORMATS, export_dem
+from moon_gen.lib.loaders import (
+    HEIGHTMAP_FORMATS, image_size, load_dem, read_metadata
+)
+from moon_gen.lib.store import STORE_EXTENSION, save_surface
 from moon_gen.lib.utils import SurfaceFunctionType, SurfaceType
 
 
+class _GridMeshData(gl.MeshData):
+    '''
+    the mesh of a gridded surface, with its vertex normals given (e.g. by
+    `cached_normals`) instead of being computed, vertex by vertex, by
+    `MeshData.vertexNormals`
+    '''
+
+    def __init__(self, surface: SurfaceType, normals: np.ndarray) -> None:
+        x, y, z, *c = surface
+        nx, ny = np.shape(z)
+        vertexes = np.stack(np.broadcast_arrays(
+            np.reshape(x, (-1, 1)), np.reshape(y, (1, -1)), z
+        ), axis=-1).reshape((-1, 3))
+        # two triangles per cell of the grid
+        cells = (np.arange(nx-1)[:, None]*ny + np.arange(ny-1)).reshape(-1, 1)
+        faces = np.concatenate((cells + [0, 1, ny], cells + [ny, 1, ny + 1]))
+        colors = np.reshape(c[0], (nx*ny, -1)) if c else None
+        super().__init__(vertexes=vertexes, faces=faces,
+                         vertexColors=colors)
+        self._gridNormals = np.asarray(normals, float).reshape((-1, 3))
+
+    def vertexNormals(self, indexed=None):
+        if indexed is None:
+            return self._gridNormals
+        return super().vertexNormals(indexed)
+
+
 class SurfacePlotter(QtWidgets.QFrame):
 
+    MAX_DISPLAY_SIZE = 2049
+    '''larger heightmap images are decimated when they are loaded'''
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self._logger = logging.getLogger(self.__class__.__name__)
@@ -39,8 +75,9 @@ class SurfacePlotter(QtWidgets.QFrame):
             np.zeros((2, 2))
         )
 
-        self.surf = gl.GLSurfacePlotItem(
-            *self._surfaceData,
+        self.surf = gl.GLMeshItem(
+            meshdata=_GridMeshData(self._surfaceData, surface_normals(
+                self._surfaceData[2], (1., 1.))),
             shader='shaded'
         )
         self.vw.addItem(self.surf)
@@ -103,6 +140,18 @@ class SurfacePlotter(QtWidgets.QFrame):
     def __exit__(self, *args):
         pass
 
+    def showSurface(self, normals: np.ndarray | None = None):
+        '''
+        display the current surface, with a precomputed normal map if given
+        (see `surface_normals`)
+        '''
+        x, y, z, *_ = self._surfaceData
+        if normals is None:
+            normals = surface_normals(z, (np.ptp(x)/(len(x) - 1),
+                                          np.ptp(y)/(len(y) - 1)))
+        self.surf.setMeshData(
+            meshdata=_GridMeshData(self._surfaceData, normals))
+
     def toggleShader(self, active: bool):
         self.surf.setShader('normalColor' if active else 'shaded')
 
@@ -129,7 +178,7 @@ class SurfacePlotter(QtWidgets.QFrame):
         if filename.casefold().endswith('.py'):
             self.plotSurfaceFromModule(filename)
         elif filename.casefold().endswith(
-            ('.png', '.jpg', '.jepg', '.tif', '.tiff')
+            HEIGHTMAP_FORMATS + ('.jpg', '.jepg')
         ):
             self.plotSurfaceFromHeightmap(filename)
         else:
@@ -154,7 +203,7 @@ class SurfacePlotter(QtWidgets.QFrame):
         try:
             surface_func: SurfaceFunctionType = module.surface
             self._surfaceData = surface_func()
-            self.surf.setData(*self._surfaceData)
+            self.showSurface()
             self._module = module
             if surface_func.__doc__ is not None:
                 self.setToolTip(surface_func.__doc__)
@@ -169,49 +218,17 @@ class SurfacePlotter(QtWidgets.QFrame):
     def plotSurfaceFromHeightmap(self, filename: str):
         '''plot the surface defined in a heightmap image file'''
         try:
-            surface_image = QtGui.QImage(filename)
-            surface_image.convertTo(
-                QtGui.QImage.Format.Format_Grayscale8,
-                QtCore.Qt.ImageConversionFlag.MonoOnly
-            )
-            w = surface_image.width()
-            h = surface_image.height()
-            ptr = surface_image.constBits()
-            ptr.setsize(surface_image.sizeInBytes())
-
-            # QImage has some end-of-line padding, so that each line
-            # is word-aligned
-            padding = surface_image.sizeInBytes()//w - h
-
-            x_range, _ = QtWidgets.QInputDialog.getDouble(
-                self,
-                "X range",
-                "please input width of heightmap image (in meters)",
-                20, 0, 10000
-            )
-            y_range, _ = QtWidgets.QInputDialog.getDouble(
-                self,
-                "Y range",
-                "please input height of heightmap image (in meters)",
-                x_range/w*h, 0, 10000
-            )
-            z_range, _ = QtWidgets.QInputDialog.getDouble(
-                self,
-                "Z range",
-                "please input depth of heightmap image (in meters)",
-                1, 0, 10000
-            )
-
-            x = np.linspace(-x_range/2, x_range/2, w)
-            y = np.linspace(-y_range/2, y_range/2, h)
-
-            zz = np.asarray(ptr, dtype=np.uint8).reshape((h, w+padding))
-            if padding:
-                zz = zz[:, :-padding]
-            z = np.flipud(zz.T).astype(float)*(z_range/(2**8-1))
+            if filename.casefold().endswith(HEIGHTMAP_FORMATS):
+                extents = read_metadata(filename)
+                if 'z' not in extents:
+                    extents = self._askExtents(*image_size(filename))
+                x, y, z = load_dem(filename, self.MAX_DISPLAY_SIZE,
+                                   extents=extents)
+            else:
+                x, y, z = self._loadQImage(filename)
 
             self._surfaceData = x, y, z
-            self.surf.setData(*self._surfaceData)
+            self.showSurface(cached_normals(self._surfaceData, filename))
             self._module = None
 
             self.setToolTip(os.path.basename(filename))
@@ -222,6 +239,52 @@ class SurfacePlotter(QtWidgets.QFrame):
             self._logger.error(ermsg)
             self._logger.exception(e)
 
+    def _askExtents(self, w: int, h: int) -> dict:
+        '''ask for the extents of a heightmap image of `w` x `h` pixels'''
+        x_range, _ = QtWidgets.QInputDialog.getDouble(
+            self,
+            "X range",
+            "please input width of heightmap image (in meters)",
+            20, 0, 10000
+        )
+        y_range, _ = QtWidgets.QInputDialog.getDouble(
+            self,
+            "Y range",
+            "please input height of heightmap image (in meters)",
+            x_range/w*h, 0, 10000
+        )
+        z_range, _ = QtWidgets.QInputDialog.getDouble(
+            self,
+            "Z range",
+            "please input depth of heightmap image (in meters)",
+            1, 0, 10000
+        )
+        return {'x': [-x_range/2, x_range/2], 'y': [-y_range/2, y_range/2],
+                'z': [0, z_range]}
+
+    def _loadQImage(self, filename: str) -> SurfaceType:
+        '''load a heightmap in any other image format supported by Qt'''
+        surface_image = QtGui.QImage(filename)
+        surface_image.convertTo(
+            QtGui.QImage.Format.Format_Grayscale16,
+            QtCore.Qt.ImageConversionFlag.MonoOnly
+        )
+        w = surface_image.width()
+        h = surface_image.height()
+        ptr = surface_image.constBits()
+        ptr.setsize(surface_image.sizeInBytes())
+
+        # QImage has some end-of-line padding, so that each line
+        # is word-aligned
+        line = surface_image.bytesPerLine()//2
+        zz = np.frombuffer(ptr, dtype=np.uint16).reshape((h, line))[:, :w]
+
+        extents = self._askExtents(w, h)
+        x = np.linspace(*extents['x'], w)
+        y = np.linspace(*extents['y'], h)
+        z = zz.T[::-1]*(extents['z'][1]/(2**16-1))
+        return x, y, z
+
     def reloadSurface(self):
         if self._module is not None:
             self.reloadSurfaceModule()
@@ -258,7 +321,7 @@ class SurfacePlotter(QtWidgets.QFrame):
 
         # try to retrieve a surface from the module
         self._surfaceData = self._module.surface()
-        self.surf.setData(*self._surfaceData)
+        self.showSurface()
 
     def reloadSurfaceImage(self):
         x, y, z, *c = self._surfaceData
@@ -287,10 +350,14 @@ class SurfacePlotter(QtWidgets.QFrame):
         z *= (z_range/np.ptp(z))
 
         self._surfaceData = x, y, z
-        self.surf.setData(*self._surfaceData)
+        self.showSurface()
 
     def exportSurface(self, *, filename: str | None = None):
-        '''export a surface to a PNG image file'''
+        '''
+        export a surface to a DEM file (16-bit PNG, raw float32 or npy),
+        along with its baked textures (see `export_baked`), or to a chunked
+        store (see `save_surface`)
+        '''
         x, y, z, *c = self._surfaceData
 
         if filename is None:
@@ -299,27 +366,24 @@ class SurfacePlotter(QtWidgets.QFrame):
                 'save heightmap',
                 f'./heightmap_{int(np.ptp(x))}'
                 f'_{int(np.ptp(y))}_{np.ptp(z):.1f}.png',
-                'PNG (*.png)'
+                'PNG (*.png);;RAW float32 (*.r32);;NumPy (*.npy);;'
+                f'chunked store (*{STORE_EXTENSION})'
             )
 
         if filename in ('', None):
             return
 
-        if not filename.casefold().endswith('.png'):
+        if not filename.casefold().endswith(DEM_FORMATS + (STORE_EXTENSION,)):
             filename += '.png'
 
-        # zz: np.ndarray = (1000*(z - z.min())).astype(np.uint16)
-        zz: np.ndarray = ((z - z.min())*(255/np.ptp(z))).astype(np.uint8)
-        zz = np.flipud(zz).transpose()
-
-        img = QtGui.QImage(
-            zz.data.tobytes(),
-            z.shape[0],
-            z.shape[1],
-            # z.shape[0]*2,  # 16 bits == 2 bytes
-            # QtGui.QImage.Format.Format_Grayscale16
-            z.shape[0],  # 8 bits == 1 byte
-            QtGui.QImage.Format.Format_Grayscale8
-        )
-
-        img.save(filename)
+        try:
+            if filename.casefold().endswith(STORE_EXTENSION):
+                save_surface(self._surfaceData, filename)
+            else:
+                export_dem(self._surfaceData, filename)
+                export_baked(self._surfaceData, filename)
+        except Exception as e:
+            ermsg = f"failed to export heightmap ({e})"
+            self._err_message.showMessage(ermsg, 'error')
+            self._logger.error(ermsg)
+            self._logger.exception(e)
@@ -1,7 +1,10 @@
 import numpy as np
 
 from moon_gen.lib.utils import SurfaceType
-from moon_gen.lib.craters import make_procedural_craters
+from moon_gen.lib.craters import (
+    make_procedural_craters,
+    crater_density_young,
+)
 
 __depends__ = [
     "moon_gen.lib.utils",
@@ -23,9 +26,10 @@ def surface(n=150) -> SurfaceType:
     y = np.linspace(-size, size, ny)
     z = .005*np.random.random((nx, ny))
 
-    thresh = np.random.random()/100 + 99/100
-    # thresh = .9987
-    z = make_procedural_craters(x, y, z, thresh)
+    distribution = crater_density_young.truncated(d_min=4*size/n)
+
+    z = make_procedural_craters(x, y, z, distribution,
+                                seed=np.random.randint(2**31))
     print("done")
 
     return x, y, z
@@ -1,8 +1,10 @@
+import os
+
 import numpy as np
 
 from moon_gen.lib.utils import SurfaceType
 from moon_gen.lib.craters import (  # noqa: F401
-    make_crater,
+    make_craters,
     crater_density_fresh, crater_density_young,
     crater_density_mature, crater_density_old,
 )
@@ -30,16 +32,13 @@ def surface(n=257) -> SurfaceType:
                                       crater_density_young,
                                      crater_density_mature,
                                      crater_density_old)):
-        distribution.d_min = 4*size/n
-        nb_craters = distribution.number(x, y)
-        print(f"generating {nb_craters} craters")
-
-        for _ in range(nb_craters):
-            d = distribution.diameter(np.random.random())
-            center = (np.ptp(x) * np.random.random() + x.min(),
-                      np.ptp(y) * np.random.random() + y.min())
-            z[:, i*ny:(i+1)*ny] = make_crater(x, y,
-                                              z[:, i*ny:(i+1)*ny], d/2, center)
+        distribution = distribution.truncated(d_min=4*size/n)
+        cxs, cys, diameters = distribution.sample(
+            x, y, np.random.randint(2**31))
+        print(f"generating {len(diameters)} craters")
+
+        make_craters(x, y, z[:, i*ny:(i+1)*ny], diameters/2, (cxs, cys),
+                     workers=os.cpu_count())
 
     print("done")
 
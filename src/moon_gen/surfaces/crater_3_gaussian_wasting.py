@@ -25,18 +25,14 @@ def surface(n=257) -> SurfaceType:
     y = np.linspace(-size, size, ny)
     z = np.random.normal(scale=0.05, size=(nx, ny))
 
-    distribution = crater_density_young
-    distribution.d_min = 4*size/n
+    distribution = crater_density_young.truncated(d_min=4*size/n)
 
-    nb_craters = distribution.number(x, y)
-    print(f"generating {nb_craters} craters")
+    cxs, cys, diameters = distribution.sample(x, y, np.random.randint(2**31))
+    print(f"generating {len(diameters)} craters")
 
-    for _ in range(nb_craters):
+    for cx, cy, d in zip(cxs, cys, diameters):
         # make the crater
-        d = distribution.diameter(np.random.random())
-        center = (np.ptp(x) * np.random.random() + x.min(),
-                  np.ptp(y) * np.random.random() + y.min())
-        z = make_crater(x, y, z, d/2, center)
+        z = make_crater(x, y, z, d/2, (cx, cy))
         # apply mass wasting
         z = waste_gaussian(z, np.random.random())
 
@@ -1,20 +1,20 @@
 import numpy as np
 
-from moon_gen.lib.utils import SurfaceType
+from moon_gen.lib.utils import SurfaceType, albedo_colors
 from moon_gen.lib.craters import (  # noqa: F401
-    make_crater, waste_gaussian,
     crater_density_fresh, crater_density_young,
     crater_density_mature, crater_density_old,
 )
 from moon_gen.lib.heightmaps import (  # noqa: F401
-    perlin_multiscale_grid,
     surface_psd_rough, surface_psd_nominal, surface_psd_smooth,
 )
+from moon_gen.lib.pipeline import Background, run_recipe, weathered_craters
 
 __depends__ = [
     "moon_gen.lib.utils",
     "moon_gen.lib.craters",
-    "moon_gen.lib.heightmaps"
+    "moon_gen.lib.heightmaps",
+    "moon_gen.lib.pipeline"
 ]
 
 
@@ -24,44 +24,16 @@ def parametric_surface(
         ocatves=6,  # don't need many, bc weathering
         psd=surface_psd_nominal,
         distribution=crater_density_young,
+        workers=None,
+        return_catalog=False,
+        background=None,  # e.g. a `DEMSource`, instead of perlin noise
+        seed=None,
+        albedo=None,  # an array, in which to paint the crater ejecta
 ):
-
-    print("generating background")
-    z = perlin_multiscale_grid(
-        x,
-        y,
-        octaves=ocatves,
-        psd=psd,
-    )
-
-    distribution.d_min = 4*np.ptp(x)/len(x)
-    nb_craters = distribution.number(x, y)
-    print(f"generating {nb_craters} craters")
-
-    # create older craters first and weather them
-    for w in reversed(range(epochs)):
-        for _ in range(nb_craters//epochs):
-            d = distribution.diameter(np.random.random())
-            center = (np.ptp(x) * np.random.random() + np.min(x),
-                      np.ptp(y) * np.random.random() + np.min(y))
-            z = make_crater(x, y, z, d/2, center)
-
-        if w > 0:
-            z = waste_gaussian(z, np.ptp(x)/len(x), w/epochs)
-
-    # apply micro-meteorite impacts
-    z += np.random.normal(scale=2e-2*np.ptp(x)/len(x), size=z.shape)
-
-    # create the last remaining craters unweathered
-    for _ in range(nb_craters % epochs):
-        d = distribution.diameter(np.random.random())
-        center = (np.ptp(x) * np.random.random() + np.min(x),
-                  np.ptp(y) * np.random.random() + np.min(y))
-        z = make_crater(x, y, z, d/2, center)
-
-    print("done")
-
-    return z
+    recipe = Background(ocatves, psd, background) + \
+        weathered_craters(distribution, epochs)
+    return run_recipe(recipe, x, y, seed, workers,
+                      return_catalog=return_catalog, albedo=albedo)
 
 
 # def surface(n=1025) -> SurfaceType:
@@ -73,6 +45,7 @@ def surface(n=130) -> SurfaceType:
      - mutliscale perlin grid with a lunar highland PSD
      - randomly placed craters
      - gaussian-blur style mass wasting
+     - bright ejecta, darkening with age
     '''
     nx = ny = n
     ny += 1
@@ -83,8 +56,11 @@ def surface(n=130) -> SurfaceType:
     x = np.linspace(-ax/2, ax/2, nx)
     y = np.linspace(-ay/2, ay/2, ny)
 
+    albedo = np.zeros((nx, ny))
     z = parametric_surface(x+cx, y+cy, epochs,
                            psd=surface_psd_nominal,
-                           distribution=crater_density_mature)
+                           distribution=crater_density_mature,
+                           seed=np.random.randint(2**31),
+                           albedo=albedo)
 
-    return x, y, z
+    return x, y, z, albedo_colors(albedo)
@@ -0,0 +1,46 @@
+import numpy as np
+
+from moon_gen.lib.utils import SurfaceType
+from moon_gen.lib.procedural import (  # noqa: F401
+    ProceduralTerrain, height_grid,
+)
+from moon_gen.lib.craters import (  # noqa: F401
+    crater_density_fresh, crater_density_young,
+    crater_density_mature, crater_density_old,
+)
+from moon_gen.lib.heightmaps import (  # noqa: F401
+    surface_psd_rough, surface_psd_nominal, surface_psd_smooth,
+)
+
+__depends__ = [
+    "moon_gen.lib.utils",
+    "moon_gen.lib.craters",
+    "moon_gen.lib.heightmaps",
+    "moon_gen.lib.procedural",
+]
+
+
+def surface(n=129) -> SurfaceType:
+    '''
+    create a deterministic lunar surface using:
+     - mutliscale perlin grid with a lunar highland PSD
+     - procedurally placed craters
+    the same terrain can be queried at arbitrary points with `height_at`
+    '''
+    nx = ny = n
+    ax = ay = 20
+
+    recipe = ProceduralTerrain(
+        cycle=ax,
+        psd=surface_psd_nominal,
+        distribution=crater_density_mature.truncated(d_min=4*ax/n),
+    )
+
+    cx, cy = 100*np.random.random((2,))
+    x = np.linspace(-ax/2, ax/2, nx)
+    y = np.linspace(-ay/2, ay/2, ny)
+
+    z = height_grid(x+cx, y+cy, recipe, seed=np.random.randint(2**31))
+    print("done")
+
+    return x, y, z
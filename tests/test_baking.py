@@ -0,0 +1,65 @@
+import os
+import zlib
+
+import numpy as np
+
+from moon_gen.lib.baking import (
+    bake, cached_normals, export_baked, hillshade, surface_normals,
+)
+
+
+def _surface():
+    x, y = np.linspace(-5, 5, 60), np.linspace(-4, 4, 50)
+    r = np.hypot(*np.meshgrid(x, y, indexing='ij'))
+    return x, y, np.exp(-r**2) - .05*x[:, None]
+
+
+def test_normals_and_hillshade():
+    x, y = np.linspace(0, 10, 11), np.linspace(0, 5, 6)
+    z = .5*x[:, None] + 0*y
+    normals = surface_normals(z, (1., 1.))
+    assert np.allclose(normals, np.array([-.5, 0, 1])/np.sqrt(1.25))
+    assert np.allclose(hillshade(normals, 270, 0), .5/np.sqrt(1.25)), \
+        "lit from -x, facing -x"
+
+
+def test_tiled_bake_matches_whole():
+    surface = _surface()
+    whole = bake(surface, radius=8, tile=1000)
+    tiled = bake(surface, radius=8, tile=16)
+    for name in whole:
+        assert np.array_equal(whole[name], tiled[name]), name
+
+    occlusion = whole['occlusion']
+    assert np.all((occlusion > 0) & (occlusion <= 1))
+    summit = np.unravel_index(np.argmax(surface[2]), occlusion.shape)
+    assert occlusion[summit] == 1, "the summit sees the whole sky"
+
+
+def test_export_and_cache(tmp_path):
+    surface = _surface()
+    names = export_baked(surface, tmp_path / 'dem.png', strip=7, radius=4)
+    data = open(names['normals'], 'rb').read()
+    assert data[24:26] == b'\x08\x02', "8-bit RGB"
+    idat, pos = b'', 8
+    while pos < len(data):
+        length = int.from_bytes(data[pos:pos+4], 'big')
+        if data[pos+4:pos+8] == b'IDAT':
+            idat += data[pos+8:pos+8+length]
+        pos += 12 + length
+    rows = np.frombuffer(zlib.decompress(idat), np.uint8) \
+        .reshape((50, 1 + 3*60))[:, 1:].reshape((50, 60, 3))
+    assert np.all(rows[..., 2] > 128), "the normals point up"
+
+    dem = tmp_path / 'dem.npy'
+    np.save(dem, surface[2])
+    normals = cached_normals(surface, dem)
+    assert os.path.exists(f'{dem}.normals.npz')
+    assert np.array_equal(cached_normals(surface, dem), normals)
+
+    # the same file, loaded with other extents
+    x, y, z = surface[:3]
+    stretched = cached_normals((2*x, 2*y, z), dem)
+    assert np.array_equal(stretched, surface_normals(z, (2*(x[1] - x[0]),
+                                                         2*(y[1] - y[0]))))
+    assert not np.allclose(stretched, normals)
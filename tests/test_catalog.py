@@ -0,0 +1,50 @@
+import pytest
+
+import numpy as np
+
+from moon_gen.lib.catalog import CraterCatalog, CRATER_DTYPE
+
+
+@pytest.fixture
+def catalog():
+    rng = np.random.default_rng(0)
+    return CraterCatalog.from_arrays(
+        rng.uniform(0.1, 2., 1000),
+        (rng.uniform(-50, 50, 1000), rng.uniform(-50, 50, 1000)),
+        np.linspace(1, 0, 1000)
+    )
+
+
+def test_range_queries(catalog):
+    near = catalog.within(10., -5., 8.)
+    distance = np.hypot(catalog.x - 10., catalog.y + 5.)
+    assert len(near) == np.count_nonzero(distance <= 8.)
+    assert np.all(np.diff(near.age) <= 0), "order should be preserved"
+
+    covering = catalog.covering(10., -5., extent=2.)
+    assert np.all(np.hypot(covering.x - 10, covering.y + 5)
+                  < 2*covering.radius)
+
+    assert catalog.count((-50, 0), (-50, 50)) + \
+        catalog.count((0, 50), (-50, 50)) == len(catalog)
+    assert catalog.count((-50, 50), (-50, 50), d_min=2.) == \
+        np.count_nonzero(catalog.radius >= 1.)
+
+
+def test_nearest(catalog):
+    distance, index = catalog.nearest(np.array([0., 20.]),
+                                      np.array([0., -20.]))
+    brute = np.hypot(catalog.x - 20, catalog.y + 20)
+    assert index[1] == brute.argmin()
+    assert np.isclose(distance[1], brute.min())
+
+
+def test_save_and_load(catalog, tmp_path):
+    catalog.save(tmp_path / "catalog.npy")
+    loaded = CraterCatalog.load(tmp_path / "catalog.npy")
+    assert loaded.craters.dtype == CRATER_DTYPE
+    assert np.array_equal(loaded.craters, catalog.craters)
+
+    np.save(tmp_path / "other.npy", np.zeros(3))
+    with pytest.raises(ValueError):
+        CraterCatalog.load(tmp_path / "other.npy")
@@ -0,0 +1,23 @@
+import numpy as np
+
+from moon_gen.lib.clipmap import Clipmap
+from moon_gen.lib.procedural import ProceduralTerrain, height_grid
+
+
+def test_clipmap_incremental_update():
+    recipe = ProceduralTerrain()
+    clipmap = Clipmap(recipe, levels=3, size=33, spacing=0.25, seed=2)
+    clipmap.update((0., 0.))
+    assert clipmap.generated == 3*33**2
+
+    clipmap.update((1.1, -0.6))
+    assert 0 < clipmap.generated < 33**2, "only the exposed strips"
+
+    for level in range(clipmap.levels):
+        x, y, z = clipmap.level(level)
+        assert np.isclose(np.diff(x).mean(), 0.25*2**level)
+        assert x[0] < 1.1 < x[-1] and y[0] < -0.6 < y[-1]
+        assert np.allclose(z, height_grid(x, y, recipe, seed=2))
+
+    clipmap.update((1.1, -0.6))
+    assert clipmap.generated == 0
@@ -0,0 +1,185 @@
+import time
+
+import pytest
+
+import numpy as np
+
+from moon_gen.lib.craters import (
+    make_crater, stamp_crater, crater_profile, CraterProfile,
+    procedural_craters, PowerDistribution,
+    splat_craters, make_craters, stamp_craters, independent_batches,
+    erode_thermal, ejecta_brightness, HDR
+)
+
+
+@pytest.fixture
+def grid():
+    x = np.linspace(-10, 10, 201)
+    y = np.linspace(-10, 10, 202)
+    z = np.zeros((len(x), len(y)))
+    return x, y, z
+
+
+def test_profile_tables():
+    profile = CraterProfile(noise=0)
+    s = np.linspace(0, 1, 11)
+    assert np.allclose(profile.bowl(s), 2*(HDR-profile.ddr) + 2*profile.ddr*s)
+    assert np.isclose(profile.ejecta(np.array(1.)), 2*HDR, rtol=1e-2), \
+        "the rim height should be preserved"
+    assert profile.ejecta(np.array(profile.extent**2 + 1.)) == 0, \
+        "the ejecta should vanish outside of the footprint"
+
+
+def test_profile_is_cached():
+    assert crater_profile() is crater_profile()
+
+
+def test_lookup_matches_exact_bowl(grid):
+    x, y, z = grid
+    exact = make_crater(x, y, z, 2, (1, 1))
+    lookup = make_crater(x, y, z, 2, (1, 1), crater_profile())
+
+    r = np.sqrt((x.reshape((-1, 1))-1)**2 + (y.reshape((1, -1))-1)**2)
+    assert np.allclose(exact[r < 1.8], lookup[r < 1.8])
+    assert not z.any(), "`make_crater` should not modify its input"
+
+
+def test_stamp_is_local(grid):
+    x, y, z = grid
+    profile = crater_profile()
+    stamp_crater(x, y, z, 1, (-5, 5), profile)
+
+    r = np.sqrt((x.reshape((-1, 1))+5)**2 + (y.reshape((1, -1))-5)**2)
+    assert z[r < 1].min() < 0, "the bowl should be carved in place"
+    assert not z[r > profile.extent].any(), "outside the footprint"
+
+
+def test_procedural_craters_are_consistent():
+    distribution = PowerDistribution(2e-2, -2., d_min=0.2)
+    cx, cy, d, age = procedural_craters((-10, 10), (-10, 10),
+                                        distribution, seed=3)
+    assert np.all(np.diff(age) <= 0), "craters should be oldest first"
+    assert np.all((d >= 0.2) & (d < distribution.icdf(1e-6)))
+
+    # a sub-region yields the same craters, irrespective of the query
+    sx, sy, sd, _ = procedural_craters((-2, 3), (0, 4),
+                                       distribution, seed=3)
+    assert len(sd) > 0
+    assert set(zip(sx, sy, sd)) <= set(zip(cx, cy, d))
+
+    other = procedural_craters((-10, 10), (-10, 10), distribution, seed=4)
+    assert not np.array_equal(other[0][:len(cx)], cx[:len(other[0])])
+
+
+def test_procedural_craters_without_size_classes():
+    distribution = PowerDistribution(2e-2, -2., d_min=0.2)
+    for d_max in (.2, .1):
+        craters = procedural_craters((-10, 10), (-10, 10), distribution,
+                                     d_max=d_max)
+        assert all(len(c) == 0 for c in craters)
+
+
+def test_splat_approximates_stamp(grid):
+    x, y, z = grid
+    profile = CraterProfile(noise=0)
+    radius, center = 2.5*np.ptp(x)/len(x), (1.234, -2.345)
+
+    stamped = stamp_crater(x, y, z.copy(), radius, center, profile)
+    splatted = splat_craters(x, y, z.copy(), np.array([radius]),
+                             (np.array([center[0]]), np.array([center[1]])),
+                             profile)
+    assert np.linalg.norm(splatted - stamped) < \
+        0.25*np.linalg.norm(stamped)
+
+
+def test_make_craters_splits_batch(grid):
+    x, y, z = grid
+    profile = CraterProfile(noise=0)
+    radii = np.array([2., .15, .12])
+    centers = (np.array([0., 5., -5.]), np.array([0., 5., -5.]))
+
+    make_craters(x, y, z, radii, centers, profile)
+    i, j = [np.abs(x - c).argmin() for c in centers[0]], \
+        [np.abs(y - c).argmin() for c in centers[1]]
+    assert z[i[0], j[0]] < -0.7, "the large crater should be stamped"
+    assert z[i[1], j[1]] < 0 and z[i[2], j[2]] < 0, \
+        "the small craters should be splatted"
+
+
+def test_independent_batches(grid):
+    x, y, z = grid
+    rng = np.random.default_rng(0)
+    radii = rng.uniform(0.1, 1., 200)
+    centers = (rng.uniform(-10, 10, 200), rng.uniform(-10, 10, 200))
+
+    batches = independent_batches(x, y, radii, centers, extent=2.)
+    assert sorted(np.concatenate(batches)) == list(range(200))
+
+    group = np.zeros(200, int)
+    for k, batch in enumerate(batches):
+        group[batch] = k
+    distance = np.hypot(centers[0].reshape((-1, 1)) - centers[0],
+                        centers[1].reshape((-1, 1)) - centers[1])
+    overlap = distance < 2.*(radii.reshape((-1, 1)) + radii)
+    earlier, later = np.nonzero(np.triu(overlap, 1))
+    assert np.all(group[earlier] < group[later]), \
+        "overlapping craters should be stamped in order"
+
+
+def test_threaded_stamping_matches_serial(grid):
+    x, y, z = grid
+    profile = CraterProfile(noise=0)
+    rng = np.random.default_rng(1)
+    radii = rng.uniform(0.2, 2., 100)
+    centers = (rng.uniform(-10, 10, 100), rng.uniform(-10, 10, 100))
+
+    serial = stamp_craters(x, y, z.copy(), radii, centers, profile)
+    threaded = stamp_craters(x, y, z.copy(), radii, centers, profile,
+                             workers=4)
+    assert np.array_equal(serial, threaded)
+
+
+def test_thermal_erosion(grid):
+    x, y, z = grid
+    r = np.hypot(*np.meshgrid(x, y, indexing='ij'))
+    z = .1*x[:, None] + np.maximum(0, 2*(2 - r)) + 0*y
+    dx = x[1] - x[0]
+    eroded = erode_thermal(z, dx, angle=45)
+    assert np.isclose(eroded.sum(), z.sum()), "mass should be conserved"
+    assert np.abs(np.diff(eroded, axis=0)).max() < 1.01*dx
+    assert np.abs(np.diff(eroded, axis=1)).max() < 1.01*dx
+    assert np.array_equal(eroded[r > 6], z[r > 6]), \
+        "gentle slopes should be left untouched"
+
+
+def test_thermal_erosion_cost_follows_the_unsettled_area():
+    # a pillar needs hundreds of iterations to settle, which would take
+    # far longer if every one of them swept the whole grid
+    z = np.zeros((1025, 1025))
+    z[510:515, 510:515] = 3.
+    start = time.perf_counter()
+    eroded = erode_thermal(z, .1, angle=35)
+    assert time.perf_counter() - start < 2.
+    assert np.isclose(eroded.sum(), z.sum())
+    assert np.count_nonzero(eroded) < 1000
+
+
+def test_albedo_in_same_pass(grid):
+    x, y, z = grid
+    radii = np.array([2., .1, .15])
+    centers = np.array([-4., 5., 6.]), np.array([0., 5., 5.])
+
+    profile = crater_profile(noise=0.)
+    plain = make_craters(x, y, z.copy(), radii, centers, profile)
+    albedo = np.zeros_like(z)
+    painted = make_craters(x, y, z.copy(), radii, centers, profile,
+                           albedo=albedo,
+                           brightness=ejecta_brightness(np.array([0, 1, 1])))
+    assert np.array_equal(plain, painted), "the albedo shouldn't change z"
+
+    assert np.isclose(albedo[60, 100], 1), "fresh ejecta are bright"
+    far = np.hypot(*np.meshgrid(x + 4, y, indexing='ij')) > 10.5
+    assert albedo[far & (x[:, None] < 3)].max() == 0, \
+        "beyond the footprints"
+    assert 0 < albedo[150:161, 150:161].max() < 1.5*ejecta_brightness(1), \
+        "small craters are splatted, and older ones are darker"
@@ -0,0 +1,44 @@
+import numpy as np
+
+from moon_gen.lib.craters import crater_density_young
+from moon_gen.lib.dem import DEMSource
+from moon_gen.lib.export import export_dem
+from moon_gen.surfaces.full_1_random import parametric_surface
+
+
+def test_dem_window_resampling(tmp_path):
+    x, y = np.linspace(-50, 50, 201), np.linspace(0, 80, 161)
+    z = 0.1*x.reshape((-1, 1)) + 0.05*y**1.5
+    export_dem((x, y, z), tmp_path / 'dem.npy')
+
+    dem = DEMSource.open(tmp_path / 'dem.npy')
+    assert dem.extents == ((-50, 50), (0, 80))
+    assert isinstance(dem.z.base, np.memmap)
+
+    gx, gy = np.linspace(-10, 12, 37), np.linspace(30, 31, 5)
+    expected = 0.1*gx.reshape((-1, 1)) + 0.05*gy**1.5
+    assert np.allclose(dem(gx, gy), expected, atol=1e-3)
+
+    # grids past the edges are clamped
+    assert np.allclose(dem(np.array([-60., 60.]), np.array([0.])),
+                       [[z[0, 0]], [z[-1, 0]]], atol=1e-4)
+
+
+def test_dem_quantized(tmp_path):
+    x, y = np.linspace(0, 10, 51), np.linspace(0, 10, 41)
+    z = np.sin(x).reshape((-1, 1)) + np.cos(y)
+    export_dem((x, y, z), tmp_path / 'dem.png')
+
+    dem = DEMSource.open(tmp_path / 'dem.png')
+    assert np.allclose(dem(x, y), z, atol=1e-4)
+
+
+def test_dem_background():
+    x = np.linspace(0, 4, 33)
+    dem = DEMSource(x, x, np.add.outer(x, x))
+    # craters much smaller than the surface, so they can't hide the DEM
+    distribution = crater_density_young.truncated(d_max=1.)
+    z = parametric_surface(x, x, epochs=2, distribution=distribution,
+                           background=dem, seed=0)
+    assert z.shape == (33, 33)
+    assert abs(np.mean(z) - 4) < 0.5, "the DEM should be the base terrain"
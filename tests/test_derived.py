@@ -0,0 +1,35 @@
+import numpy as np
+
+from moon_gen.lib.craters import waste_gaussian
+from moon_gen.lib.derived import terrain_products, PRODUCTS
+from moon_gen.lib.tiling import iter_tiles
+
+
+def test_iter_tiles_cover():
+    covered = np.zeros((50, 37), int)
+    for block, window, inner in iter_tiles(covered.shape, 16, 3):
+        covered[block] += 1
+        assert covered[window][inner].shape == covered[block].shape
+    assert np.all(covered == 1)
+
+
+def test_tiled_wasting_matches_whole():
+    z = np.random.default_rng(0).random((70, 90))
+    assert np.allclose(waste_gaussian(z, .1, .3, tile=32),
+                       waste_gaussian(z, .1, .3))
+
+
+def test_terrain_products():
+    x, y = np.linspace(0, 10, 81), np.linspace(0, 5, 47)
+    z = 0.5*x.reshape((-1, 1)) + np.sin(y)
+    products = terrain_products((x, y, z), tile=16)
+
+    whole = terrain_products((x, y, z), tile=1000)
+    for name in PRODUCTS:
+        assert np.array_equal(products[name], whole[name]), name
+
+    dzdy = np.cos(y)
+    slope = np.degrees(np.arctan(np.hypot(0.5, dzdy)))
+    assert np.allclose(products['slope'][10:-10, 10:-10], slope[10:-10],
+                       atol=0.5)
+    assert np.array_equal(products['hazard'], products['slope'] > 20.)
@@ -0,0 +1,57 @@
+import pytest
+
+import numpy as np
+
+from moon_gen.lib.distributions import (
+    PowerDistribution,
+    cash_uniform,
+    crater_density_young,
+    poisson_icdf,
+)
+
+
+def test_distributions_are_immutable():
+    with pytest.raises(AttributeError):
+        crater_density_young.d_min = 1.  # type: ignore
+
+    truncated = crater_density_young.truncated(d_min=1., d_max=10.)
+    assert truncated is not crater_density_young
+    assert crater_density_young.d_min == 0.1
+    assert np.isclose(truncated.density,
+                      crater_density_young.cdf(1.)
+                      - crater_density_young.cdf(10.))
+
+
+def test_sample_is_bounded_and_reproducible():
+    distribution = PowerDistribution(2e-1, -2., d_min=0.5, d_max=2.)
+    x = np.linspace(0, 100, 11)
+    y = np.linspace(-50, 50, 11)
+
+    cx, cy, d = distribution.sample(x, y, np.random.Philox(42))
+    assert abs(len(d) - distribution.number(x, y)) < 5*np.sqrt(len(d))
+    assert np.all((d >= 0.5) & (d <= 2.))
+    assert np.all((cx >= 0) & (cx <= 100) & (cy >= -50) & (cy <= 50))
+
+    again = distribution.sample(x, y, np.random.Philox(42))
+    assert np.array_equal(d, again[2])
+
+
+def test_sample_is_smaller_than_the_area():
+    x = np.linspace(0, 4, 5)
+    _, _, d = crater_density_young.truncated(d_min=.1).sample(x, x, 0)
+    assert len(d) > 0 and np.all(d <= 4)
+
+
+def test_poisson_icdf():
+    u = (np.arange(100000) + .5) / 100000
+    k = poisson_icdf(3., u)
+    assert np.isclose(k.mean(), 3., rtol=1e-3)
+    assert np.isclose(k.var(), 3., rtol=1e-2)
+
+
+def test_cash_uniform_channels_are_independent():
+    key = np.arange(100000)
+    u = np.array([cash_uniform(key, 0, channel) for channel in range(4)])
+    assert np.all((u >= 0) & (u < 1))
+    assert np.allclose(u.mean(axis=1), .5, atol=1e-2)
+    assert np.abs(np.corrcoef(u) - np.eye(4)).max() < 2e-2
@@ -0,0 +1,75 @@
+import json
+import zlib
+
+import numpy as np
+
+from moon_gen.lib.export import export_dem, gazebo_size
+from moon_gen.lib.utils import albedo_colors
+
+
+def _surface():
+    x, y = np.linspace(-5, 5, 40), np.linspace(0, 3, 25)
+    return x, y, np.sin(x).reshape((-1, 1)) * np.cos(y)
+
+
+def _read_png16(filename):
+    data = open(filename, 'rb').read()
+    width, height = np.frombuffer(data[16:24], '>u4')
+    idat, pos = b'', 8
+    while pos < len(data):
+        length = int.from_bytes(data[pos:pos+4], 'big')
+        if data[pos+4:pos+8] == b'IDAT':
+            idat += data[pos+8:pos+8+length]
+        pos += 12 + length
+    raw = np.frombuffer(zlib.decompress(idat), np.uint8)
+    rows = raw.reshape((height, 1 + 2*width))
+    assert not rows[:, 0].any()
+    return rows[:, 1:].copy().view('>u2')
+
+
+def test_gazebo_size():
+    assert [gazebo_size(n) for n in (2, 3, 4, 129, 130)] == [2, 3, 5, 129, 257]
+
+
+def test_export_png16(tmp_path):
+    x, y, z = _surface()
+    export_dem((x, y, z), tmp_path / 'dem.png', strip=7)
+    image = _read_png16(tmp_path / 'dem.png')
+    metadata = json.load(open(tmp_path / 'dem.png.json'))
+
+    z_min, z_max = metadata['z']
+    restored = np.flipud(image.T)*(z_max - z_min)/(2**16 - 1) + z_min
+    assert np.allclose(restored, z, atol=(z_max - z_min)/2**16)
+    assert metadata['x'] == [-5, 5] and metadata['shape'] == [40, 25]
+
+
+def test_export_raw_and_npy(tmp_path):
+    x, y, z = _surface()
+    export_dem((x, y, z), tmp_path / 'dem.r32', strip=4)
+    raw = np.fromfile(tmp_path / 'dem.r32', '<f4').reshape((25, 40))
+    assert np.allclose(np.flipud(raw.T), z)
+
+    export_dem((x, y, z), tmp_path / 'dem.npy', strip=4)
+    assert np.allclose(np.load(tmp_path / 'dem.npy'), z)
+
+    metadata = export_dem((x, y, z), tmp_path / 'big.npy', size=65)
+    resampled = np.load(tmp_path / 'big.npy')
+    assert resampled.shape == (65, 65) == tuple(metadata['shape'])
+    assert np.allclose(resampled[[0, -1]][:, [0, -1]], z[[0, -1]][:, [0, -1]])
+    export_dem((x, y, z), tmp_path / 'big.r32', size=65, strip=16)
+    raw = np.fromfile(tmp_path / 'big.r32', '<f4').reshape((65, 65))
+    assert np.allclose(np.flipud(raw.T), resampled)
+
+
+def test_export_albedo(tmp_path):
+    x, y, z = _surface()
+    albedo = np.abs(z)
+    metadata = export_dem((x, y, z, albedo_colors(albedo)),
+                          tmp_path / 'dem.r32', strip=6)
+    assert metadata['albedo'] == 'dem_albedo.png'
+    image = _read_png16(tmp_path / 'dem_albedo.png')
+    assert np.allclose(image/(2**16 - 1), albedo[::-1].T, atol=1e-4)
+
+    # the albedo itself, rather than colors
+    export_dem((x, y, z, albedo), tmp_path / 'raw.r32', strip=6)
+    assert np.array_equal(_read_png16(tmp_path / 'raw_albedo.png'), image)
@@ -0,0 +1,110 @@
+import struct
+import zlib
+
+import numpy as np
+
+from moon_gen.lib.export import export_dem
+from moon_gen.lib.loaders import image_size, load_dem, load_image, png_rows
+
+
+def _surface():
+    x, y = np.linspace(-5, 5, 40), np.linspace(0, 3, 25)
+    return x, y, np.sin(x).reshape((-1, 1)) * np.cos(y)
+
+
+def _write_png(filename, image):
+    '''a 16-bit PNG, with each row using another filter type'''
+    raw = image.astype('>u2').view(np.uint8).astype(int)
+    rows, previous = [], np.zeros(raw.shape[1], int)
+    for r, row in enumerate(raw):
+        kind = r % 5
+        left = np.r_[0, 0, row[:-2]]
+        upper_left = np.r_[0, 0, previous[:-2]]
+        p = left + previous - upper_left
+        pa, pb, pc = abs(p - left), abs(p - previous), abs(p - upper_left)
+        paeth = np.where((pa <= pb) & (pa <= pc), left,
+                         np.where(pb <= pc, previous, upper_left))
+        predictor = [0, left, previous, (left + previous)//2, paeth][kind]
+        rows.append(bytes([kind]) + bytes(((row - predictor) % 256).tolist()))
+        previous = row
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + \
+            struct.pack('>I', zlib.crc32(kind + data))
+
+    with open(filename, 'wb') as file:
+        file.write(b'\x89PNG\r\n\x1a\n')
+        file.write(chunk(b'IHDR', struct.pack('>IIBBBBB', image.shape[1],
+                                              image.shape[0], 16, 0, 0, 0, 0)))
+        file.write(chunk(b'IDAT', zlib.compress(b''.join(rows))))
+        file.write(chunk(b'IEND', b''))
+
+
+def _write_tiff(filename, image):
+    '''an uncompressed, single-strip float32 TIFF'''
+    height, width = image.shape
+    entries = [(256, 4, 1, width), (257, 4, 1, height), (258, 3, 1, 32),
+               (259, 3, 1, 1), (273, 4, 1, 8), (277, 3, 1, 1),
+               (279, 4, 1, image.nbytes), (339, 3, 1, 3)]
+    with open(filename, 'wb') as file:
+        file.write(b'II' + struct.pack('<HI', 42, 8 + image.nbytes))
+        file.write(image.astype('<f4').tobytes())
+        file.write(struct.pack('<H', len(entries)))
+        for tag, kind, n, value in entries:
+            file.write(struct.pack('<HHI', tag, kind, n) +
+                       struct.pack('<H2x' if kind == 3 else '<I', value))
+        file.write(struct.pack('<I', 0))
+
+
+def test_load_exported_dems(tmp_path):
+    x, y, z = _surface()
+    for extension in ('.png', '.r32', '.npy'):
+        export_dem((x, y, z), tmp_path / f'dem{extension}')
+        lx, ly, lz = load_dem(tmp_path / f'dem{extension}')
+        assert np.allclose(lx, x) and np.allclose(ly, y)
+        assert np.allclose(lz, z, atol=1e-4), extension
+
+    # raw files are memory-mapped
+    _, _, lz = load_dem(tmp_path / 'dem.r32')
+    assert isinstance(lz.base, np.memmap)
+
+
+def test_load_filtered_png(tmp_path):
+    image = np.random.default_rng(0).integers(0, 2**16, (13, 9))
+    _write_png(tmp_path / 'filtered.png', image)
+    loaded, scale = load_image(tmp_path / 'filtered.png')
+    assert scale == 2**16 - 1
+    assert np.array_equal(loaded, image)
+
+    # decoded in blocks of rows, which don't align with the filters
+    _, _, rows = png_rows(tmp_path / 'filtered.png', block=3)
+    assert np.array_equal(np.stack(list(rows)), image)
+
+
+def test_load_tiff(tmp_path):
+    image = np.random.default_rng(0).random((12, 7)).astype(np.float32)
+    _write_tiff(tmp_path / 'dem.tif', image)
+    x, y, z = load_dem(tmp_path / 'dem.tif')
+    assert np.array_equal(z, image.T[::-1])
+    assert len(x) == 7 and len(y) == 12
+
+
+def test_load_decimated(tmp_path):
+    x, y, z = _surface()
+    export_dem((x, y, z), tmp_path / 'dem.png')
+    export_dem((x, y, z), tmp_path / 'dem.r32')
+
+    for filename in ('dem.png', 'dem.r32'):
+        _, _, box = load_dem(tmp_path / filename, max_size=10)
+        assert box.shape == (10, 7)
+        assert np.isclose(box[-1, 0], z[-4:, :4].mean(), atol=1e-4)
+
+        _, _, stride = load_dem(tmp_path / filename, 10, 'stride')
+        assert np.allclose(stride, z[::-1][::4, ::4][::-1], atol=1e-4)
+
+
+def test_image_size(tmp_path):
+    x, y, z = _surface()
+    for extension in ('.png', '.r32', '.npy'):
+        export_dem((x, y, z), tmp_path / f'dem{extension}')
+        assert image_size(tmp_path / f'dem{extension}') == (40, 25)
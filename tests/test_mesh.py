@@ -0,0 +1,77 @@
+import struct
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import numpy as np
+
+from moon_gen.lib.craters import crater_profile, make_crater
+from moon_gen.lib.mesh import decimate, export_mesh, terrain_lods
+
+
+@pytest.fixture
+def surface():
+    x = np.linspace(-8, 8, 65)
+    z = make_crater(x, x, np.zeros((65, 65)), 0.8, (2, -1),
+                    crater_profile(noise=0.))
+    return x, x, z
+
+
+def _rasterize(mesh, x):
+    '''the mesh, linearly interpolated on the grid `x` x `x`'''
+    vertices, triangles = mesh
+    z = np.full((len(x), len(x)), np.nan)
+    X, Y = np.meshgrid(x, x, indexing='ij')
+    for a, b, c in vertices[triangles]:
+        m = np.array([b[:2] - a[:2], c[:2] - a[:2]]).T
+        u, v = np.linalg.solve(m, np.stack((X.ravel() - a[0],
+                                            Y.ravel() - a[1])))
+        inside = ((u >= -1e-9) & (v >= -1e-9) &
+                  (u + v <= 1 + 1e-9)).reshape(X.shape)
+        z[inside] = (a[2] + u*(b[2] - a[2]) +
+                     v*(c[2] - a[2])).reshape(X.shape)[inside]
+    return z
+
+
+def test_decimate_is_bounded(surface):
+    x, y, z = surface
+    lods = terrain_lods(surface, 0.05, 0.01)
+    assert len(lods['collision'][1]) < len(lods['visual'][1]) < \
+        2*64**2 / 10, "flat regions should be coarsened"
+
+    for tolerance, mesh in zip((0.05, 0.01), lods.values()):
+        vertices, triangles = mesh
+        a, b, c = (vertices[triangles[:, k]] for k in range(3))
+        area = (b[:, 0] - a[:, 0])*(c[:, 1] - a[:, 1]) - \
+            (b[:, 1] - a[:, 1])*(c[:, 0] - a[:, 0])
+        assert np.all(area > 0), "triangles should face up"
+        assert np.isclose(area.sum()/2, 16**2), "no holes, no overlaps"
+        assert np.nanmax(np.abs(_rasterize(mesh, x) - z)) <= tolerance
+
+
+def test_decimate_resamples():
+    x, y = np.linspace(0, 1, 50), np.linspace(0, 2, 40)
+    vertices, _ = decimate((x, y, np.ones((50, 40))), 0.01)
+    assert len(vertices) == 5, "a flat surface is a single fan"
+    assert np.allclose(vertices.min(axis=0), [0, 0, 1])
+    assert np.allclose(vertices.max(axis=0), [1, 2, 1])
+
+
+def test_export_mesh(surface, tmp_path):
+    vertices, triangles = mesh = decimate(surface, 0.05)
+
+    export_mesh(mesh, tmp_path / 'terrain.stl')
+    data = open(tmp_path / 'terrain.stl', 'rb').read()
+    assert struct.unpack('<I', data[80:84])[0] == len(triangles)
+    assert len(data) == 84 + 50*len(triangles)
+
+    export_mesh(mesh, tmp_path / 'terrain.obj')
+    lines = open(tmp_path / 'terrain.obj').read().splitlines()
+    assert len(lines) == len(vertices) + len(triangles)
+
+    export_mesh(mesh, tmp_path / 'terrain.dae')
+    root = ET.parse(tmp_path / 'terrain.dae').getroot()
+    assert root.tag.endswith('COLLADA')
+
+    with pytest.raises(ValueError):
+        export_mesh(mesh, tmp_path / 'terrain.ply')
@@ -0,0 +1,100 @@
+import numpy as np
+
+from moon_gen.lib.catalog import CraterCatalog
+from moon_gen.lib.heightmaps import (
+    perlin, perlin_grid, perlin_multiscale_grid, perlin_multiscale_points,
+    octave_plan, surface_psd_nominal, gradient_index, GRADIENT_BITS
+)
+from moon_gen.lib.distributions import cash, crater_density_old
+from moon_gen.lib.procedural import (
+    ProceduralTerrain, height_at, height_grid
+)
+
+
+def test_perlin_points_match_grid():
+    x = np.linspace(-10, 10, 51) + 33.3
+    y = np.linspace(-7, 10, 40)
+    grid = perlin_multiscale_grid(x, y, 6, cycle=20., seed=5, plan=False)
+    points = perlin_multiscale_points(*np.meshgrid(x, y, indexing='ij'),
+                                      20., 6, seed=5)
+    assert np.allclose(grid, points)
+
+    # planned grids drop the octaves finer than the grid
+    planned = perlin_multiscale_grid(x, y, 6, cycle=20., seed=5)
+    assert not np.allclose(planned, points)
+
+
+def test_gradient_table():
+    x = np.linspace(-3, 3, 13) + 0.37
+    y = np.linspace(0, 4, 9)
+    grid = perlin_grid(x, y, seed=0)
+    assert np.isclose(perlin(x[3], y[5]), grid[3, 5]), \
+        "the scalar and vectorized noise should use the same gradients"
+
+    i, j = np.meshgrid(np.arange(-200, 200), np.arange(-200, 200))
+    counts = np.bincount(gradient_index(cash(i, j)).ravel())
+    assert len(counts) == 2**GRADIENT_BITS
+    assert counts.min() > 0.7*counts.mean()
+
+
+def test_octave_plan():
+    x = np.linspace(-10, 10, 257) + 33.3
+    y = np.linspace(-10, 10, 301)
+    plan = octave_plan(20., 20., 10, surface_psd_nominal, (20/256, 20/300))
+    assert len(plan) < 10, "sub-Nyquist octaves should be skipped"
+    assert plan[0][2] > (0, 0) and plan[-1][2] == (0, 0)
+
+    planned = perlin_multiscale_grid(x, y, 10, surface_psd_nominal, 20.,
+                                     seed=2)
+    exact = sum(w*perlin_grid(2*x/c, 2*y/c, 2) for c, w, _ in plan)
+    assert np.abs(planned - exact).max() < 0.02*exact.std()
+
+
+def test_height_at_matches_grid():
+    recipe = ProceduralTerrain()
+    x = np.linspace(-10, 10, 101)
+    y = np.linspace(-10, 10, 102)
+    z = height_grid(x, y, recipe, seed=1)
+    assert z.shape == (101, 102)
+
+    rng = np.random.default_rng(0)
+    i, j = rng.integers(0, 101, 500), rng.integers(0, 102, 500)
+    assert np.allclose(height_at(x[i], y[j], recipe, seed=1), z[i, j])
+
+    # chunking and far-away points do not change the result
+    xs = np.r_[x[i], rng.uniform(-1e4, 1e4, 10)]
+    ys = np.r_[y[j], rng.uniform(-1e4, 1e4, 10)]
+    assert np.allclose(height_at(xs, ys, recipe, seed=1, chunk=64)[:500],
+                       z[i, j])
+
+
+def test_height_at_does_not_depend_on_chunks():
+    # dense, overlapping craters, whose floors depend on older craters
+    recipe = ProceduralTerrain(
+        octaves=2, distribution=crater_density_old.truncated(d_min=0.3))
+    x = np.linspace(-10, 10, 41)
+    xs, ys = np.meshgrid(x, x, indexing='ij')
+    catalog = recipe.catalog((-10, 10), (-10, 10))
+    for lookup in (None, catalog):
+        z = height_at(xs, ys, recipe, catalog=lookup)
+        for chunk in (37, 400):
+            assert np.array_equal(
+                height_at(xs, ys, recipe, chunk=chunk, catalog=lookup), z)
+
+
+def test_height_at_has_craters():
+    recipe = ProceduralTerrain(octaves=0)
+    x = np.linspace(-10, 10, 101)
+    z = height_grid(x, x, recipe, seed=2)
+    assert z.min() < 0 < z.max(), "craters should carve bowls and rims"
+
+
+def test_height_at_from_catalog(tmp_path):
+    recipe = ProceduralTerrain()
+    x = np.linspace(-10, 10, 41)
+    catalog = recipe.catalog((-10, 10), (-10, 10), seed=3)
+    catalog.save(tmp_path / "craters.npy")
+    catalog = CraterCatalog.load(tmp_path / "craters.npy")
+
+    assert np.allclose(height_grid(x, x, recipe, seed=3),
+                       height_grid(x, x, recipe, seed=3, catalog=catalog))
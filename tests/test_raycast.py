@@ -0,0 +1,47 @@
+import numpy as np
+
+from moon_gen.lib.raycast import HeightfieldRaycaster, lidar_rays, max_mipmap
+from moon_gen.lib.sampling import HeightfieldSampler
+
+
+def test_max_mipmap():
+    z = np.random.default_rng(0).random((37, 20))
+    levels = max_mipmap(z)
+    assert levels[0].shape == (36, 19) and levels[-1].shape == (1, 1)
+    assert levels[-1][0, 0] == z.max()
+    assert levels[2][3, 1] == z[12:17, 4:9].max()
+
+
+def test_raycast_plane():
+    x = np.linspace(0, 10, 65)
+    y = np.linspace(-5, 5, 33)
+    z = 0.5*x.reshape((-1, 1)) + 0*y
+    raycaster = HeightfieldRaycaster((x, y, z))
+
+    t = raycaster.intersect([[1., 1.], [0., 0.], [10., 10.]],
+                            [[0., 1.], [0., 0.], [-1., -1.]])
+    # z = 10 - t meets z = 0.5*(1 + s*t)
+    assert np.allclose(t, [9.5, 9.5/1.5])
+    assert np.all(np.isinf(raycaster.intersect([[1.], [0.], [10.]],
+                                               [[0.], [0.], [1.]])))
+
+
+def test_raycast_first_hit():
+    rng = np.random.default_rng(0)
+    x, y = np.linspace(-10, 10, 129), np.linspace(-10, 10, 100)
+    z = rng.standard_normal((len(x), len(y)))
+    raycaster = HeightfieldRaycaster((x, y, z))
+    sampler = HeightfieldSampler((x, y, z))
+
+    origins, directions = lidar_rays((1., 2., 3.5), beams=8, azimuths=64)
+    points = raycaster.cast(origins, directions)
+    hit = ~np.isnan(points[0])
+    assert hit.sum() > 200
+    assert np.allclose(sampler(points[0, hit], points[1, hit]), points[2, hit])
+
+    # nothing is hit before the reported intersection
+    t = raycaster.intersect(origins, directions)[hit]
+    s = np.linspace(0, 1, 500, endpoint=False).reshape((-1, 1))
+    path = origins[:, hit, None] + directions[:, hit, None]*(t[:, None]*s.T)
+    above = path[2] - sampler(path[0], path[1])
+    assert np.all(above > -1e-9)
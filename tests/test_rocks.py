@@ -0,0 +1,95 @@
+import pytest
+
+import numpy as np
+
+from moon_gen.lib.catalog import CraterCatalog
+from moon_gen.lib.distributions import (
+    crater_density_young, rock_density_typical,
+)
+from moon_gen.lib.pipeline import (
+    CraterPopulation, Recipe, run_recipe, weathered_craters,
+)
+from moon_gen.lib.rocks import (
+    ROCK_DTYPE, RockField, export_instances, place_rocks, rockiness,
+)
+
+
+@pytest.fixture
+def craters():
+    return CraterCatalog.from_arrays(np.array([10., 8.]),
+                                     (np.array([30., -30.]),
+                                      np.array([30., -30.])),
+                                     np.array([0., 10.]))
+
+
+def test_rocks_are_procedural():
+    field = place_rocks((-50, 50), (-50, 50), seed=3)
+    assert field.rocks.dtype == ROCK_DTYPE
+    expected = rock_density_typical.density*100*100
+    assert abs(len(field) - expected) < 5*np.sqrt(expected)
+    assert np.all(field.rocks['height'] < field.rocks['diameter'])
+
+    # the rocks don't depend on the region which is queried
+    part = place_rocks((-10, 20), (0, 40), seed=3)
+    assert np.array_equal(np.sort(part.rocks, order=['x', 'y']),
+                          np.sort(field.in_box((-10, 20), (0, 40)),
+                                  order=['x', 'y']))
+    assert len(place_rocks((-50, 50), (-50, 50), seed=4)) != len(field)
+
+
+def test_rocks_near_fresh_craters(craters):
+    plain = place_rocks((-50, 50), (-50, 50))
+    rocky = place_rocks((-50, 50), (-50, 50), craters=craters)
+    # more rocks on the fresh crater, not on the old one nor elsewhere
+    assert len(rocky.query(30, 30, 10)) > 5*len(plain.query(30, 30, 10))
+    assert len(rocky.query(-30, -30, 8)) == len(plain.query(-30, -30, 8))
+    assert len(rocky.query(30, -30, 10)) == len(plain.query(30, -30, 10))
+
+
+def test_rockiness_matches_recipe_albedo():
+    # craters large enough to be stamped, so their albedo is exact
+    x = np.linspace(0, 64, 129)
+    albedo = np.zeros((129, 129))
+    recipe = CraterPopulation(crater_density_young, min_cells=8) + \
+        Recipe(weathered_craters(crater_density_young, epochs=3,
+                                 micro_noise=None).stages[1:])
+    _, catalog = run_recipe(recipe, x, x, seed=1, return_catalog=True,
+                            albedo=albedo)
+    assert len(np.unique(catalog.age)) == 3
+
+    gx, gy, weight = rockiness((0, 64), (0, 64), catalog, spacing=.5)
+    assert np.allclose(gx, x) and np.allclose(gy, x)
+    assert np.allclose(weight, albedo, atol=1e-6), \
+        "rocks and bright ejecta should weather alike"
+
+
+def test_queries(craters):
+    field = place_rocks((-50, 50), (-50, 50), craters=craters, bucket=3.)
+    rocks = field.rocks
+    for x, y, radius in ((0, 0, 5), (28.5, 31., 12.), (-49, 49, 4)):
+        near = field.query(x, y, radius)
+        brute = np.hypot(rocks['x'] - x, rocks['y'] - y) <= radius
+        assert len(near) == np.count_nonzero(brute)
+        assert np.array_equal(np.sort(near, order=['x', 'y']),
+                              np.sort(rocks[brute], order=['x', 'y']))
+    assert len(field.query(500, 500, 10)) == 0
+
+
+def test_save_and_export(tmp_path):
+    field = place_rocks((0, 20), (0, 20))
+    field.save(tmp_path / 'rocks.npy')
+    loaded = RockField.load(tmp_path / 'rocks.npy')
+    assert np.array_equal(loaded.rocks, field.rocks)
+    assert len(loaded.query(10, 10, 5)) == len(field.query(10, 10, 5))
+
+    x = y = np.linspace(0, 20, 41)
+    surface = (x, y, np.add.outer(x, y)/10)
+    instances = export_instances(field, tmp_path / 'rocks.csv', surface)
+    assert np.allclose(instances['z'], (instances['x'] + instances['y'])/10,
+                       atol=1e-4)
+    table = np.loadtxt(tmp_path / 'rocks.csv', delimiter=',', skiprows=1)
+    assert table.shape == (len(field), 7)
+    assert np.array_equal(table[:, 0], field.rocks['model'])
+
+    with pytest.raises(ValueError):
+        export_instances(field, tmp_path / 'rocks.obj')
@@ -0,0 +1,77 @@
+import pytest
+
+import numpy as np
+from scipy.ndimage import map_coordinates
+
+from moon_gen.lib.sampling import HeightfieldSampler, spline_coefficients
+
+
+@pytest.fixture
+def surface():
+    x = np.linspace(-5, 5, 101)
+    y = np.linspace(0, 20, 151)
+    X, Y = np.meshgrid(x, y, indexing='ij')
+    return x, y, np.sin(X)*np.cos(Y/3) + 0.1*X*Y
+
+
+@pytest.mark.parametrize('method, order', [('linear', 1), ('cubic', 3)])
+def test_sampler_matches_scipy(surface, method, order):
+    x, y, z = surface
+    rng = np.random.default_rng(0)
+    xs, ys = rng.uniform(-5, 5, 1000), rng.uniform(0, 20, 1000)
+
+    sampler = HeightfieldSampler(surface, method)
+    expected = map_coordinates(z, [(xs - x[0])/(x[1]-x[0]),
+                                   (ys - y[0])/(y[1]-y[0])],
+                               order=order, mode='mirror')
+    assert np.allclose(sampler(xs, ys), expected)
+
+    # the gradient is the derivative of the interpolant
+    h = 1e-6
+    dzdx, dzdy = sampler.gradient(xs, ys)
+    assert np.allclose(dzdx, (sampler(xs+h, ys) - sampler(xs-h, ys))/(2*h),
+                       atol=1e-5)
+    assert np.allclose(dzdy, (sampler(xs, ys+h) - sampler(xs, ys-h))/(2*h),
+                       atol=1e-5)
+
+
+def test_sampler_bounds(surface):
+    xs, ys = np.array([-6., 0.]), np.array([1., 1.])
+
+    z = HeightfieldSampler(surface, bounds='nan')(xs, ys)
+    assert np.isnan(z[0]) and not np.isnan(z[1])
+    clamped = HeightfieldSampler(surface, bounds='clamp')(xs, ys)
+    assert clamped[0] == HeightfieldSampler(surface)(-5., 1.)
+    with pytest.raises(ValueError):
+        HeightfieldSampler(surface, bounds='raise')(xs, ys)
+    with pytest.raises(ValueError):
+        HeightfieldSampler(surface, method='quintic')
+
+
+def test_sampler_memmap(surface, tmp_path):
+    x, y, z = surface
+    coefficients = np.lib.format.open_memmap(tmp_path / 'c.npy', 'w+',
+                                             np.float64, z.shape)
+    spline_coefficients(z, out=coefficients)
+
+    xs, ys = np.linspace(-4, 4, 50), np.linspace(1, 19, 50)
+    mapped = HeightfieldSampler(surface, 'cubic', coefficients=coefficients,
+                                batch=16)
+    assert np.allclose(mapped(xs, ys), HeightfieldSampler(surface,
+                                                          'cubic')(xs, ys))
+
+
+def test_cubic_wrap_is_periodic():
+    # a periodic surface, whose last samples repeat the first ones
+    x, y = np.linspace(0, 10, 41), np.linspace(0, 20, 61)
+    X, Y = np.meshgrid(x, y, indexing='ij')
+    z = np.sin(2*np.pi*X/10) + np.cos(2*np.pi*Y/20)
+    sampler = HeightfieldSampler((x, y, z), 'cubic', bounds='wrap')
+
+    # the interpolant is smooth across the seam
+    xs, ys = np.linspace(-1, 1, 51), np.full(51, 3.)
+    expected = np.sin(2*np.pi*xs/10) + np.cos(2*np.pi*ys/20)
+    assert np.allclose(sampler(xs, ys), expected, atol=1e-3)
+    assert np.allclose(sampler(xs + 10, ys), sampler(xs, ys))
+    assert np.allclose(sampler.gradient(xs, ys)[0],
+                       2*np.pi/10*np.cos(2*np.pi*xs/10), atol=1e-2)
@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+import numpy as np
+
+from moon_gen.lib.catalog import CraterCatalog
+from moon_gen.lib.store import TileStore, fill_store, save_surface
+
+
+def plane(x, y):
+    return np.add.outer(x, 2*y)
+
+
+@pytest.fixture
+def surface():
+    x, y = np.linspace(0, 10, 101), np.linspace(-5, 5, 70)
+    z = np.random.default_rng(0).normal(size=(101, 70))
+    return x, y, z, np.stack((z, -z, np.ones_like(z)), axis=-1)
+
+
+@pytest.mark.parametrize('compression', ('zlib', 'lzma', 'none'))
+def test_round_trip(surface, tmp_path, compression):
+    x, y, z, c = surface
+    catalog = CraterCatalog.from_arrays(np.ones(3), (np.zeros(3), np.ones(3)))
+    save_surface(surface, tmp_path / 'surface.mgs', chunk=32,
+                 compression=compression, catalog=catalog,
+                 metadata={'seed': 4})
+
+    store = TileStore(tmp_path / 'surface.mgs')
+    assert store.chunks == (4, 3)
+    assert store.metadata == {'seed': 4}
+    assert np.array_equal(store.catalog.craters, catalog.craters)
+    sx, sy, sz, sc = store.surface()
+    assert np.allclose(sx, x) and np.allclose(sy, y)
+    assert sz.shape == z.shape and sc.shape == c.shape
+    assert np.array_equal(np.asarray(sz), z.astype(np.float32))
+    assert np.array_equal(sz[30:70:3, 5], z[30:70:3, 5].astype(np.float32))
+    assert np.array_equal(sc[-1, 10:40], c[-1, 10:40].astype(np.float32))
+
+
+def test_windows_only_read_their_chunks(surface, tmp_path):
+    x, y, z, _ = surface
+    store = save_surface((x, y, z), tmp_path / 'surface.mgs', chunk=32)
+    os.remove(store._chunk_file('z', 3, 2))
+
+    # the missing chunk isn't needed for the window
+    assert np.array_equal(store['z'][:64, :64], z[:64, :64].astype(np.float32))
+    assert np.all(np.isnan(store['z'][96:, 64:]))
+
+    with open(store._chunk_file('z', 0, 0), 'wb') as file:
+        file.write(b'\x78\x9c\x03\x00\x00\x00\x00\x01')  # an empty stream
+    with pytest.raises(ValueError):
+        store['z'][0, 0]
+
+
+def test_write_windows(tmp_path):
+    x, y = np.arange(50.), np.arange(40.)
+    store = TileStore.create(tmp_path / 'surface.mgs', x, y, chunk=16)
+    z = store['z']
+    assert np.all(np.isnan(z[:, :]))
+    z[:, :] = 1.
+    z[10:20, 5:30] = plane(x[10:20], y[5:30])
+    z[3] = -1.
+    z[:, 39] = np.arange(50.)
+
+    expected = np.ones((50, 40))
+    expected[10:20, 5:30] = plane(x[10:20], y[5:30])
+    expected[3] = -1.
+    expected[:, 39] = np.arange(50.)
+    assert np.array_equal(np.asarray(z), expected)
+
+    with pytest.raises(ValueError):
+        z[::2, :] = 0.
+
+
+def test_fill_store(tmp_path):
+    x, y = np.linspace(0, 1, 70), np.linspace(0, 2, 90)
+    store = TileStore.create(tmp_path / 'surface.mgs', x, y, chunk=32)
+    store.write_chunk('z', 0, 0, np.zeros((32, 32)))
+    assert fill_store(store.path, plane, processes=2) == 3*3 - 1
+    assert fill_store(store.path, plane, processes=2) == 0
+
+    z = np.asarray(store['z'])
+    assert np.all(z[:32, :32] == 0)
+    assert np.allclose(z[32:], plane(x, y)[32:])
@@ -0,0 +1,48 @@
+import csv
+import functools
+
+import numpy as np
+
+from moon_gen.lib.craters import crater_density_young, crater_density_old
+from moon_gen.lib.sweep import parameter_grid, run_sweep
+from moon_gen.surfaces.full_1_random import parametric_surface
+
+
+def test_parameter_grid():
+    jobs = parameter_grid({'epochs': [1, 2, 3],
+                           'distribution': {'young': crater_density_young,
+                                            'old': crater_density_old}})
+    assert len(jobs) == 6
+    k, labels, params = jobs[1]
+    assert k == 1
+    assert labels == {'epochs': '1', 'distribution': 'old'}
+    assert params['distribution'] is crater_density_old
+
+
+def test_sweep_resume(tmp_path):
+    # large enough for noisy craters to be stamped
+    x = np.linspace(0, 64, 129)
+    target = functools.partial(parametric_surface, workers=2,
+                               return_catalog=True)
+    grid = {'epochs': [1, 2]}
+    rows = run_sweep(target, grid, x, x, tmp_path, processes=2)
+    assert [r['job'] for r in rows] == ['0', '1']
+    assert all(float(r['height_range']) > 0 for r in rows)
+    first = np.load(tmp_path / 'job_0001.npy')
+
+    # the recorded seed reproduces the job, whatever the global state
+    np.random.seed(None)
+    z, _ = target(x, x, seed=int(rows[1]['seed']), epochs=2)
+    assert np.array_equal(z.astype(np.float32), first)
+
+    # drop the last job, as if the sweep had been interrupted
+    with open(tmp_path / 'summary.csv', newline='') as file:
+        lines = list(csv.reader(file))
+    with open(tmp_path / 'summary.csv', 'w', newline='') as file:
+        csv.writer(file).writerows(
+            line for line in lines if line[0] != '1')
+
+    rows = run_sweep(target, grid, x, x, tmp_path, processes=2)
+    assert [r['job'] for r in rows] == ['0', '1']
+    assert np.array_equal(np.load(tmp_path / 'job_0001.npy'), first), \
+        "each job has its own seed"
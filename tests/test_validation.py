@@ -0,0 +1,45 @@
+import numpy as np
+
+from moon_gen.lib.distributions import (
+    PowerDistribution, surface_psd_nominal, surface_psd_rough,
+)
+from moon_gen.lib.heightmaps import perlin_multiscale_grid
+from moon_gen.lib.validation import (
+    compare_psd, crater_statistics, profile_psd, radial_psd,
+)
+
+
+def test_psd_normalization():
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 50, 501)
+    z = rng.normal(scale=.3, size=(501, 501))
+    dx = x[1] - x[0]
+
+    # white noise has a flat spectrum, whose integral is the variance
+    f, psd = profile_psd((x, x, z), tile=64)
+    assert np.isclose(psd.mean(), 2*.09*dx, rtol=.05)
+    f, psd = radial_psd((x, x, z), tile=64)
+    assert np.isclose(psd.mean(), .09*dx**2, rtol=.05)
+
+
+def test_perlin_psd_shape():
+    x = np.linspace(0, 30, 257)
+    z = perlin_multiscale_grid(x, x, octaves=7, psd=surface_psd_rough)
+    f, psd = profile_psd((x, x, z), tile=64)
+    _, error = compare_psd(f, psd, surface_psd_rough)
+    _, other = compare_psd(f, psd, surface_psd_nominal)
+    assert error < .15
+    assert error < other
+
+
+def test_crater_statistics():
+    distribution = PowerDistribution(2e-1, -2., d_min=.5, d_max=20.)
+    x = np.linspace(0, 200, 3)
+    _, _, d = distribution.sample(x, x, 1)
+    stats = crater_statistics(d, 200*200, distribution)
+    assert abs(stats['count_z']) < 4
+    assert stats['p_value'] > 1e-3
+
+    steeper = PowerDistribution(2e-1, -3., d_min=.5, d_max=20.)
+    _, _, d = steeper.sample(x, x, 1)
+    assert crater_statistics(d, 200*200, distribution)['p_value'] < 1e-3